@@ -0,0 +1,51 @@
+#!/usr/bin/python
+"""
+Micro-benchmark for the policy rule / mapping document join.
+
+Builds synthetic policies and mapping records of growing size and times
+extract_policy_rules_have_pci. With the indexed join the time per rule stays
+flat as the policy grows.
+
+    cd cis-pci_mapping/app
+    python benchmark/bench_mapping_join.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../'))
+
+from cispcimapping import config_helper  # noqa: E402
+from cispcimapping import halo_api_caller  # noqa: E402
+from cispcimapping import mapping_index  # noqa: E402
+
+POLICY_SIZES = [500, 1000, 2000, 4000, 8000, 16000]
+REPEAT = 5
+
+
+def build_policy(rule_count):
+    rules = [{'cp_rule_id': 'CIS:Bench:%d' % i, 'name': 'Rule %d' % i} for i in range(rule_count)]
+    return {'policy': {'name': 'Bench', 'rules': rules}}
+
+
+def build_fltrd_info_lst(rule_count):
+    # Every other rule has a mapping, plus as many unmatched rows again.
+    return [['CIS:Bench:%d' % i, '2.2', 'Title', 'Description'] for i in range(0, rule_count * 2, 2)]
+
+
+def main():
+    halo_api_caller_obj = halo_api_caller.HaloAPICaller(config_helper.ConfigHelper())
+    print("%10s %12s %14s" % ("rules", "best (ms)", "per rule (us)"))
+    for rule_count in POLICY_SIZES:
+        mapping_idx = mapping_index.MappingIndex(build_fltrd_info_lst(rule_count))
+
+        def run():
+            halo_api_caller_obj.extract_policy_rules_have_pci((build_policy(rule_count), False), mapping_idx)
+
+        setup_time = min(timeit.repeat(lambda: build_policy(rule_count), number=1, repeat=REPEAT))
+        best = min(timeit.repeat(run, number=1, repeat=REPEAT)) - setup_time
+        print("%10d %12.2f %14.3f" % (rule_count, best * 1000, best * 1e6 / rule_count))
+
+
+if __name__ == "__main__":
+    main()
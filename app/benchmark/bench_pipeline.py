@@ -0,0 +1,209 @@
+#!/usr/bin/python
+"""
+End-to-end benchmark of the mapping pipeline against the local fake Halo API.
+
+Starts test/fake_halo_api.py with a synthetic source policy, runs the full
+runner.main pipeline against it for growing policy sizes, and reports wall
+time, Halo API requests, bytes received/sent and peak traced memory for every
+stage of the pipeline.
+
+    cd cis-pci_mapping/app
+    python benchmark/bench_pipeline.py
+    python benchmark/bench_pipeline.py --rules 10,1000,50000 --latency 0.05 --fault-rate 0.02
+    python benchmark/bench_pipeline.py --rules 50000 --stream
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')
+sys.path.append(app_dir)
+sys.path.append(os.path.join(app_dir, 'test'))
+
+import fake_halo_api  # noqa: E402
+import runner  # noqa: E402
+from cispcimapping import config_helper  # noqa: E402
+from cispcimapping import excel_handler  # noqa: E402
+from cispcimapping import frameworks  # noqa: E402
+from cispcimapping import halo_api_caller  # noqa: E402
+
+POLICY_SIZES = [10, 1000, 10000, 50000]
+POLICY_NAME = "Synthetic CIS Benchmark Policy"
+
+# (stage, owner, attribute): the pipeline stages of runner.main, in order.
+STAGES = [
+    ('auth', halo_api_caller.HaloAPICaller, 'authenticate_client'),
+    ('policy_list', halo_api_caller.HaloAPICaller, 'find_configuration_policy_id'),
+    ('policy_details', halo_api_caller.HaloAPICaller, 'get_configuration_policy_details'),
+    ('policy_details', halo_api_caller.HaloAPICaller, 'map_configuration_policy_details'),
+    ('mapping_sheet', runner, 'load_mapping_indexes'),
+    ('map_publish', runner, 'map_and_create_policy'),
+]
+
+
+class StageRecorder(object):
+    """
+    Measures the pipeline stages by wrapping the functions running them.
+
+    A stage spans from the first call entering one of its functions to the last
+    call leaving it, so concurrent calls (the mapping types published in
+    parallel) count once. The Halo API traffic of a stage is the difference of
+    the fake server counters over that span.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.lock = threading.Lock()
+        self.active = {}
+        self.started = {}
+        self.stages = {}
+        self.patched = []
+
+    def wrap(self, stage, owner, attribute):
+        function = getattr(owner, attribute)
+        recorder = self
+
+        def wrapper(*args, **kwargs):
+            recorder.enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.leave(stage)
+
+        self.patched.append((owner, attribute, function))
+        setattr(owner, attribute, wrapper)
+
+    def restore(self):
+        for owner, attribute, function in reversed(self.patched):
+            setattr(owner, attribute, function)
+        self.patched = []
+
+    def enter(self, stage):
+        with self.lock:
+            self.active[stage] = self.active.get(stage, 0) + 1
+            if self.active[stage] > 1:
+                return
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self.started[stage] = (time.perf_counter(), self.server.totals(), tracemalloc.get_traced_memory()[0])
+
+    def leave(self, stage):
+        with self.lock:
+            self.active[stage] -= 1
+            if self.active[stage]:
+                return
+            start, totals, memory = self.started.pop(stage)
+            end_totals = self.server.totals()
+            stats = self.stages.setdefault(stage, {'seconds': 0.0, 'requests': 0, 'bytes_in': 0, 'bytes_out': 0,
+                                                   'peak_memory': 0})
+            stats['seconds'] += time.perf_counter() - start
+            for key in ('requests', 'bytes_in', 'bytes_out'):
+                stats[key] += end_totals[key] - totals[key]
+            stats['peak_memory'] = max(stats['peak_memory'], tracemalloc.get_traced_memory()[1] - memory)
+
+
+def mapping_rule_ids():
+    """Returns the CP Rule IDs of the mapping document, so about half of the synthetic rules are mapped."""
+    config = config_helper.ConfigHelper()
+    records = excel_handler.ExcelHandler().load_mapping_records(
+        runner.get_mapping_file_path(config), config.sheet_name, frameworks.names(),
+        config.excel_engine_type)
+    return sorted(set(record[0] for fltrd_info_lst in records.values() for record in fltrd_info_lst))
+
+
+def run_pipeline(server, rule_count, rule_ids, mapping_types, warm_cache, filler_policies=0, stream=False):
+    server.policies.clear()
+    server.stats.clear()
+    for i in range(filler_policies):
+        server.add_policy("Filler Policy %d" % i, [])
+    server.add_synthetic_policy(POLICY_NAME, rule_count, rule_ids)
+    cache_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.environ.update({'HALO_API_HOSTNAME': server.base_url,
+                       'HALO_API_PORT': str(server.server_port),
+                       'HALO_API_KEY_ID': 'bench',
+                       'HALO_API_KEY_SECRET': 'bench',
+                       'TARGET_POLICY_NAME': POLICY_NAME,
+                       'MAPPING_TYPE': mapping_types,
+                       'MAPPING_CACHE_DIR': cache_dir,
+                       'HALO_API_STREAM_POLICY_DETAILS': 'true' if stream else 'false',
+                       'INCREMENTAL_MODE': 'false'})
+    recorder = StageRecorder(server)
+    for stage, owner, attribute in STAGES:
+        recorder.wrap(stage, owner, attribute)
+    log = io.StringIO()
+    failed = False
+    try:
+        if warm_cache:
+            with contextlib.redirect_stdout(log):
+                runner.load_mapping_records(config_helper.ConfigHelper(), config_helper.ConfigHelper().mapping_types)
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(log):
+                runner.main()
+        except SystemExit:
+            failed = True
+        total_seconds = time.perf_counter() - start
+        total_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        recorder.restore()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    if failed:
+        sys.stderr.write(log.getvalue())
+    return recorder.stages, total_seconds, total_peak, failed
+
+
+def print_report(rule_count, stages, total_seconds, total_peak, server, failed):
+    print("\n%d rules%s" % (rule_count, " (FAILED)" if failed else ""))
+    print("%-16s %10s %9s %12s %12s %12s" % ("stage", "wall (ms)", "requests", "recv (KiB)", "sent (KiB)",
+                                            "peak (KiB)"))
+    for stage in sorted(stages, key=lambda name: [entry[0] for entry in STAGES].index(name)):
+        stats = stages[stage]
+        print("%-16s %10.1f %9d %12.1f %12.1f %12.1f" % (
+            stage, stats['seconds'] * 1000, stats['requests'], stats['bytes_out'] / 1024.0,
+            stats['bytes_in'] / 1024.0, stats['peak_memory'] / 1024.0))
+    totals = server.totals()
+    print("%-16s %10.1f %9d %12.1f %12.1f %12.1f" % (
+        "total", total_seconds * 1000, totals['requests'], totals['bytes_out'] / 1024.0, totals['bytes_in'] / 1024.0,
+        total_peak / 1024.0))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the mapping pipeline against a local fake Halo API.")
+    parser.add_argument('--rules', default=",".join(str(size) for size in POLICY_SIZES),
+                        help="comma separated synthetic policy sizes")
+    parser.add_argument('--mapping-types', default="PCI,HIPAA,NIST")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every fake API response")
+    parser.add_argument('--max-per-page', type=int, default=100, help="page size limit of the fake policy list")
+    parser.add_argument('--filler-policies', type=int, default=0,
+                        help="extra policies listed before the source policy")
+    parser.add_argument('--fault-rate', type=float, default=0.0,
+                        help="probability of a 503 answer to any fake API request")
+    parser.add_argument('--stream', action='store_true', help="stream the policy details through the mapping join")
+    parser.add_argument('--warm-cache', action='store_true', help="compile the mapping cache before every run")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    rule_ids = mapping_rule_ids()
+    fault_rates = {503: args.fault_rate} if args.fault_rate else None
+    with fake_halo_api.FakeHaloAPI(latency=args.latency, max_per_page=args.max_per_page,
+                                   fault_rates=fault_rates) as server:
+        for rule_count in [int(size) for size in args.rules.split(",")]:
+            stages, total_seconds, total_peak, failed = run_pipeline(server, rule_count, rule_ids, args.mapping_types,
+                                                                     args.warm_cache, args.filler_policies,
+                                                                     args.stream)
+            print_report(rule_count, stages, total_seconds, total_peak, server, failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+"""
+Startup-time benchmark of the cispcimapping package and the runner.
+
+Runs ``python -X importtime`` in fresh interpreters for each target and
+reports the median cumulative import time of the target, of the package
+modules and of the heavy third party dependencies (pandas, openpyxl) when
+they get imported. The heavy dependencies are loaded lazily, on the code
+paths needing them, so they should not show up for the package import nor
+for ``runner.py --help``.
+
+    cd cis-pci_mapping/app
+    python benchmark/bench_startup.py
+    python benchmark/bench_startup.py --repeat 10 --top 15
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+app_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../'))
+
+HEAVY_MODULES = ['pandas', 'openpyxl', 'cloudpassage', 'numpy']
+
+# Target name -> python code run under -X importtime
+TARGETS = [
+    ('import cispcimapping', "import cispcimapping"),
+    ('runner.py --help', "import sys; sys.argv = ['runner.py', '--help']; import runner\n"
+                         "try:\n    runner.parse_args()\nexcept SystemExit:\n    pass"),
+    ('ExcelHandler.read_from_excel', "import cispcimapping; import pandas"),
+]
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def run_importtime(code):
+    """
+    Runs code in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict module name -> (cumulative us, import depth), depth 0 for the modules imported by code itself
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=app_dir,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    modules = {}
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(2)), (len(match.group(3)) - 1) // 2)
+    return modules
+
+
+def measure(code, repeat):
+    """
+    Returns:
+        (dict module name -> median cumulative import time in ms over repeat runs, median total import time in ms)
+    """
+    runs = [run_importtime(code) for _ in range(repeat)]
+    names = set()
+    for modules in runs:
+        names.update(modules)
+    medians = dict((name, statistics.median([modules[name][0] for modules in runs if name in modules]) / 1000.0)
+                   for name in names)
+    total = statistics.median([sum(us for us, depth in modules.values() if depth == 0) for modules in runs]) / 1000.0
+    return medians, total
+
+
+def print_report(target, modules, total, top):
+    package = dict((name, ms) for name, ms in modules.items() if name.startswith('cispcimapping'))
+    print("%s: %.1f ms total imports" % (target, total))
+    heavy = ["%s %.1f ms" % (name, modules[name]) for name in HEAVY_MODULES if name in modules]
+    print("    heavy dependencies: %s" % (", ".join(heavy) or "none"))
+    for name, ms in sorted(package.items(), key=lambda item: -item[1])[:top]:
+        print("    %-45s %8.1f ms" % (name, ms))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the package and the runner.")
+    parser.add_argument('--repeat', type=int, default=5, help="interpreter runs per target, the median is kept")
+    parser.add_argument('--top', type=int, default=10, help="package modules listed per target")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    for target, code in TARGETS:
+        modules, total = measure(code, args.repeat)
+        print_report(target, modules, total, args.top)
+
+
+if __name__ == "__main__":
+    main()
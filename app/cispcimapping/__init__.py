@@ -1,10 +1,30 @@
+from .bulk_mapper import BulkMapper
 from .config_helper import ConfigHelper
+from .coverage_index import CoverageIndex
 from .custom_enum import Module
 from .custom_enum import Platform
 from .custom_enum import Status
 from .custom_enum import TargetType
 from .excel_handler import ExcelHandler
+from .frameworks import Framework
 from .halo_api_caller import HaloAPICaller
+from .job_journal import JobJournal
+from .mapping_cache import MappingCache
+from .mapping_index import MappingIndex
+from .mapping_index import MappingRecord
+from .mapping_index import MappingTable
+from .mapping_ingest import MappingIngestor
+from .mapping_service import MappingService
+from .mapping_service import MappingServiceServer
+from .mapping_state import MappingState
+from .offline_mapper import OfflineMapper
+from .metrics import Metrics
+from .policy_publisher import PolicyPublisher
+from .rate_limiter import RateLimiter
+from .response_cache import ResponseCache
+from .sheet_validator import SheetValidator
+from .tenant_fanout import TenantFanout
+from .token_manager import TokenManager
 from .utility import Utility
 
 
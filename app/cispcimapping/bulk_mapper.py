@@ -0,0 +1,187 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from . import policy_publisher
+from . import utility
+
+ACTION_MESSAGES = {
+    'created': "Generated Successfully",
+    'updated': "Updated Successfully",
+    'unchanged': "Unchanged, skipped",
+    'resumed': "Already published by the interrupted run, skipped",
+}
+
+
+class BulkMapper(object):
+    """
+    Maps many source configuration policies concurrently.
+
+    Every selected source policy is handled by one worker of a bounded thread
+    pool: the worker fetches the policy details, builds one derived policy per
+    mapping type and publishes them (concurrently, see
+    PolicyPublisher.publish_many). The Halo API request rate is bounded by
+    the rate limiter of the HaloAPICaller HTTP session, shared by all workers.
+    Several bulk mappers (i.e. one per tenant) can share ``slots`` to bound
+    the number of source policies mapped concurrently across all of them.
+    With a job journal, every (source policy, mapping type) outcome is
+    committed once published, and the units already done by an interrupted
+    run of the same job are skipped.
+
+    Attributes:
+        halo_api_caller (HaloAPICaller): Authenticated Halo API caller
+        mapping_idxs (dict): Mapping type -> MappingIndex
+        workers (int): Number of source policies mapped concurrently
+        policy_publisher (PolicyPublisher): Creates, updates or skips the derived policies
+        slots (threading.Semaphore): Shared cap on the source policies mapped concurrently, None for no cap
+        journal (JournaledJob): Journal of the units of the job, None to map every unit
+    """
+
+    def __init__(self, halo_api_caller, mapping_idxs, workers=4, policy_publisher_obj=None, slots=None,
+                 journal=None):
+        self.halo_api_caller = halo_api_caller
+        self.mapping_idxs = mapping_idxs
+        self.workers = max(1, int(workers))
+        self.policy_publisher = policy_publisher_obj or policy_publisher.PolicyPublisher(halo_api_caller)
+        self.slots = slots
+        self.journal = journal
+
+    def select_policies(self, policy_names=None, policy_pattern=None):
+        """
+        Selects the source policies by name or ID, and/or by a regular expression over the policy names.
+
+        Returns:
+            (selected policies as (policy id, policy name) tuples, names or IDs not found)
+
+        Raises:
+            RuntimeError: A page of the policy list could not be retrieved, so the selection would be incomplete
+        """
+        wanted = list(policy_names or [])
+        regex = re.compile(policy_pattern) if policy_pattern else None
+        selected = []
+        found = set()
+        for (page, auth_error) in self.halo_api_caller.iter_configuration_policy_pages():
+            if page is None:
+                raise RuntimeError("Failed to retrieve the configuration policy list%s" % (
+                    " (authentication error)" if auth_error else ""))
+            for policy in page.get('policies', []):
+                matched = False
+                for wanted_item in wanted:
+                    if wanted_item not in found and wanted_item in (policy['name'], policy['id']):
+                        found.add(wanted_item)
+                        matched = True
+                if regex is not None and regex.search(policy['name']):
+                    matched = True
+                if matched:
+                    selected.append((policy['id'], policy['name']))
+        missing = [wanted_item for wanted_item in wanted if wanted_item not in found]
+        return selected, missing
+
+    def map_policy(self, policy_id, policy_name):
+        """
+        Maps one source policy to every mapping type, or to the mapping types not done yet by the journaled job.
+
+        Returns:
+            list of result dicts, one per mapping type
+        """
+        done_units = self.journal.done_units(policy_id) if self.journal is not None else {}
+        mapping_idxs = dict((mapping_type, mapping_idx) for mapping_type, mapping_idx in self.mapping_idxs.items()
+                            if mapping_type not in done_units)
+        results = dict((mapping_type, self.result(policy_id, policy_name, mapping_type, {
+            'action': 'resumed', 'policy': unit, 'parts': [{'policy': {'id': part_id}} for part_id in unit['parts']]}))
+            for mapping_type, unit in done_units.items() if mapping_type in self.mapping_idxs)
+        if mapping_idxs:
+            for result in self.map_mapping_types(policy_id, policy_name, mapping_idxs):
+                if self.journal is not None:
+                    self.journal.record(result)
+                results[result['mapping_type']] = result
+        return [results[mapping_type] for mapping_type in self.mapping_idxs]
+
+    def map_mapping_types(self, policy_id, policy_name, mapping_idxs):
+        """
+        Fetches one source policy and maps it to the given mapping types.
+
+        Returns:
+            list of result dicts, one per mapping type
+        """
+        results = []
+        metrics = self.halo_api_caller.metrics
+        csm_plc_det = None
+        mapped_policies = {}
+        with metrics.span("stage", stage="policy_details"):
+            if self.halo_api_caller.halo_api_stream_policy_details:
+                mapped_policies = self.halo_api_caller.map_configuration_policy_details(policy_id, mapping_idxs)[0]
+                retrieved = mapped_policies is not None
+            else:
+                csm_plc_det = self.halo_api_caller.get_configuration_policy_details(policy_id)
+                retrieved = csm_plc_det[0] is not None
+        if not retrieved:
+            for mapping_type in mapping_idxs:
+                results.append(self.result(policy_id, policy_name, mapping_type, error="policy details not retrieved"))
+            return results
+        items = []
+        rule_keys = None
+        if csm_plc_det is not None:
+            rule_keys = self.halo_api_caller.policy_rule_keys(csm_plc_det[0])
+        for mapping_type, mapping_idx in mapping_idxs.items():
+            try:
+                mapped_policy = mapped_policies.get(mapping_type)
+                if mapped_policy is None:
+                    with metrics.span("stage", stage="filter", mapping_type=mapping_type):
+                        mapped_policy = self.halo_api_caller.extract_policy_rules(csm_plc_det, mapping_type,
+                                                                                  mapping_idx, rule_keys)
+            except Exception as e:
+                results.append(self.result(policy_id, policy_name, mapping_type, error=str(e)))
+                continue
+            items.append((policy_id, mapping_type, mapped_policy))
+        for (_, mapping_type, _), outcome in zip(items, self.policy_publisher.publish_many(items)):
+            results.append(self.result(policy_id, policy_name, mapping_type, outcome))
+        return results
+
+    def run(self, policies):
+        """
+        Maps the given (policy id, policy name) tuples concurrently.
+
+        Returns:
+            list of result dicts, one per (source policy, mapping type)
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.map_policy_in_slot, policy_id, policy_name)
+                       for (policy_id, policy_name) in policies]
+            for future in futures:
+                for result in future.result():
+                    self.log_result(result)
+                    results.append(result)
+        return results
+
+    def map_policy_in_slot(self, policy_id, policy_name):
+        if self.slots is None:
+            return self.map_policy(policy_id, policy_name)
+        with self.slots:
+            return self.map_policy(policy_id, policy_name)
+
+    @classmethod
+    def result(cls, policy_id, policy_name, mapping_type, outcome=None, error=None):
+        outcome = outcome or {}
+        error = error or outcome.get('error')
+        generated_policy = outcome.get('policy') or {}
+        return {'policy_id': policy_id,
+                'policy_name': policy_name,
+                'mapping_type': mapping_type,
+                'status': 'failed' if error else 'success',
+                'action': outcome.get('action'),
+                'changed_rules': outcome.get('changed_rules'),
+                'generated_policy_id': generated_policy.get('id'),
+                'generated_policy_name': generated_policy.get('name'),
+                'generated_policy_parts': [part['policy'].get('id') for part in outcome.get('parts') or []],
+                'error': error}
+
+    @classmethod
+    def log_result(cls, result):
+        if result['status'] == 'success':
+            utility.Utility.log_stdout("[%s] %s: Configuration Policy [%s] %s" % (
+                result['policy_name'], result['mapping_type'], result['generated_policy_name'],
+                ACTION_MESSAGES[result['action']]))
+        else:
+            utility.Utility.log_stderr("[%s] %s: Mapping failed: %s" % (
+                result['policy_name'], result['mapping_type'], result['error']))
@@ -1,5 +1,6 @@
 import os
 
+from . import frameworks
 from .utility import Utility
 
 
@@ -16,9 +17,71 @@ class ConfigHelper(object):
         halo_api_auth_url (str): Halo API authentication URL
         halo_api_auth_args (str): Halo API authentication arguments (grant_type)
         halo_api_auth_token (str): Halo API authentication token
+        halo_api_token_refresh_margin (str): Seconds before expiry at which the Halo API token is refreshed
+        halo_api_token_default_lifetime (str): Lifetime of a Halo API token issued without an expires_in
+        halo_api_token_failure_backoff (str): Seconds during which a failed Halo API token request is not retried
+        halo_api_pool_size (str): Number of keep-alive connections kept open to the Halo API
+        halo_api_connect_timeout (str): Seconds to wait for a connection to the Halo API
+        halo_api_read_timeout (str): Seconds to wait for a Halo API response
+        halo_api_per_page (str): Page size used when listing Halo API resources
+        halo_api_rate_limit (str): Maximum number of Halo API requests per second, 0 for no limit
+        halo_api_retries (str): Number of retries of a failed Halo API request
+        halo_api_backoff_factor (str): Seconds of backoff before the first retry, doubled for each following retry
+        halo_api_backoff_max (str): Maximum seconds of backoff between two retries
+        halo_api_server_name_filter (bool): Ask the Halo API to filter the policy list by name
+        halo_api_stream_policy_details (bool): Parse the policy details while they are received, keeping only the
+            mapped rules
+        halo_api_gzip_requests (bool): gzip-compress the policy creation/update request bodies
+        halo_api_max_payload_bytes (str): Largest policy request body, larger derived policies are split into
+            several policies; 0 for no limit
+        halo_api_cache_enabled (bool): Cache the Halo API GET responses on disk and revalidate them (ETag,
+            Last-Modified)
+        halo_api_cache_dir (str): Directory of the Halo API response cache
+        halo_api_cache_ttl (str): Seconds during which a cached response is used without revalidation
+        halo_api_cache_max_bytes (str): Size above which the least recently used cached responses are evicted
+        halo_api_cache_purge (bool): Empty the Halo API response cache at the start of the run
         target_policy_name (str): Name of the policy which its' rules will be mapped from CIS to PCI
+        target_policy_names (list): Names or IDs of the policies mapped in bulk mode
+        target_policy_pattern (str): Regular expression matching the names of the policies mapped in bulk mode
+        bulk_workers (str): Number of policies mapped concurrently in bulk mode
+        publish_workers (str): Number of derived policies of a source policy published concurrently
+        tenant_manifest (str): JSON manifest of the tenants (credentials, policies, mapping types) of the fanout
+            command
+        fanout_tenants (str): Number of tenants mapped concurrently by the fanout command
+        fanout_workers (str): Number of policies mapped concurrently across all tenants by the fanout command, a
+            tenant mapping up to bulk_workers (or its manifest 'workers') of them
+        fanout_summary_file (str): JSON file receiving the per tenant results of the fanout command
         mapping_file_name (str): Name of the document/sheet which contains the mapping rules
-        mapping_type (str): Target Mapping Type (PCI, HIPAA, NIST)
+        sheet_names (list): Sheets parsed in each mapping workbook in multi-workbook mode, from the comma separated
+            SHEET_NAME
+        mapping_files (str): Comma separated mapping workbooks, directories or glob patterns loaded together
+            (multi-workbook mode), relative to the app directory
+        mapping_ingest_workers (str): Number of processes parsing the mapping workbooks, 0 for one per CPU
+        frameworks_file (str): JSON file of framework definitions registered next to the built-in ones
+        mapping_type (str): Target Mapping Type (PCI, HIPAA, NIST, ISO27001, SOC2, CISV8 or one of frameworks_file),
+            or a comma separated list of them
+        mapping_types (list): Target Mapping Types parsed from mapping_type, i.e. ['PCI', 'NIST']
+        mapping_cache_enabled (bool): Use the on-disk cache of the parsed mapping document
+        mapping_cache_dir (str): Directory of the on-disk cache of the parsed mapping document
+        mapping_validation_report (str): JSON report of the mapping sheet validation issues, written by compile-cache
+        incremental_mode (bool): Update or skip the policies generated by previous runs instead of creating new ones
+        mapping_state_file (str): File recording the policies generated by previous runs (incremental mode)
+        job_journal_enabled (bool): Journal the units of the bulk and fanout runs, always on when job_resume is set
+        job_journal_file (str): SQLite job journal of the bulk and fanout runs
+        job_id (str): ID of the journaled job, derived from the policy selection (or the tenant manifest) when empty
+        job_resume (bool): Resume the journaled job when its previous run did not complete, instead of restarting it;
+            off by default, as the resumed units are not mapped again even if their source policy or the mapping sheet
+            changed since
+        dry_run_input (str): Saved policy details JSON file, or directory of them, mapped by the dry-run command
+        dry_run_output_dir (str): Directory receiving the derived policies, rule diff and coverage of the dry run
+        service_host (str): Address the mapping service listens on
+        service_port (str): Port the mapping service listens on
+        service_workers (str): Number of mapping jobs run concurrently by the mapping service
+        service_queue_size (str): Maximum number of mapping jobs waiting in the mapping service queue
+        service_schedule_interval (str): Seconds between two scheduled mapping jobs, 0 to disable the schedule
+        metrics_enabled (bool): Record per stage and per HTTP call timings and counters
+        metrics_json_log (str): File receiving the metrics as JSON lines, "-" for stdout
+        metrics_textfile (str): Prometheus textfile written with the metrics at the end of a run
     """
 
     def __init__(self):
@@ -30,28 +93,118 @@ class ConfigHelper(object):
         self.halo_api_auth_url = "oauth/access_token"
         self.halo_api_auth_args = {'grant_type': 'client_credentials'}
         self.halo_api_auth_token = None
+        self.halo_api_token_refresh_margin = os.getenv("HALO_API_TOKEN_REFRESH_MARGIN", "60")
+        self.halo_api_token_default_lifetime = os.getenv("HALO_API_TOKEN_DEFAULT_LIFETIME", "900")
+        self.halo_api_token_failure_backoff = os.getenv("HALO_API_TOKEN_FAILURE_BACKOFF", "5")
+        self.halo_api_pool_size = os.getenv("HALO_API_POOL_SIZE", "10")
+        self.halo_api_connect_timeout = os.getenv("HALO_API_CONNECT_TIMEOUT", "10")
+        self.halo_api_read_timeout = os.getenv("HALO_API_READ_TIMEOUT", "60")
+        self.halo_api_per_page = os.getenv("HALO_API_PER_PAGE", "100")
+        self.halo_api_rate_limit = os.getenv("HALO_API_RATE_LIMIT", "0")
+        self.halo_api_retries = os.getenv("HALO_API_RETRIES", "3")
+        self.halo_api_backoff_factor = os.getenv("HALO_API_BACKOFF_FACTOR", "0.5")
+        self.halo_api_backoff_max = os.getenv("HALO_API_BACKOFF_MAX", "30")
+        self.halo_api_server_name_filter = os.getenv("HALO_API_SERVER_NAME_FILTER", "false").lower() in (
+            "true", "1", "yes")
+        self.halo_api_stream_policy_details = os.getenv("HALO_API_STREAM_POLICY_DETAILS", "false").lower() in (
+            "true", "1", "yes")
+        self.halo_api_gzip_requests = os.getenv("HALO_API_GZIP_REQUESTS", "false").lower() in ("true", "1", "yes")
+        self.halo_api_max_payload_bytes = os.getenv("HALO_API_MAX_PAYLOAD_BYTES", "0")
         self.target_policy_name = os.getenv("TARGET_POLICY_NAME", "HARDSTOP")
         self.target_policy_id = os.getenv("TARGET_POLICY_ID", "")
+        self.target_policy_names = [name.strip() for name in os.getenv("TARGET_POLICY_NAMES", "").split(",")
+                                    if name.strip()]
+        self.target_policy_pattern = os.getenv("TARGET_POLICY_PATTERN", "")
+        self.bulk_workers = os.getenv("BULK_WORKERS", "4")
+        self.publish_workers = os.getenv("PUBLISH_WORKERS", "3")
+        self.tenant_manifest = os.getenv("TENANT_MANIFEST", "")
+        self.fanout_tenants = os.getenv("FANOUT_TENANTS", "4")
+        self.fanout_workers = os.getenv("FANOUT_WORKERS", "16")
+        self.fanout_summary_file = os.getenv("FANOUT_SUMMARY_FILE", "fanout_summary.json")
         self.mapping_file_name =  os.getenv("MAPPING_FILE_NAME", "Ubuntu-CIS-Control-PCD-DSS-mapping.xlsx")
         self.sheet_name = os.getenv("SHEET_NAME", "Sheet2")
+        self.sheet_names = [name.strip() for name in self.sheet_name.split(",") if name.strip()]
+        self.mapping_files = os.getenv("MAPPING_FILES", "")
+        self.mapping_ingest_workers = os.getenv("MAPPING_INGEST_WORKERS", "0")
         self.excel_engine_type = "openpyxl"
+        self.frameworks_file = os.getenv("FRAMEWORKS_FILE", "")
+        if self.frameworks_file:
+            frameworks.load_definitions(self.frameworks_file)
         self.mapping_type = os.getenv("MAPPING_TYPE", "PCI")
+        self.mapping_types = self.parse_mapping_types(self.mapping_type)
+        self.mapping_cache_enabled = os.getenv("MAPPING_CACHE_ENABLED", "true").lower() not in ("false", "0", "no")
+        self.mapping_cache_dir = os.getenv("MAPPING_CACHE_DIR",
+                                           os.path.join(os.path.expanduser("~"), ".cache", "cis-pci_mapping"))
+        self.mapping_validation_report = os.getenv("MAPPING_VALIDATION_REPORT",
+                                                   os.path.join(self.mapping_cache_dir, "mapping_validation.json"))
+        self.halo_api_cache_enabled = os.getenv("HALO_API_CACHE_ENABLED", "true").lower() not in ("false", "0", "no")
+        self.halo_api_cache_dir = os.getenv("HALO_API_CACHE_DIR", os.path.join(self.mapping_cache_dir, "responses"))
+        self.halo_api_cache_ttl = os.getenv("HALO_API_CACHE_TTL", "0")
+        self.halo_api_cache_max_bytes = os.getenv("HALO_API_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+        self.halo_api_cache_purge = os.getenv("HALO_API_CACHE_PURGE", "false").lower() in ("true", "1", "yes")
+        self.incremental_mode = os.getenv("INCREMENTAL_MODE", "false").lower() in ("true", "1", "yes")
+        self.mapping_state_file = os.getenv("MAPPING_STATE_FILE",
+                                            os.path.join(self.mapping_cache_dir, "mapping_state.json"))
+        self.job_resume = os.getenv("JOB_RESUME", "false").lower() in ("true", "1", "yes")
+        self.job_journal_enabled = self.job_resume or os.getenv("JOB_JOURNAL_ENABLED", "false").lower() in (
+            "true", "1", "yes")
+        self.job_journal_file = os.getenv("JOB_JOURNAL_FILE",
+                                          os.path.join(self.mapping_cache_dir, "job_journal.sqlite"))
+        self.job_id = os.getenv("JOB_ID", "")
+        self.dry_run_input = os.getenv("DRY_RUN_INPUT", "")
+        self.dry_run_output_dir = os.getenv("DRY_RUN_OUTPUT_DIR", "dry-run")
+        self.service_host = os.getenv("SERVICE_HOST", "127.0.0.1")
+        self.service_port = os.getenv("SERVICE_PORT", "8081")
+        self.service_workers = os.getenv("SERVICE_WORKERS", "1")
+        self.service_queue_size = os.getenv("SERVICE_QUEUE_SIZE", "100")
+        self.service_schedule_interval = os.getenv("SERVICE_SCHEDULE_INTERVAL", "0")
+        self.metrics_enabled = os.getenv("METRICS_ENABLED", "false").lower() in ("true", "1", "yes")
+        self.metrics_json_log = os.getenv("METRICS_JSON_LOG", "-")
+        self.metrics_textfile = os.getenv("METRICS_TEXTFILE", "")
 
-    def sane(self):
+    @classmethod
+    def parse_mapping_types(cls, mapping_type):
+        mapping_types = []
+        for item in mapping_type.split(","):
+            item = item.strip().upper()
+            if item and item not in mapping_types:
+                mapping_types.append(item)
+        return mapping_types
+
+    def bulk_mode(self):
+        """Returns True when several source policies are selected (TARGET_POLICY_NAMES or TARGET_POLICY_PATTERN)."""
+        return bool(self.target_policy_names or self.target_policy_pattern)
+
+    def sane(self, require_target=True, require_credentials=True):
 
         """
         Test to make sure that config items for Halo are set.
+        Args:
+            require_target (bool): Require TARGET_POLICY_NAME when no bulk mode selection is set
+            require_credentials (bool): Require the Halo API key, not needed by the offline dry run
         Returns:
             True if everything is OK, False if otherwise
         """
 
         sanity = True
         template = "Required configuration variable {0} is not set!"
-        critical_vars = {"HALO_API_KEY_ID": self.halo_api_key_id,
-                         "HALO_API_KEY_SECRET": self.halo_api_key_secret,
-                         "TARGET_POLICY_NAME": self.target_policy_name}
+        critical_vars = {}
+        if require_credentials:
+            critical_vars["HALO_API_KEY_ID"] = self.halo_api_key_id
+            critical_vars["HALO_API_KEY_SECRET"] = self.halo_api_key_secret
+        if require_target and not self.bulk_mode():
+            critical_vars["TARGET_POLICY_NAME"] = self.target_policy_name
         for name, varval in critical_vars.items():
             if varval == "HARDSTOP":
                 sanity = False
                 Utility.log_stdout(template.format(name))
+        supported_types = frameworks.names()
+        if not self.mapping_types:
+            sanity = False
+            Utility.log_stdout(template.format("MAPPING_TYPE"))
+        for mapping_type in self.mapping_types:
+            if mapping_type not in supported_types:
+                sanity = False
+                Utility.log_stdout("Unsupported mapping type {0}, expected one of {1}".format(
+                    mapping_type, ", ".join(supported_types)))
         return sanity
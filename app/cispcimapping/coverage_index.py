@@ -0,0 +1,131 @@
+import re
+
+from .sheet_validator import requirement_items
+from .sheet_validator import rule_key
+
+# Last component of a requirement number: "PR.IP-1" -> "PR.IP", "2.2.4" -> "2.2"
+LAST_REQUIREMENT_COMPONENT = re.compile(r'[.\-(][^.\-(]*$')
+
+
+class CoverageIndex(object):
+    """
+    Forward and reverse index of the mappings of every framework, answering coverage queries.
+
+    Built once from a MappingTable: the forward index goes from a CloudPassage
+    rule ID to its requirements in every framework, the reverse index from a
+    (framework, requirement number) to the rules mapped to it. A mapping sheet
+    cell may hold several requirement numbers ("10.2.1, 11.5"), each one is
+    indexed on its own. Every query is a handful of dictionary and set
+    operations.
+
+    Note that a framework's requirements are the ones known from the mapping
+    sheet: a requirement no rule is mapped to at all is not listed as uncovered.
+
+    Attributes:
+        mapping_table (MappingTable): Mapping records of every framework
+        rule_requirements (dict): Framework -> rule ID -> sorted requirement numbers
+        requirement_rules (dict): Framework -> requirement number -> set of rule IDs
+        rule_ids (dict): Canonical rule ID (rule_key) -> rule ID of the mapping sheet
+    """
+
+    def __init__(self, mapping_table):
+        self.mapping_table = mapping_table
+        self.rule_requirements = {}
+        self.requirement_rules = {}
+        self.rule_ids = {}
+        for framework in mapping_table.mapping_types():
+            rule_requirements = self.rule_requirements.setdefault(framework, {})
+            requirement_rules = self.requirement_rules.setdefault(framework, {})
+            for record in mapping_table.iter_framework(framework):
+                req_nos = self.split_requirements(record.req_no)
+                rule_requirements[record.cp_rule_id] = req_nos
+                self.rule_ids[rule_key(record.cp_rule_id)] = record.cp_rule_id
+                for req_no in req_nos:
+                    requirement_rules.setdefault(req_no, set()).add(record.cp_rule_id)
+
+    @classmethod
+    def split_requirements(cls, req_no):
+        """Returns the sorted requirement numbers of a mapping sheet cell."""
+        return sorted(requirement_items(req_no))
+
+    @classmethod
+    def requirement_group(cls, req_no):
+        """Returns the parent of a requirement number, i.e. the NIST CSF category "PR.IP" of "PR.IP-1"."""
+        return LAST_REQUIREMENT_COMPONENT.sub("", req_no) or req_no
+
+    def frameworks(self):
+        return list(self.rule_requirements)
+
+    def rule(self, cp_rule_id):
+        """
+        Returns:
+            dict framework -> {'req_nos', 'title', 'description'} of every framework mapping the rule
+        """
+        result = {}
+        for framework, record in self.mapping_table.get(cp_rule_id).items():
+            result[framework] = {'req_nos': self.rule_requirements[framework][record.cp_rule_id], 'title': record.title,
+                                 'description': record.description}
+        return result
+
+    def rules_for(self, framework, req_no, prefix=False):
+        """
+        Returns the sorted rule IDs mapped to a requirement, and to its sub-requirements ("2.2" -> "2.2.4") when
+        prefix is set.
+        """
+        requirement_rules = self.requirement_rules.get(framework, {})
+        rule_ids = set(requirement_rules.get(req_no, ()))
+        if prefix:
+            for other_req_no, other_rule_ids in requirement_rules.items():
+                if other_req_no.startswith(req_no) and other_req_no[len(req_no):len(req_no) + 1] in ".-(":
+                    rule_ids.update(other_rule_ids)
+        return sorted(rule_ids)
+
+    def coverage(self, framework, rule_ids=None, group=False):
+        """
+        Returns the requirements of a framework covered by the given rules (every mapped rule when None), grouped by
+        parent requirement when group is set.
+
+        Returns:
+            dict with 'framework', 'requirements_total', 'requirements_covered', 'coverage' (ratio), 'covered'
+            (requirement -> sorted rule IDs) and 'uncovered' (sorted requirements)
+        """
+        rule_requirements = self.rule_requirements.get(framework, {})
+        if rule_ids is None:
+            rule_ids = set(rule_requirements)
+        else:
+            rule_ids = set(self.rule_ids.get(rule_key(cp_rule_id), cp_rule_id) for cp_rule_id in rule_ids)
+        key = self.requirement_group if group else (lambda req_no: req_no)
+        requirements = set(key(req_no) for req_no in self.requirement_rules.get(framework, {}))
+        covered = {}
+        for cp_rule_id in rule_ids:
+            for req_no in rule_requirements.get(cp_rule_id, ()):
+                covered.setdefault(key(req_no), []).append(cp_rule_id)
+        return {'framework': framework,
+                'requirements_total': len(requirements),
+                'requirements_covered': len(covered),
+                'coverage': round(float(len(covered)) / len(requirements), 4) if requirements else 0.0,
+                'covered': dict((req_no, sorted(covered[req_no])) for req_no in sorted(covered)),
+                'uncovered': sorted(requirements - set(covered))}
+
+    def overlap(self, framework, other_framework):
+        """
+        Returns how two frameworks overlap: rules mapped by either or both, and the requirement pairs sharing rules.
+
+        Returns:
+            dict with 'rules' (framework -> number of mapped rules), 'rules_both', 'jaccard' and 'requirement_pairs'
+            ([requirement, other requirement, shared rules], most shared first)
+        """
+        rules = set(self.rule_requirements.get(framework, {}))
+        other_rules = set(self.rule_requirements.get(other_framework, {}))
+        both = rules & other_rules
+        pairs = {}
+        for cp_rule_id in both:
+            for req_no in self.rule_requirements[framework][cp_rule_id]:
+                for other_req_no in self.rule_requirements[other_framework][cp_rule_id]:
+                    pairs[(req_no, other_req_no)] = pairs.get((req_no, other_req_no), 0) + 1
+        union = rules | other_rules
+        return {'rules': {framework: len(rules), other_framework: len(other_rules)},
+                'rules_both': len(both),
+                'jaccard': round(float(len(both)) / len(union), 4) if union else 0.0,
+                'requirement_pairs': [[req_no, other_req_no, count] for (req_no, other_req_no), count in
+                                      sorted(pairs.items(), key=lambda item: (-item[1], item[0]))]}
@@ -1,11 +1,101 @@
 import os
-import pandas as pd
+
+from . import frameworks
+from . import sheet_validator
+from . import utility
+from .custom_enum import MappingType
+
+CP_RULE_ID_COLUMN = 'CP Rule ID'
+
+# Mapping type -> (requirement number, title, description) columns of the PCI/HIPAA/NIST mapping sheet. Kept for
+# compatibility: the columns of every framework are defined in the frameworks registry
+MAPPING_COLUMNS = dict((mapping_type.value, frameworks.get(mapping_type.value).columns) for mapping_type in MappingType)
 
 
 class ExcelHandler:
 
     def read_from_excel(self, sheet_name, file_name, base_dir, excel_engine_type):
+        # pandas (and openpyxl) are only imported when a mapping sheet is actually parsed
+        import pandas as pd
+
         excel_file_path = os.path.join(base_dir, file_name)
         xlsx = pd.ExcelFile(excel_file_path)
         df = pd.read_excel(xlsx, sheet_name, engine=excel_engine_type)
         return df
+
+    def extract_mapping_records(self, df, mapping_type):
+        """
+        Extracts the mapping records of one mapping type from the mapping sheet.
+
+        The columns are the ones of the mapping type's framework. Rows with no
+        requirement number are dropped with a column mask and the remaining
+        cells are converted to str in bulk. A sheet without the framework's
+        columns holds no mapping record of it.
+
+        Returns:
+            list of [cp_rule_id, req_no, title, description]
+        """
+        framework = frameworks.get(mapping_type)
+        req_column = framework.req_column
+        columns = [CP_RULE_ID_COLUMN] + list(framework.columns)
+        missing_columns = [column for column in columns if column not in df.columns]
+        if missing_columns:
+            utility.Utility.log_stderr("Mapping sheet has no %s columns %s" % (mapping_type,
+                                                                               ", ".join(missing_columns)))
+            return []
+        fltrd_df = df.loc[df[req_column].notna(), columns]
+        return fltrd_df.to_numpy(dtype=object).astype(str).tolist()
+
+    def extract_all_mapping_records(self, df, mapping_types=None):
+        """
+        Extracts the mapping records of several mapping types from one parsed mapping sheet, by default of every
+        registered framework whose columns the sheet has.
+
+        Returns:
+            dict of mapping type -> list of [cp_rule_id, req_no, title, description]
+        """
+        if mapping_types is None:
+            mapping_types = self.sheet_frameworks(df)
+        return dict((mapping_type, self.extract_mapping_records(df, mapping_type)) for mapping_type in mapping_types)
+
+    @classmethod
+    def sheet_frameworks(cls, df):
+        """Returns the registered mapping types whose columns are all present in the mapping sheet."""
+        sheet_columns = set(df.columns)
+        return [framework.name for framework in frameworks.FRAMEWORKS.values()
+                if sheet_columns.issuperset(framework.columns)]
+
+    def load_mapping_records(self, excel_file_path, sheet_name, mapping_types, excel_engine_type, cache=None,
+                             validator=None):
+        """
+        Returns the mapping records of several mapping types, cleaned by a SheetValidator when the sheet is parsed.
+        When a MappingCache is given, the mapping sheet is only parsed for the mapping types missing from the cache
+        and the cache is filled with the cleaned records.
+
+        Args:
+            validator (SheetValidator): Collects the validation issues of the parsed sheet, a new one when None
+
+        Returns:
+            dict of mapping type -> list of [cp_rule_id, req_no, title, description]
+        """
+        records = {}
+        if cache is not None:
+            fingerprint = cache.fingerprint(excel_file_path)
+            for mapping_type in mapping_types:
+                fltrd_info_lst = cache.load(excel_file_path, sheet_name, mapping_type, fingerprint)
+                if fltrd_info_lst is not None:
+                    records[mapping_type] = fltrd_info_lst
+
+        missing_types = [mapping_type for mapping_type in mapping_types if mapping_type not in records]
+        if missing_types:
+            df = self.read_from_excel(sheet_name, os.path.basename(excel_file_path), os.path.dirname(excel_file_path),
+                                      excel_engine_type)
+            if validator is None:
+                validator = sheet_validator.SheetValidator()
+            parsed = validator.normalize_all(self.extract_all_mapping_records(df, missing_types),
+                                             "%s:%s" % (os.path.basename(excel_file_path), sheet_name))
+            for mapping_type, fltrd_info_lst in parsed.items():
+                if cache is not None:
+                    cache.store(excel_file_path, sheet_name, mapping_type, fingerprint, fltrd_info_lst)
+                records[mapping_type] = fltrd_info_lst
+        return records
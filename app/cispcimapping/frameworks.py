@@ -0,0 +1,143 @@
+import collections
+import json
+import os
+
+from . import utility
+
+
+class Framework(object):
+    """
+    Declarative definition of a compliance framework the CIS rules are mapped to.
+
+    A framework is read from three columns of the mapping sheet and drives the
+    generic rule extraction: a kept rule is renamed
+    ``<rule_name_prefix><req_no>-<rule name>``, gets ``user_notes_template``
+    (formatted with req_no, title and description) as user_notes, and the
+    derived policy is named ``<policy_name_prefix><source policy name>_<time>``.
+
+    Attributes:
+        name (str): Mapping type, as given in MAPPING_TYPE, i.e. 'PCI'
+        title (str): Human readable framework name
+        req_column (str): Mapping sheet column of the requirement numbers
+        title_column (str): Mapping sheet column of the requirement titles
+        description_column (str): Mapping sheet column of the requirement descriptions
+        rule_name_prefix (str): Prefix of the derived rule names
+        policy_name_prefix (str): Prefix of the derived policy names
+        user_notes_template (str): str.format template of the derived rule user_notes
+    """
+
+    fields = ('name', 'title', 'req_column', 'title_column', 'description_column', 'rule_name_prefix',
+              'policy_name_prefix', 'user_notes_template')
+
+    def __init__(self, name, title, req_column, title_column, description_column, rule_name_prefix,
+                 policy_name_prefix, user_notes_template):
+        self.name = name.upper()
+        self.title = title
+        self.req_column = req_column
+        self.title_column = title_column
+        self.description_column = description_column
+        self.rule_name_prefix = rule_name_prefix
+        self.policy_name_prefix = policy_name_prefix
+        self.user_notes_template = user_notes_template
+
+    @classmethod
+    def from_dict(cls, definition):
+        missing = [field for field in cls.fields if field not in definition]
+        if missing:
+            raise ValueError("Framework definition %r misses %s" % (definition.get('name'), ", ".join(missing)))
+        return cls(*[definition[field] for field in cls.fields])
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+    @property
+    def columns(self):
+        """(requirement number, title, description) columns of the mapping sheet."""
+        return self.req_column, self.title_column, self.description_column
+
+    def user_notes(self, ruleinfo_elmnt):
+        return self.user_notes_template.format(req_no=ruleinfo_elmnt.req_no, title=ruleinfo_elmnt.title,
+                                               description=ruleinfo_elmnt.description)
+
+    def annotate_rule(self, rule, ruleinfo_elmnt):
+        return dict(rule, user_notes=self.user_notes(ruleinfo_elmnt),
+                    name=self.rule_name_prefix + ruleinfo_elmnt.req_no + '-' + rule.get('name'))
+
+
+def labels_template(req_label, title_label, description_label):
+    """Returns the user_notes template of the historical "<label><value>" user_notes layout."""
+    return req_label + "{req_no}" + title_label + "{title}" + description_label + "{description}"
+
+
+FRAMEWORK_DEFINITIONS = [
+    {'name': 'PCI', 'title': 'PCI-DSS',
+     'req_column': 'PCI-DSS_Req. #', 'title_column': 'PCI-DSS_Title', 'description_column': 'PCI-DSS_Description',
+     'rule_name_prefix': 'PCI-DSS-', 'policy_name_prefix': 'PCI-DSS_',
+     'user_notes_template': labels_template('PCI-DSS Req: ', ', PCI_Title: ', ', PCI_Description: ')},
+    {'name': 'HIPAA', 'title': 'HIPAA',
+     'req_column': 'HIPAA_Req. #', 'title_column': 'HIPAA_Title', 'description_column': 'HIPAA_Description',
+     'rule_name_prefix': 'HIPAA-', 'policy_name_prefix': 'HIPAA_',
+     'user_notes_template': labels_template('HIPAA Req: ', ', HIPAA_Title: ', ', HIPAA_Description: ')},
+    {'name': 'NIST', 'title': 'NIST CSF 1.1',
+     'req_column': 'NIST CSF 1.1', 'title_column': 'NIST_Title', 'description_column': 'NIST_Description',
+     'rule_name_prefix': 'NIST-', 'policy_name_prefix': 'NIST_',
+     'user_notes_template': labels_template('NIST Req: ', ', NIST_Title: ', ', NIST_Description: ')},
+    {'name': 'ISO27001', 'title': 'ISO/IEC 27001',
+     'req_column': 'ISO27001_Req. #', 'title_column': 'ISO27001_Title', 'description_column': 'ISO27001_Description',
+     'rule_name_prefix': 'ISO27001-', 'policy_name_prefix': 'ISO27001_',
+     'user_notes_template': labels_template('ISO 27001 Control: ', ', ISO27001_Title: ', ', ISO27001_Description: ')},
+    {'name': 'SOC2', 'title': 'SOC 2',
+     'req_column': 'SOC2_Req. #', 'title_column': 'SOC2_Title', 'description_column': 'SOC2_Description',
+     'rule_name_prefix': 'SOC2-', 'policy_name_prefix': 'SOC2_',
+     'user_notes_template': labels_template('SOC 2 Criteria: ', ', SOC2_Title: ', ', SOC2_Description: ')},
+    {'name': 'CISV8', 'title': 'CIS Controls v8',
+     'req_column': 'CIS v8_Safeguard #', 'title_column': 'CIS v8_Title', 'description_column': 'CIS v8_Description',
+     'rule_name_prefix': 'CISv8-', 'policy_name_prefix': 'CISv8_',
+     'user_notes_template': labels_template('CIS v8 Safeguard: ', ', CISv8_Title: ', ', CISv8_Description: ')},
+]
+
+# Mapping type -> Framework, in definition order
+FRAMEWORKS = collections.OrderedDict()
+# Definitions files already registered
+LOADED_FILES = set()
+
+
+def register(framework):
+    """Adds a framework to the registry, replacing a framework of the same name."""
+    FRAMEWORKS[framework.name] = framework
+    return framework
+
+
+def get(name):
+    """Returns the registered framework of a mapping type, raising ValueError for an unknown one."""
+    framework = FRAMEWORKS.get(name.upper())
+    if framework is None:
+        raise ValueError("Unsupported mapping type [%s]" % name)
+    return framework
+
+
+def names():
+    return list(FRAMEWORKS)
+
+
+def load_definitions(definitions_file):
+    """
+    Registers the frameworks of a JSON definitions file: a list of objects with the Framework fields. A file is only
+    loaded once. Returns the names of the registered frameworks.
+    """
+    definitions_file = os.path.abspath(definitions_file)
+    if definitions_file in LOADED_FILES:
+        return []
+    with open(definitions_file) as fh:
+        definitions = json.load(fh)
+    registered = []
+    for definition in definitions:
+        registered.append(register(Framework.from_dict(definition)).name)
+    LOADED_FILES.add(definitions_file)
+    utility.Utility.log_stdout("Loaded framework definitions %s from '%s'" % (", ".join(registered),
+                                                                              definitions_file))
+    return registered
+
+
+for framework_definition in FRAMEWORK_DEFINITIONS:
+    register(Framework.from_dict(framework_definition))
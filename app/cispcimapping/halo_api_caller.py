@@ -1,18 +1,33 @@
 #!/usr/bin/env python3.9
 import base64
+import gzip
 import json
 import urllib.parse
-import urllib.request
 from datetime import datetime
 
-import cloudpassage
+import urllib3
 
+from . import frameworks
+from . import http_session
+from . import json_stream
+from . import metrics
+from . import response_cache
+from . import token_manager
+from .custom_enum import MappingType
+from .sheet_validator import rule_key
 from . import utility
 
+# Size of the chunks read from a streamed policy details response
+STREAM_CHUNK_SIZE = 64 * 1024
+# Request bodies smaller than this are sent uncompressed even when gzip is enabled
+GZIP_MIN_BYTES = 1024
+# Name suffix of the parts of a policy split to stay under the payload limit
+POLICY_PART_SUFFIX = " (%d/%d)"
+
 
 class HaloAPICaller(object):
 
-    def __init__(self, config):
+    def __init__(self, config, metrics_obj=None):
         self.halo_api_auth_url = config.halo_api_auth_url
         self.halo_api_auth_args = config.halo_api_auth_args
         self.halo_api_hostname = config.halo_api_hostname
@@ -21,11 +36,39 @@ class HaloAPICaller(object):
         self.halo_api_key_id = config.halo_api_key_id
         self.halo_api_key_secret = config.halo_api_key_secret
         self.halo_api_auth_token = config.halo_api_auth_token
+        self.expires = None
+        self.token_manager = token_manager.TokenManager(self.fetch_auth_token,
+                                                        float(config.halo_api_token_refresh_margin),
+                                                        float(config.halo_api_token_default_lifetime),
+                                                        float(config.halo_api_token_failure_backoff))
+        self.halo_api_per_page = int(config.halo_api_per_page)
+        self.halo_api_server_name_filter = config.halo_api_server_name_filter
+        self.halo_api_stream_policy_details = config.halo_api_stream_policy_details
+        self.halo_api_gzip_requests = config.halo_api_gzip_requests
+        self.halo_api_max_payload_bytes = int(config.halo_api_max_payload_bytes)
+        self.response_cache = None
+        if config.halo_api_cache_enabled:
+            self.response_cache = response_cache.ResponseCache(config.halo_api_cache_dir,
+                                                               float(config.halo_api_cache_ttl),
+                                                               int(config.halo_api_cache_max_bytes))
+            if config.halo_api_cache_purge:
+                utility.Utility.log_stdout("Removed %d cached Halo API responses" %
+                                           self.response_cache.invalidate())
         self.target_policy_name = config.target_policy_name
         self.mapping_file_name = config.mapping_file_name
         self.sheet_name = config.sheet_name
         self.excel_engine_type = config.excel_engine_type
         self.mapping_type = config.mapping_type
+        self.metrics = metrics_obj or metrics.Metrics(config.metrics_enabled, config.metrics_json_log,
+                                                      config.metrics_textfile)
+        self.http_session = http_session.HTTPSession(int(config.halo_api_pool_size),
+                                                     float(config.halo_api_connect_timeout),
+                                                     float(config.halo_api_read_timeout),
+                                                     float(config.halo_api_rate_limit),
+                                                     int(config.halo_api_retries),
+                                                     float(config.halo_api_backoff_factor),
+                                                     float(config.halo_api_backoff_max),
+                                                     self.metrics)
 
     # Dump debug info
     @classmethod
@@ -45,6 +88,8 @@ class HaloAPICaller(object):
             return "Forbidden"
         elif code == 404:
             return "Not found"
+        elif code == 413:
+            return "Payload too large"
         elif code == 422:
             return "Validation failed"
         elif code == 500:
@@ -54,36 +99,34 @@ class HaloAPICaller(object):
         else:
             return "Unknown code [%d]" % code
 
-    # add authentication token into the request
+    # add authentication token into the request headers
     @classmethod
-    def add_auth(cls, req, kid, sec):
+    def add_auth(cls, headers, kid, sec):
         combined = kid + ":" + sec
         combined_bytes = combined.encode("utf-8")
         encoded = base64.b64encode(combined_bytes)
         encoded_str = encoded.decode("utf-8")
-        req.add_header("Authorization", "Basic " + encoded_str)
+        headers["Authorization"] = "Basic " + encoded_str
 
     def get_auth_token(self, url, args, kid, sec):
-        req = urllib.request.Request(url)
-        self.add_auth(req, kid, sec)
+        headers = {}
+        self.add_auth(headers, kid, sec)
         if args:
             args = urllib.parse.urlencode(args).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
         try:
-            fh = urllib.request.urlopen(req, data=args)
-            return fh.read()
-        except IOError as e:
-            if hasattr(e, 'reason'):
-                utility.Utility.log_stderr("Failed to connect [%s] to '%s'" % (e.reason, url))
-            elif hasattr(e, 'code'):
-                msg = self.get_http_status(e.code)
-                utility.Utility.log_stderr("Failed to authorize [%s] at '%s'" % (msg, url))
-                data = e.read()
-                if data:
-                    utility.Utility.log_stderr("Extra data: %s" % data)
-                utility.Utility.log_stderr("Likely cause: incorrect API keys, id=%s" % kid)
-            else:
-                utility.Utility.log_stderr("Unknown error fetching '%s'" % url)
+            response = self.http_session.request("POST", url, headers=headers, body=args)
+        except urllib3.exceptions.HTTPError as e:
+            utility.Utility.log_stderr("Failed to connect [%s] to '%s'" % (e, url))
             return None
+        if response.status >= 400:
+            msg = self.get_http_status(response.status)
+            utility.Utility.log_stderr("Failed to authorize [%s] at '%s'" % (msg, url))
+            if response.data:
+                utility.Utility.log_stderr("Extra data: %s" % response.data)
+            utility.Utility.log_stderr("Likely cause: incorrect API keys, id=%s" % kid)
+            return None
+        return response.data
 
     def get_initial_link(self, from_date, events_per_page):
         url = "%s:%d/%s/events?per_page=%d" % (
@@ -93,84 +136,119 @@ class HaloAPICaller(object):
         return url
 
     def get_event_batch(self, url):
-        return self.do_get_request(url, self.halo_api_auth_token)
+        return self.do_authorized_request("GET", url, failure_msg="Failed to fetch events")
 
-    def do_get_request(self, url, token):
-        req = urllib.request.Request(url)
-        req.add_header("Authorization", "Bearer " + token)
+    def do_request(self, method, url, token, body=None, failure_msg="Failed to make request:", stream=False):
+        """
+        Sends an authorized request to the Halo API over the pooled HTTP session.
+
+        GET responses go through the response cache when it is enabled: a fresh entry is returned without any
+        request, an older one is revalidated and returned on a 304 response.
+
+        Args:
+            stream (bool): Return the unread urllib3 response instead of the response body, bypassing the cache
+
+        Returns:
+            (response body, auth_error), the body being None on failure
+        """
+        headers = {"Authorization": "Bearer " + token}
+        if body is not None:
+            if not isinstance(body, bytes):
+                body = body.encode("utf-8")
+            headers["Content-Type"] = "application/json"
+            if self.halo_api_gzip_requests and len(body) >= GZIP_MIN_BYTES:
+                body = gzip.compress(body, 6)
+                headers["Content-Encoding"] = "gzip"
+        cached = None
+        if self.response_cache is not None and method == "GET" and not stream:
+            cached = self.response_cache.get(self.halo_api_key_id, url)
+            if cached is not None:
+                if self.response_cache.is_fresh(cached):
+                    self.metrics.count("http_cache", result="hit")
+                    return cached['body'], False
+                headers.update(self.response_cache.conditional_headers(cached))
         try:
-            fh = urllib.request.urlopen(req)
-            return fh.read(), False
-        except IOError as e:
-            auth_error = False
-            if hasattr(e, 'reason'):
-                utility.Utility.log_stderr("Failed to connect [%s] to '%s'" % (e.reason, url))
-            elif hasattr(e, 'code'):
-                msg = self.get_http_status(e.code)
-                utility.Utility.log_stderr("Failed to fetch events [%s] from '%s'" % (msg, url))
-                if e.code == 401:
-                    auth_error = True
+            response = self.http_session.request(method, url, headers=headers, body=body,
+                                                 preload_content=not stream)
+        except urllib3.exceptions.HTTPError as e:
+            utility.Utility.log_stderr("Failed to connect [%s] to '%s'" % (e, url))
+            return None, False
+        if response.status == 304 and cached is not None:
+            self.metrics.count("http_cache", result="revalidated")
+            self.response_cache.refresh(self.halo_api_key_id, url, cached)
+            return cached['body'], False
+        if response.status >= 400:
+            msg = self.get_http_status(response.status)
+            utility.Utility.log_stderr("%s [%s] from '%s'" % (failure_msg, msg, url))
+            if stream:
+                response.drain_conn()
+                response.release_conn()
+            return None, response.status == 401
+        if stream:
+            return response, False
+        if self.response_cache is not None:
+            if method == "GET":
+                self.metrics.count("http_cache", result="miss")
+                self.response_cache.store(self.halo_api_key_id, url, response.data, response.headers.get("ETag"),
+                                          response.headers.get("Last-Modified"))
             else:
-                utility.Utility.log_stderr("Unknown error fetching '%s'" % url)
-            return None, auth_error
+                self.response_cache.forget(self.halo_api_key_id, url)
+        return response.data, False
+
+    def do_get_request(self, url, token):
+        return self.do_request("GET", url, token, failure_msg="Failed to fetch events")
 
     def do_put_request(self, url, token, put_data):
-        opener = urllib.request.build_opener(urllib.request.HTTPHandler)
-        req = urllib.request.Request(url, data=put_data.encode("utf-8"))
-        req.add_header("Authorization", "Bearer " + token)
-        req.add_header("Content-Type", "application/json")
-        req.get_method = lambda: 'PUT'
-        try:
-            fh = opener.open(req)
-            return fh.read(), False
-        except IOError as e:
-            auth_error = False
-            if hasattr(e, 'reason'):
-                utility.Utility.log_stderr("Failed to connect [%s] to '%s'" % (e.reason, url))
-            if hasattr(e, 'code'):
-                msg = self.get_http_status(e.code)
-                utility.Utility.log_stderr("Failed to make request: [%s] from '%s'" % (msg, url))
-                if e.code == 401:
-                    auth_error = True
-            if (not hasattr(e, 'reason')) and (not hasattr(e, 'code')):
-                utility.Utility.log_stderr("Unknown error fetching '%s'" % url)
-            return None, auth_error
+        return self.do_request("PUT", url, token, put_data)
 
     def do_post_request(self, url, token, post_data):
-        opener = urllib.request.build_opener(urllib.request.HTTPHandler)
-        req = urllib.request.Request(url, data=post_data.encode("utf-8"))
-        req.add_header("Authorization", "Bearer " + token)
-        req.add_header("Content-Type", "application/json")
-        try:
-            fh = opener.open(req)
-            return fh.read(), False
-        except IOError as e:
-            auth_error = False
-            if hasattr(e, 'reason'):
-                utility.Utility.log_stderr("Failed to connect [%s] to '%s'" % (e.reason, url))
-            if hasattr(e, 'code'):
-                msg = self.get_http_status(e.code)
-                utility.Utility.log_stderr("Failed to make request: [%s] from '%s'" % (msg, url))
-                if e.code == 401:
-                    auth_error = True
-            if (not hasattr(e, 'reason')) and (not hasattr(e, 'code')):
-                utility.Utility.log_stderr("Unknown error fetching '%s'" % url)
-            return None, auth_error
+        return self.do_request("POST", url, token, post_data)
 
-    def authenticate_client(self):
+    def do_authorized_request(self, method, url, body=None, failure_msg="Failed to make request:", stream=False):
+        """
+        Sends a request with the token of the token manager. When the Halo API rejects the token (401), a new token
+        is fetched and the request is retried once.
+
+        Returns:
+            (response body, auth_error), the body being None on failure
+        """
+        token = self.token_manager.get_token()
+        if token is None:
+            utility.Utility.log_stderr("No Halo API token available for '%s'" % url)
+            return None, True
+        (data, auth_error) = self.do_request(method, url, token, body, failure_msg, stream)
+        if auth_error:
+            self.token_manager.invalidate(token)
+            token = self.token_manager.get_token()
+            if token is None:
+                return None, True
+            (data, auth_error) = self.do_request(method, url, token, body, failure_msg, stream)
+        return data, auth_error
+
+    def fetch_auth_token(self):
+        """
+        Requests a new token from the Halo API.
+
+        Returns:
+            (token, expires_in seconds), or (None, None) on failure
+        """
         url = "%s:%d/%s" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_auth_url)
         response = self.get_auth_token(url, self.halo_api_auth_args, self.halo_api_key_id, self.halo_api_key_secret)
-        if response:
-            auth_resp_obj = json.loads(response)
-            if 'access_token' in auth_resp_obj:
-                self.halo_api_auth_token = auth_resp_obj['access_token']
-            if 'expires_in' in auth_resp_obj:
-                self.expires = auth_resp_obj['expires_in']
-        return self.halo_api_auth_token
+        if not response:
+            return None, None
+        auth_resp_obj = json.loads(response)
+        token = auth_resp_obj.get('access_token')
+        self.expires = auth_resp_obj.get('expires_in')
+        if token:
+            self.halo_api_auth_token = token
+        return token, self.expires
+
+    def authenticate_client(self):
+        return self.token_manager.refresh()
 
     def get_firewall_policy_list(self):
         url = "%s:%d/%s/firewall_policies/" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_version)
-        (data, auth_error) = self.do_get_request(url, self.halo_api_auth_token)
+        (data, auth_error) = self.do_authorized_request("GET", url, failure_msg="Failed to fetch events")
         if data:
             return json.loads(data), auth_error
         else:
@@ -179,123 +257,306 @@ class HaloAPICaller(object):
     def get_firewall_policy_details(self, policy_id):
         url = "%s:%d/%s/firewall_policies/%s" % (
             self.halo_api_hostname, self.halo_api_port, self.halo_api_version, policy_id)
-        (data, auth_error) = self.do_get_request(url, self.halo_api_auth_token)
+        (data, auth_error) = self.do_authorized_request("GET", url, failure_msg="Failed to fetch events")
         if data:
             return json.loads(data), auth_error
         else:
             return None, auth_error
 
     def get_configuration_policy_list(self):
-        url = "%s:%d/%s/policies/" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_version)
-        (data, auth_error) = self.do_get_request(url, self.halo_api_auth_token)
-        if data:
-            return json.loads(data), auth_error
-        else:
-            return None, auth_error
+        """
+        Retrieves every configuration policy, following the pagination of the Halo API.
+
+        Returns:
+            (policy list, auth_error), the policy list holding the policies of all pages
+        """
+        policy_list = None
+        for (page, auth_error) in self.iter_configuration_policy_pages():
+            if page is None:
+                return None, auth_error
+            if policy_list is None:
+                policy_list = page
+            else:
+                policy_list['policies'].extend(page.get('policies', []))
+        policy_list.pop('pagination', None)
+        return policy_list, False
+
+    def iter_configuration_policy_pages(self, policy_name=None):
+        """
+        Yields the configuration policy list page by page, following the pagination links of the Halo API.
+
+        Args:
+            policy_name (str): Sent as a server side name filter when halo_api_server_name_filter is enabled
+
+        Yields:
+            (page, auth_error) tuples. On failure the page is None and the iteration stops.
+        """
+        query = {'per_page': self.halo_api_per_page}
+        if policy_name and self.halo_api_server_name_filter:
+            query['name'] = policy_name
+        url = "%s:%d/%s/policies/?%s" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_version,
+                                         urllib.parse.urlencode(query))
+        while url:
+            (data, auth_error) = self.do_authorized_request("GET", url, failure_msg="Failed to fetch events")
+            if not data:
+                yield None, auth_error
+                return
+            page = json.loads(data)
+            yield page, auth_error
+            url = (page.get('pagination') or {}).get('next')
+
+    def find_configuration_policy_id(self, policy_name):
+        """
+        Returns the ID of the first configuration policy named policy_name, fetching only the pages needed to find it.
+        """
+        for (page, auth_error) in self.iter_configuration_policy_pages(policy_name):
+            if page is None:
+                return None
+            target_policy_id = self.extract_policy_from_policy_list((page, auth_error), policy_name)
+            if target_policy_id is not None:
+                return target_policy_id
+        return None
 
     def get_configuration_policy_details(self, policy_id):
         url = "%s:%d/%s/policies/%s" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_version, policy_id)
-        (data, auth_error) = self.do_get_request(url, self.halo_api_auth_token)
+        (data, auth_error) = self.do_authorized_request("GET", url, failure_msg="Failed to fetch events")
         if data:
             return json.loads(data), auth_error
         else:
             return None, auth_error
 
+    def stream_configuration_policy_details(self, policy_id):
+        """
+        Requests the configuration policy details without reading the response body.
+
+        Returns:
+            (JSONArrayStream yielding the policy rules one at a time, auth_error), the stream being None on failure
+        """
+        url = "%s:%d/%s/policies/%s" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_version, policy_id)
+        (response, auth_error) = self.do_authorized_request("GET", url, failure_msg="Failed to fetch events",
+                                                            stream=True)
+        if response is None:
+            return None, auth_error
+        return json_stream.JSONArrayStream(self.iter_response_chunks(response), ('policy', 'rules')), auth_error
+
+    @classmethod
+    def iter_response_chunks(cls, response, chunk_size=STREAM_CHUNK_SIZE):
+        """Yields the body of a streamed response, releasing its connection once read or abandoned."""
+        completed = False
+        try:
+            for chunk in response.stream(chunk_size):
+                yield chunk
+            completed = True
+        finally:
+            if not completed:
+                response.close()
+            response.release_conn()
+
+    def map_configuration_policy_details(self, policy_id, mapping_idxs):
+        """
+        Streams the configuration policy details through the mapping join: the rules are parsed one at a time and
+        only the rules found in a mapping index are kept, so the whole source policy is never held in memory.
+
+        Returns:
+            (dict mapping type -> mapped policy, auth_error), the dict being None on failure
+        """
+        (policy_rules, auth_error) = self.stream_configuration_policy_details(policy_id)
+        if policy_rules is None:
+            return None, auth_error
+        try:
+            return self.extract_policy_rules_from_stream(policy_rules, mapping_idxs), auth_error
+        except (ValueError, urllib3.exceptions.HTTPError) as e:
+            utility.Utility.log_stderr("Failed to read configuration policy [%s] details: %s" % (policy_id, e))
+            return None, False
+
     def create_firewall_policy(self, policy_data):
         url = "%s:%d/%s/firewall_policies" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_version)
         json_data = json.dumps(policy_data)
-        (data, auth_error) = self.do_post_request(url, self.halo_api_auth_token, json_data)
+        (data, auth_error) = self.do_authorized_request("POST", url, json_data)
         if data:
             return json.loads(data), auth_error
         else:
             return None, auth_error
 
+    @classmethod
+    def encode_policy(cls, policy_data):
+        """Serializes a policy to the compact UTF-8 JSON request body, once."""
+        return json.dumps(policy_data, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+
+    def split_policy(self, policy_data):
+        """
+        Splits a policy whose request body exceeds halo_api_max_payload_bytes into parts holding consecutive rules,
+        named "<name> (1/3)", "<name> (2/3)"... A rule larger than the limit on its own is sent alone.
+
+        Returns:
+            list of (policy dict, request body) tuples, a single one when the policy fits
+        """
+        body = self.encode_policy(policy_data)
+        max_payload_bytes = self.halo_api_max_payload_bytes
+        rules = policy_data['policy'].get('rules') or []
+        if max_payload_bytes <= 0 or len(body) <= max_payload_bytes or len(rules) < 2:
+            return [(policy_data, body)]
+        name = policy_data['policy']['name']
+        envelope = dict(policy_data, policy=dict(policy_data['policy'], rules=[],
+                                                 name=name + POLICY_PART_SUFFIX % (len(rules), len(rules))))
+        available = max_payload_bytes - len(self.encode_policy(envelope))
+        groups = [[]]
+        size = 0
+        for rule in rules:
+            rule_size = len(self.encode_policy(rule)) + 1
+            if groups[-1] and size + rule_size > available:
+                groups.append([])
+                size = 0
+            groups[-1].append(rule)
+            size += rule_size
+        parts = []
+        for i, group in enumerate(groups):
+            part = dict(policy_data, policy=dict(policy_data['policy'], rules=group,
+                                                 name=name + POLICY_PART_SUFFIX % (i + 1, len(groups))))
+            parts.append((part, self.encode_policy(part)))
+        return parts
+
     def create_configuration_policy(self, policy_data):
+        """
+        Creates a configuration policy from a policy dict, or from its already encoded request body.
+
+        Returns:
+            (response, auth_error), the response being None on failure
+        """
         url = "%s:%d/%s/policies" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_version)
-        json_data = json.dumps(policy_data)
-        (data, auth_error) = self.do_post_request(url, self.halo_api_auth_token, json_data)
+        json_data = policy_data if isinstance(policy_data, bytes) else self.encode_policy(policy_data)
+        (data, auth_error) = self.do_authorized_request("POST", url, json_data)
         if data:
             return json.loads(data), auth_error
         else:
             return None, auth_error
 
+    def update_configuration_policy(self, policy_id, policy_data):
+        """
+        Replaces an existing configuration policy.
+
+        Returns:
+            (response, auth_error), the response being None on failure and {} when the API returns no content
+        """
+        url = "%s:%d/%s/policies/%s" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_version, policy_id)
+        json_data = policy_data if isinstance(policy_data, bytes) else self.encode_policy(policy_data)
+        (data, auth_error) = self.do_authorized_request("PUT", url, json_data)
+        if data is None:
+            return None, auth_error
+        return (json.loads(data) if data else {}), auth_error
+
+    def delete_configuration_policy(self, policy_id):
+        """
+        Deletes a configuration policy.
+
+        Returns:
+            (response, auth_error), the response being None on failure and {} when the API returns no content
+        """
+        url = "%s:%d/%s/policies/%s" % (self.halo_api_hostname, self.halo_api_port, self.halo_api_version, policy_id)
+        (data, auth_error) = self.do_authorized_request("DELETE", url, failure_msg="Failed to delete policy")
+        if data is None:
+            return None, auth_error
+        return (json.loads(data) if data else {}), auth_error
+
     def extract_policy_from_policy_list(self, policy_list, policy_name):
         policy_list_data = policy_list[0]
-        target_policy_id = None
         for policy in policy_list_data['policies']:
             if policy['name'] == policy_name:
-                target_policy_id = policy['id']
-        return target_policy_id
+                return policy['id']
+        return None
 
-    def extract_policy_rules_have_pci(self, policy_details_tuple, cp_rule_id_lst, fltrd_pcirule_lst):
-        policy_details = policy_details_tuple[0]
-        rule_id_lst_has_pci = cp_rule_id_lst
-        plc_rules_lst = []
-        for rule in policy_details['policy']['rules']:
-            current_rule_id = rule.get('cp_rule_id')
-            current_rule_name = rule.get('name')
-            if current_rule_id in rule_id_lst_has_pci:
-                for pci_ruleinfo_elmnt in fltrd_pcirule_lst:
-                    if pci_ruleinfo_elmnt[0] == current_rule_id:
-                        rule.update(
-                            user_notes='PCI-DSS Req: ' + pci_ruleinfo_elmnt[1] + ', PCI_Title: ' + pci_ruleinfo_elmnt[
-                                2] + ', PCI_Description: ' + pci_ruleinfo_elmnt[3])
-                        rule.update(name='PCI-DSS-' + pci_ruleinfo_elmnt[1] + '-' + current_rule_name)
-                plc_rules_lst.append(rule)
-        current_time = utility.Utility.date_to_iso8601(datetime.now())
-        policy_details['policy']['name'] = "PCI-DSS_" + self.target_policy_name + "_" + current_time
-        policy_details['policy']['rules'] = plc_rules_lst
-        return policy_details
+    @classmethod
+    def policy_rule_keys(cls, policy_details):
+        """
+        Returns the canonical rule ID (rule_key) of every rule of a source policy, in rule order, computed once and
+        passed to the extraction of every mapping type.
+        """
+        return [rule_key(rule.get('cp_rule_id')) for rule in policy_details['policy']['rules']]
 
-    def extract_policy_rules_have_hipaa(self, policy_details_tuple, cp_rule_id_lst, fltrd_hipaarule_lst):
-        policy_details = policy_details_tuple[0]
-        rule_id_lst_has_hipaa = cp_rule_id_lst
-        plc_rules_lst = []
-        for rule in policy_details['policy']['rules']:
-            current_rule_id = rule.get('cp_rule_id')
-            current_rule_name = rule.get('name')
-            if current_rule_id in rule_id_lst_has_hipaa:
-                for hipaa_ruleinfo_elmnt in fltrd_hipaarule_lst:
-                    if hipaa_ruleinfo_elmnt[0] == current_rule_id:
-                        rule.update(user_notes='HIPAA Req: ' + hipaa_ruleinfo_elmnt[1] + ', HIPAA_Title: ' +
-                                               hipaa_ruleinfo_elmnt[
-                                                   2] + ', HIPAA_Description: ' + hipaa_ruleinfo_elmnt[3])
-                        rule.update(name='HIPAA-' + hipaa_ruleinfo_elmnt[1] + '-' + current_rule_name)
-                plc_rules_lst.append(rule)
-        current_time = utility.Utility.date_to_iso8601(datetime.now())
-        policy_details['policy']['name'] = "HIPAA_" + self.target_policy_name + "_" + current_time
-        policy_details['policy']['rules'] = plc_rules_lst
-        return policy_details
+    def extract_policy_rules(self, policy_details_tuple, mapping_type, mapping_idx, rule_keys=None):
+        """
+        Builds the policy of one mapping type, as defined by its framework in the frameworks registry. The source
+        policy details are left untouched, so one fetched policy can feed every mapping type.
+        """
+        mapped_policy = self.annotate_policy_rules(policy_details_tuple, mapping_idx, frameworks.get(mapping_type),
+                                                   rule_keys)
+        self.metrics.count("rules_in", len(policy_details_tuple[0]['policy']['rules']), mapping_type=mapping_type)
+        self.metrics.count("rules_out", len(mapped_policy['policy']['rules']), mapping_type=mapping_type)
+        return mapped_policy
+
+    def extract_policy_rules_from_stream(self, policy_rules, mapping_idxs):
+        """
+        Builds the policy of every mapping type in a single pass over streamed policy rules.
+
+        Args:
+            policy_rules (JSONArrayStream): Rules of the source policy, its document holding the policy metadata
+            mapping_idxs (dict): Mapping type -> MappingIndex
 
-    def extract_policy_rules_have_nist(self, policy_details_tuple, cp_rule_id_lst, fltrd_nistrule_lst):
+        Returns:
+            dict mapping type -> mapped policy
+        """
+        joins = [(frameworks.get(mapping_type), mapping_idx, []) for mapping_type, mapping_idx in mapping_idxs.items()]
+        rules_in = 0
+        for rule in policy_rules:
+            rules_in += 1
+            key = rule_key(rule.get('cp_rule_id'))
+            for framework, mapping_idx, plc_rules_lst in joins:
+                ruleinfo_elmnt = mapping_idx.get(key)
+                if ruleinfo_elmnt is not None:
+                    plc_rules_lst.append(framework.annotate_rule(rule, ruleinfo_elmnt))
+        mapped_policies = {}
+        for (framework, _, plc_rules_lst), mapping_type in zip(joins, mapping_idxs):
+            mapped_policies[mapping_type] = self.build_mapped_policy(policy_rules.document, plc_rules_lst,
+                                                                     framework.policy_name_prefix)
+            self.metrics.count("rules_in", rules_in, mapping_type=mapping_type)
+            self.metrics.count("rules_out", len(plc_rules_lst), mapping_type=mapping_type)
+        return mapped_policies
+
+    def extract_policy_rules_have_pci(self, policy_details_tuple, mapping_idx):
+        return self.annotate_policy_rules(policy_details_tuple, mapping_idx, frameworks.get(MappingType.pci.value))
+
+    def extract_policy_rules_have_hipaa(self, policy_details_tuple, mapping_idx):
+        return self.annotate_policy_rules(policy_details_tuple, mapping_idx, frameworks.get(MappingType.hipaa.value))
+
+    def extract_policy_rules_have_nist(self, policy_details_tuple, mapping_idx):
+        return self.annotate_policy_rules(policy_details_tuple, mapping_idx, frameworks.get(MappingType.nist.value))
+
+    def annotate_policy_rules(self, policy_details_tuple, mapping_idx, framework, rule_keys=None):
+        """
+        Keeps only the policy rules found in the mapping index and annotates them with the mapping info.
+
+        The source policy details are not modified: annotated rules and the new policy are shallow copies, so the
+        same fetched policy can be mapped to several mapping types.
+
+        Args:
+            policy_details_tuple (tuple): Result of get_configuration_policy_details
+            mapping_idx (MappingIndex): Mapping records keyed by canonical CP rule ID
+            framework (Framework): Framework defining the rule user_notes, rule name and policy name
+            rule_keys (list): policy_rule_keys of the policy details, computed here when None
+        """
         policy_details = policy_details_tuple[0]
-        rule_id_lst_has_nist = cp_rule_id_lst
+        if rule_keys is None:
+            rule_keys = self.policy_rule_keys(policy_details)
+        lookup = mapping_idx.get
+        annotate_rule = framework.annotate_rule
         plc_rules_lst = []
-        for rule in policy_details['policy']['rules']:
-            current_rule_id = rule.get('cp_rule_id')
-            current_rule_name = rule.get('name')
-            if current_rule_id in rule_id_lst_has_nist:
-                for nist_ruleinfo_elmnt in fltrd_nistrule_lst:
-                    if nist_ruleinfo_elmnt[0] == current_rule_id:
-                        rule.update(
-                            user_notes='NIST Req: ' + nist_ruleinfo_elmnt[1] + ', NIST_Title: ' + nist_ruleinfo_elmnt[
-                                2] + ', NIST_Description: ' + nist_ruleinfo_elmnt[3])
-                        rule.update(name='NIST-' + nist_ruleinfo_elmnt[1] + '-' + current_rule_name)
-                plc_rules_lst.append(rule)
+        for rule, key in zip(policy_details['policy']['rules'], rule_keys):
+            ruleinfo_elmnt = lookup(key)
+            if ruleinfo_elmnt is not None:
+                plc_rules_lst.append(annotate_rule(rule, ruleinfo_elmnt))
+        return self.build_mapped_policy(policy_details, plc_rules_lst, framework.policy_name_prefix)
+
+    @classmethod
+    def build_mapped_policy(cls, policy_details, plc_rules_lst, policy_name_prefix):
         current_time = utility.Utility.date_to_iso8601(datetime.now())
-        policy_details['policy']['name'] = "NIST_" + self.target_policy_name + "_" + current_time
-        policy_details['policy']['rules'] = plc_rules_lst
-        return policy_details
+        policy = dict(policy_details['policy'])
+        policy['name'] = policy_name_prefix + policy_details['policy']['name'] + "_" + current_time
+        policy['rules'] = plc_rules_lst
+        return dict(policy_details, policy=policy)
 
     def credentials_work(self):
 
         """
-        Attempts to authenticate against Halo API
+        Attempts to authenticate against Halo API, False when no token is obtained (refused connection, bad keys)
         """
-
-        good = True
-        try:
-            self.authenticate_client()
-        except cloudpassage.CloudPassageAuthentication:
-            good = False
-        return good
+        return self.authenticate_client() is not None
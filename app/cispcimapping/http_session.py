@@ -0,0 +1,150 @@
+import email.utils
+import random
+import time
+
+import urllib3
+
+from . import metrics
+from . import rate_limiter
+from . import utility
+
+# Responses retried for every method: the server did not process the request.
+RETRY_STATUSES_ALL_METHODS = frozenset([429, 503])
+# Responses retried for idempotent methods only, a POST may have been processed.
+RETRY_STATUSES_IDEMPOTENT = frozenset([500, 502, 504])
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+
+
+class HTTPSession(object):
+    """
+    Pooled, keep-alive HTTP(S) session shared by all the Halo API calls.
+
+    Connections are kept open per host and reused by later requests, so
+    repeated calls to the Halo API only pay the TCP and TLS handshake once per
+    pooled connection. The session is safe to share between threads.
+
+    Failed requests are retried with exponential backoff and full jitter.
+    429 and 503 responses are retried for every method, honouring their
+    Retry-After header, and a 429 also pauses the shared rate limiter so all
+    workers slow down together. 500/502/504 responses and read errors are only
+    retried for idempotent methods, because a POST may already have created
+    its policy; connection errors are retried for every method.
+
+    Attributes:
+        pool_size (int): Number of connections kept open per host
+        connect_timeout (float): Seconds to wait for a connection
+        read_timeout (float): Seconds to wait for response data
+        rate_limiter (RateLimiter): Limits the requests per second sent through the session
+        retries (int): Number of retries after the first attempt
+        backoff_factor (float): Backoff before the first retry, doubled for each following retry
+        backoff_max (float): Maximum backoff, also bounding Retry-After
+        metrics (Metrics): Records a span per request, with its status, response bytes and retries
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=10.0, read_timeout=60.0, requests_per_second=0, retries=3,
+                 backoff_factor=0.5, backoff_max=30.0, metrics_obj=None):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_manager = urllib3.PoolManager(
+            maxsize=pool_size,
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+            retries=False)
+        self.rate_limiter = rate_limiter.RateLimiter(requests_per_second)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.metrics = metrics_obj or metrics.Metrics()
+
+    def request(self, method, url, headers=None, body=None, timeout=None, preload_content=True):
+        """
+        Sends a request over a pooled connection, retrying transient failures.
+
+        Args:
+            timeout (float): Overrides the session connect and read timeouts for this request
+            preload_content (bool): False to return the response unread, for streaming its body. The caller must
+                then read it to the end or release its connection.
+
+        Returns:
+            urllib3.HTTPResponse, for any HTTP status code
+
+        Raises:
+            urllib3.exceptions.HTTPError: when the request could not be sent or no response was received
+        """
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = urllib3.Timeout(connect=timeout, read=timeout)
+        attempt = 0
+        with self.metrics.http_span(method, url) as span:
+            while True:
+                self.rate_limiter.acquire()
+                try:
+                    response = self.pool_manager.urlopen(method, url, body=body, headers=headers or {},
+                                                         preload_content=preload_content, **kwargs)
+                except urllib3.exceptions.HTTPError as e:
+                    if attempt >= self.retries or not self.is_retryable_error(method, e):
+                        span.set(retries=attempt)
+                        raise
+                    reason = e
+                    delay = self.backoff(attempt)
+                else:
+                    if attempt >= self.retries or not self.is_retryable_status(method, response.status):
+                        self.metrics.record_http_response(span, response.status, self.response_bytes(
+                            response, preload_content), attempt)
+                        return response
+                    reason = "HTTP %d" % response.status
+                    delay = max(self.backoff(attempt), self.retry_after(response))
+                    if not preload_content:
+                        response.drain_conn()
+                        response.release_conn()
+                    if response.status == 429:
+                        self.rate_limiter.pause(delay)
+                attempt += 1
+                utility.Utility.log_stderr("Retrying %s '%s' in %.2fs (retry %d/%d): %s" % (
+                    method, url, delay, attempt, self.retries, reason))
+                time.sleep(delay)
+
+    @classmethod
+    def is_retryable_error(cls, method, error):
+        if isinstance(error, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError)):
+            return True
+        return method in IDEMPOTENT_METHODS and isinstance(
+            error, (urllib3.exceptions.ProtocolError, urllib3.exceptions.ReadTimeoutError))
+
+    @classmethod
+    def is_retryable_status(cls, method, status):
+        if status in RETRY_STATUSES_ALL_METHODS:
+            return True
+        return method in IDEMPOTENT_METHODS and status in RETRY_STATUSES_IDEMPOTENT
+
+    @classmethod
+    def response_bytes(cls, response, preload_content=True):
+        """Size of the response body: the preloaded data, or the Content-Length of a streamed response."""
+        if preload_content:
+            return len(response.data or b"")
+        try:
+            return int(response.headers.get("Content-Length", 0))
+        except ValueError:
+            return 0
+
+    def backoff(self, attempt):
+        """Full jitter exponential backoff: a random delay up to backoff_factor * 2 ** attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+
+    def retry_after(self, response):
+        """Returns the delay requested by the Retry-After header in seconds, 0 if there is none."""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return 0
+        try:
+            delay = float(value)
+        except ValueError:
+            retry_date = email.utils.parsedate_tz(value)
+            if retry_date is None:
+                return 0
+            delay = email.utils.mktime_tz(retry_date) - time.time()
+        return min(self.backoff_max, max(0, delay))
+
+    def clear(self):
+        """Closes every pooled connection."""
+        self.pool_manager.clear()
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from . import utility
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS units (
+    job_id TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    source_policy_id TEXT NOT NULL,
+    mapping_type TEXT NOT NULL,
+    state TEXT NOT NULL,
+    derived_policy_id TEXT,
+    derived_policy_name TEXT,
+    derived_policy_parts TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (job_id, tenant, source_policy_id, mapping_type)
+);
+"""
+
+
+class JobJournal(object):
+    """
+    SQLite journal of the units of the bulk and fan-out runs, making them resumable.
+
+    A unit is one (tenant, source policy, mapping type) of a job. Its state
+    ('done' or 'failed') and the ID of the derived policy are committed as
+    soon as the derived policy is published, so a run killed halfway (network
+    failure, expired token, OOM kill) leaves a journal of the units already
+    published. A run of the same job that was not completed resumes it: the
+    done units are skipped, without fetching their source policy again, and
+    only the failed and missing ones are mapped. Once a job completes, the
+    next run of the same job starts afresh.
+
+    Attributes:
+        journal_file (str): Path of the SQLite database
+    """
+
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        journal_dir = os.path.dirname(os.path.abspath(journal_file))
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(journal_file, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            self.connection.commit()
+
+    @classmethod
+    def job_key(cls, *selection):
+        """Returns a job ID derived from what a run selects, so running the same selection again resumes it."""
+        data = json.dumps(selection, sort_keys=True, separators=(',', ':')).encode("utf-8")
+        return hashlib.sha1(data).hexdigest()[:16]
+
+    @classmethod
+    def now(cls):
+        return utility.Utility.date_to_iso8601(datetime.now())
+
+    def begin(self, job_id, resume=True):
+        """
+        Starts a job, resuming it when a previous run of it did not complete.
+
+        Returns:
+            number of done units carried over from the interrupted run
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            done = 0
+            if row is not None and row[0] != 'completed' and resume:
+                done = self.connection.execute("SELECT COUNT(*) FROM units WHERE job_id = ? AND state = 'done'",
+                                               (job_id,)).fetchone()[0]
+                self.connection.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE job_id = ?",
+                                        (self.now(), job_id))
+            else:
+                self.connection.execute("DELETE FROM units WHERE job_id = ?", (job_id,))
+                self.connection.execute("INSERT OR REPLACE INTO jobs VALUES (?, 'running', ?, ?)",
+                                        (job_id, self.now(), self.now()))
+            self.connection.commit()
+        if done:
+            utility.Utility.log_stdout("Resuming job [%s]: %d units already done" % (job_id, done))
+        return done
+
+    def finish(self, job_id, success):
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                                    ('completed' if success else 'failed', self.now(), job_id))
+            self.connection.commit()
+
+    def job(self, job_id, tenant=""):
+        """Returns the view of the journal used by the BulkMapper of one tenant of a job."""
+        return JournaledJob(self, job_id, tenant)
+
+    def done_units(self, job_id, tenant, source_policy_id):
+        """
+        Returns:
+            dict mapping type -> {'id', 'name', 'parts'} of the derived policy, of the done units of a source policy
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT mapping_type, derived_policy_id, derived_policy_name, derived_policy_parts FROM units "
+                "WHERE job_id = ? AND tenant = ? AND source_policy_id = ? AND state = 'done'",
+                (job_id, tenant, source_policy_id)).fetchall()
+        return dict((mapping_type, {'id': policy_id, 'name': policy_name, 'parts': json.loads(parts or "[]")})
+                    for mapping_type, policy_id, policy_name, parts in rows)
+
+    def record(self, job_id, tenant, result):
+        """Commits the state of the unit of a BulkMapper result."""
+        state = 'done' if result['status'] == 'success' else 'failed'
+        unit_key = (job_id, tenant, str(result['policy_id']), result['mapping_type'])
+        values = (state, result['generated_policy_id'], result['generated_policy_name'],
+                  json.dumps(result['generated_policy_parts']), result['error'], self.now())
+        with self.lock:
+            # UPDATE then INSERT rather than an upsert, which needs SQLite 3.24
+            cursor = self.connection.execute(
+                "UPDATE units SET state = ?, derived_policy_id = ?, derived_policy_name = ?, derived_policy_parts = ?, "
+                "error = ?, updated_at = ?, attempts = attempts + 1 "
+                "WHERE job_id = ? AND tenant = ? AND source_policy_id = ? AND mapping_type = ?", values + unit_key)
+            if cursor.rowcount == 0:
+                self.connection.execute(
+                    "INSERT INTO units (job_id, tenant, source_policy_id, mapping_type, state, derived_policy_id, "
+                    "derived_policy_name, derived_policy_parts, error, updated_at, attempts) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)", unit_key + values)
+            self.connection.commit()
+
+    def units(self, job_id):
+        """Returns every unit of a job as dicts, for reporting."""
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT * FROM units WHERE job_id = ? ORDER BY tenant, source_policy_id, mapping_type", (job_id,))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class JournaledJob(object):
+    """
+    Journal of the units of one tenant of a job.
+
+    Attributes:
+        journal (JobJournal): Journal of every job
+        job_id (str): ID of the job
+        tenant (str): Tenant name, empty outside of the fan-out runs
+    """
+
+    def __init__(self, journal, job_id, tenant=""):
+        self.journal = journal
+        self.job_id = job_id
+        self.tenant = tenant
+
+    def done_units(self, source_policy_id):
+        return self.journal.done_units(self.job_id, self.tenant, str(source_policy_id))
+
+    def record(self, result):
+        self.journal.record(self.job_id, self.tenant, result)
@@ -0,0 +1,118 @@
+import codecs
+import json
+import re
+
+WHITESPACE_OR_COMMA = re.compile(r'[\s,]*')
+
+
+class JSONArrayStream(object):
+    """
+    Incremental parser yielding the items of one array of a JSON document.
+
+    The document is read chunk by chunk (bytes, UTF-8). Until the array at
+    ``path`` is reached the text is kept as the document prefix; the array
+    items are then decoded one at a time with json.JSONDecoder.raw_decode and
+    yielded, keeping only the unparsed tail of the current chunk in memory.
+    Once the iteration is over, ``document`` holds the rest of the document
+    (prefix and suffix) with an empty array in place of the streamed one.
+
+        stream = JSONArrayStream(response.stream(65536), ('policy', 'rules'))
+        for rule in stream:
+            ...
+        stream.document['policy']['name']
+
+    Attributes:
+        path (tuple): Object keys leading to the streamed array
+        document (dict): Document without the streamed items, set when the iteration is over
+    """
+
+    def __init__(self, chunks, path):
+        self.chunks = iter(chunks)
+        self.path = list(path)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.document = None
+        self.eof = False
+
+    def read(self):
+        """Returns the next decoded text chunk, "" at the end of the document."""
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                return text
+        if not self.eof:
+            self.eof = True
+            return self.decoder.decode(b"", True)
+        return ""
+
+    def find_array(self, buf):
+        """
+        Scans the document until the opening bracket of the streamed array.
+
+        Returns:
+            (text read so far, index of the opening bracket or None when the document has no such array)
+        """
+        # Stack of open containers: [bracket, current key, expecting a key]
+        frames = []
+        in_string = False
+        string_start = 0
+        i = 0
+        while True:
+            if i >= len(buf) or (in_string and buf[i] == '\\' and i + 1 >= len(buf)):
+                text = self.read()
+                if not text:
+                    return buf, None
+                buf += text
+                continue
+            c = buf[i]
+            if in_string:
+                if c == '\\':
+                    i += 2
+                    continue
+                if c == '"':
+                    in_string = False
+                    if frames and frames[-1][0] == '{' and frames[-1][2]:
+                        frames[-1][1] = json.loads(buf[string_start - 1:i + 1])
+            elif c == '"':
+                in_string = True
+                string_start = i + 1
+            elif c == '[' and frames and not frames[-1][2] and all(frame[0] == '{' for frame in frames) and [
+                    frame[1] for frame in frames] == self.path:
+                return buf, i
+            elif c in '{[':
+                frames.append([c, None, c == '{'])
+            elif c in '}]':
+                frames.pop()
+            elif c == ':':
+                frames[-1][2] = False
+            elif c == ',' and frames[-1][0] == '{':
+                frames[-1][2] = True
+            i += 1
+
+    def __iter__(self):
+        buf, start = self.find_array("")
+        if start is None:
+            self.document = json.loads(buf)
+            return
+        prefix = buf[:start]
+        buf = buf[start + 1:]
+        pos = 0
+        while True:
+            pos = WHITESPACE_OR_COMMA.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == ']':
+                break
+            try:
+                item, end = self.json_decoder.raw_decode(buf, pos)
+                complete = end < len(buf) or self.eof
+            except ValueError:
+                complete = False
+                if self.eof:
+                    raise
+            if not complete:
+                # Item cut by the end of the chunk: drop the consumed text and read on
+                buf = buf[pos:] + self.read()
+                pos = 0
+                continue
+            pos = end
+            yield item
+        self.document = json.loads(prefix + "[]" + buf[pos + 1:] + "".join(iter(self.read, "")))
@@ -0,0 +1,82 @@
+import glob
+import hashlib
+import os
+import pickle
+import tempfile
+
+from . import utility
+
+
+class MappingCache(object):
+    """
+    Persistent on-disk cache of the mapping records extracted from the mapping document.
+
+    One cache entry is kept per (mapping file path, sheet name, mapping type). The entry stores the records together
+    with the size, mtime and SHA-256 of the mapping file they were extracted from, and is only used while all three
+    still match, so warm runs skip the openpyxl parsing entirely. The cached records are the ones cleaned by the
+    SheetValidator. Entries are pickled (binary) and replaced atomically, so concurrent runs sharing the cache
+    directory never read a partial entry.
+
+    Attributes:
+        cache_dir (str): Directory holding the cache entries
+    """
+
+    entry_suffix = ".mapping.pickle"
+    # Version of the cached records, entries of another version are ignored (3: validated records, trimmed only)
+    entry_format = 3
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def fingerprint(cls, excel_file_path):
+        """Returns (size, mtime_ns, sha256) of the mapping file."""
+        stat = os.stat(excel_file_path)
+        sha256 = hashlib.sha256()
+        with open(excel_file_path, "rb") as fh:
+            for block in iter(lambda: fh.read(1024 * 1024), b""):
+                sha256.update(block)
+        return stat.st_size, stat.st_mtime_ns, sha256.hexdigest()
+
+    def entry_path(self, excel_file_path, sheet_name, mapping_type):
+        entry_key = "\0".join([os.path.abspath(excel_file_path), sheet_name, mapping_type])
+        entry_name = hashlib.sha1(entry_key.encode("utf-8")).hexdigest() + self.entry_suffix
+        return os.path.join(self.cache_dir, entry_name)
+
+    def load(self, excel_file_path, sheet_name, mapping_type, fingerprint):
+        """
+        Returns the cached mapping records, or None if there is no valid entry for this mapping file.
+        """
+        entry_path = self.entry_path(excel_file_path, sheet_name, mapping_type)
+        try:
+            with open(entry_path, "rb") as fh:
+                entry = pickle.load(fh)
+        except (IOError, OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if entry.get('fingerprint') != fingerprint or entry.get('format') != self.entry_format:
+            return None
+        return entry['records']
+
+    def store(self, excel_file_path, sheet_name, mapping_type, fingerprint, records):
+        entry_path = self.entry_path(excel_file_path, sheet_name, mapping_type)
+        entry = {'file': os.path.abspath(excel_file_path), 'sheet_name': sheet_name, 'mapping_type': mapping_type,
+                 'fingerprint': fingerprint, 'format': self.entry_format, 'records': records}
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(entry, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, entry_path)
+        except (IOError, OSError) as e:
+            utility.Utility.log_stderr("Failed to write mapping cache entry '%s': %s" % (entry_path, e))
+
+    def invalidate(self):
+        """
+        Removes every cache entry and returns the number of removed entries.
+        """
+        removed = 0
+        for entry_path in glob.glob(os.path.join(self.cache_dir, "*" + self.entry_suffix)):
+            os.remove(entry_path)
+            removed += 1
+        return removed
@@ -0,0 +1,191 @@
+import sys
+
+from . import utility
+from .sheet_validator import rule_key
+
+
+class MappingRecord(object):
+    """
+    One mapping document record: a CloudPassage rule ID and the framework requirement it maps to.
+
+    Records are slotted (no per record __dict__) and hold interned strings, so
+    the requirement numbers and titles repeated over many rules are stored
+    once. A record still reads like the original [cp_rule_id, req_no, title,
+    description] list: record[1] is the requirement number.
+
+    Attributes:
+        cp_rule_id (str): CloudPassage rule ID, i.e. 'CIS:Ubuntu18.04:1.1.1.1'
+        req_no (str): Framework requirement number
+        title (str): Framework requirement title
+        description (str): Framework requirement description
+    """
+
+    __slots__ = ('cp_rule_id', 'req_no', 'title', 'description')
+
+    def __init__(self, cp_rule_id, req_no, title, description):
+        self.cp_rule_id = sys.intern(cp_rule_id)
+        self.req_no = sys.intern(req_no)
+        self.title = sys.intern(title)
+        self.description = sys.intern(description)
+
+    @classmethod
+    def from_elmnt(cls, fltrd_info_elmnt):
+        if isinstance(fltrd_info_elmnt, cls):
+            return fltrd_info_elmnt
+        return cls(*[str(value) for value in fltrd_info_elmnt[:4]])
+
+    def __getitem__(self, i):
+        return getattr(self, self.__slots__[i])
+
+    def __iter__(self):
+        return iter((self.cp_rule_id, self.req_no, self.title, self.description))
+
+    def __len__(self):
+        return 4
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "MappingRecord(%r, %r, %r, %r)" % tuple(self)
+
+
+class MappingIndex(object):
+    """
+    Index of the mapping document records keyed by canonical CloudPassage rule ID.
+
+    The index is built once from the filtered mapping records and shared by
+    the rule extraction of every framework so each policy rule costs a single
+    dictionary lookup instead of a scan over the mapping records. Records are
+    keyed by rule_key, so a rule ID matches whatever its case or surrounding
+    whitespace. get and ``in`` take that canonical key as is: the rule IDs of
+    a source policy are normalized once, when its rules are read (see
+    HaloAPICaller.policy_rule_keys), and every mapping type looks them up
+    without normalizing them again. find normalizes a single rule ID.
+
+    Duplicate rule IDs: when the mapping document holds more than one record
+    for the same rule ID, the last record wins (this matches the behaviour of
+    the original nested scan). Every duplicate is kept in ``duplicates`` so it
+    can be reported instead of being dropped silently.
+
+    Attributes:
+        records (dict): Canonical rule ID (rule_key) -> MappingRecord
+        duplicates (dict): Canonical rule ID (rule_key) -> list of all records seen for that ID, only for rule IDs
+            appearing more than once.
+    """
+
+    def __init__(self, fltrd_info_lst=None):
+        self.records = {}
+        self.duplicates = {}
+        for fltrd_info_elmnt in fltrd_info_lst or []:
+            self.add(fltrd_info_elmnt)
+
+    def add(self, fltrd_info_elmnt):
+        record = MappingRecord.from_elmnt(fltrd_info_elmnt)
+        key = rule_key(record.cp_rule_id)
+        previous = self.records.get(key)
+        if previous is not None:
+            self.duplicates.setdefault(key, [previous]).append(record)
+        self.records[key] = record
+
+    def get(self, key):
+        """Returns the record of a canonical rule ID (rule_key), or None."""
+        return self.records.get(key)
+
+    def find(self, cp_rule_id):
+        """Returns the record of a rule ID spelled in any way, or None."""
+        return self.records.get(rule_key(cp_rule_id))
+
+    def report_duplicates(self, mapping_type):
+        for elmnts in self.duplicates.values():
+            utility.Utility.log_stderr("Duplicate %s mapping records for rule [%s], using Req [%s] (%d records)" % (
+                mapping_type, elmnts[0].cp_rule_id, elmnts[-1][1], len(elmnts)))
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def __len__(self):
+        return len(self.records)
+
+
+class MappingTable(object):
+    """
+    Mapping records of several frameworks (mapping types), one MappingIndex per framework.
+
+    Meant to hold the mappings of every framework, and of several mapping
+    documents, in one long-lived process: records are slotted and their
+    strings interned, so a requirement title repeated over many rules and
+    frameworks is stored once.
+
+    Attributes:
+        indexes (dict): Mapping type -> MappingIndex
+    """
+
+    def __init__(self):
+        self.indexes = {}
+
+    @classmethod
+    def from_records(cls, records):
+        """Builds a table from the mapping records of every mapping type, i.e. ExcelHandler.load_mapping_records."""
+        table = cls()
+        for mapping_type, fltrd_info_lst in records.items():
+            table.add_records(mapping_type, fltrd_info_lst)
+        return table
+
+    def add_records(self, mapping_type, fltrd_info_lst):
+        mapping_idx = self.indexes.setdefault(mapping_type, MappingIndex())
+        for fltrd_info_elmnt in fltrd_info_lst:
+            mapping_idx.add(fltrd_info_elmnt)
+        return mapping_idx
+
+    def index(self, mapping_type):
+        return self.indexes[mapping_type]
+
+    def mapping_types(self):
+        return list(self.indexes)
+
+    def get(self, cp_rule_id, mapping_type=None):
+        """
+        Returns the record of a rule ID, spelled in any way, for one mapping type, or a dict mapping type -> record
+        of every framework mapping the rule when no mapping type is given.
+        """
+        key = rule_key(cp_rule_id)
+        if mapping_type is not None:
+            mapping_idx = self.indexes.get(mapping_type)
+            return mapping_idx.get(key) if mapping_idx is not None else None
+        return dict((mapping_type, mapping_idx.get(key)) for mapping_type, mapping_idx in self.indexes.items()
+                    if key in mapping_idx)
+
+    def iter_framework(self, mapping_type):
+        """Yields the records of one mapping type."""
+        return iter(self.indexes.get(mapping_type, ()))
+
+    def memory_usage(self):
+        """
+        Returns the approximate memory held by the table: {'records', 'unique_strings', 'bytes'}, counting every
+        distinct string once.
+        """
+        total = sys.getsizeof(self.indexes)
+        records = {}
+        strings = {}
+        for mapping_idx in self.indexes.values():
+            total += sys.getsizeof(mapping_idx.records) + sum(
+                sys.getsizeof(elmnts) for elmnts in mapping_idx.duplicates.values())
+            for record_list in [list(mapping_idx.records.values())] + list(mapping_idx.duplicates.values()):
+                for record in record_list:
+                    records[id(record)] = record
+        for record in records.values():
+            total += sys.getsizeof(record)
+            for value in record:
+                strings[id(value)] = value
+        total += sum(sys.getsizeof(value) for value in strings.values())
+        return {'records': len(records), 'unique_strings': len(strings), 'bytes': total}
+
+    def __len__(self):
+        return sum(len(mapping_idx) for mapping_idx in self.indexes.values())
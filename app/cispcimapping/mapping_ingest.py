@@ -0,0 +1,164 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from . import excel_handler
+from . import mapping_index
+from . import sheet_validator
+from . import utility
+
+MAPPING_FILE_PATTERNS = ("*.xlsx", "*.xlsm")
+
+
+def expand_mapping_sources(mapping_files, base_dir=""):
+    """
+    Expands a comma separated list of mapping workbooks, directories and glob patterns, relative to base_dir.
+
+    Returns:
+        sorted list of workbook paths, without duplicates
+    """
+    paths = set()
+    for item in mapping_files.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        item = os.path.join(base_dir, os.path.expanduser(item))
+        if os.path.isdir(item):
+            for pattern in MAPPING_FILE_PATTERNS:
+                paths.update(glob.glob(os.path.join(item, pattern)))
+        elif glob.has_magic(item):
+            paths.update(glob.glob(item))
+        else:
+            paths.add(item)
+    return sorted(os.path.abspath(path) for path in paths if not os.path.basename(path).startswith("~$"))
+
+
+def parse_mapping_sheet(excel_file_path, sheet_name, mapping_types, excel_engine_type):
+    """
+    Parses and validates one mapping sheet, in a process pool worker.
+
+    Returns:
+        (dict of mapping type -> list of clean [cp_rule_id, req_no, title, description], validation issues), or None
+        when the workbook has no such sheet
+    """
+    excel_handler_obj = excel_handler.ExcelHandler()
+    try:
+        df = excel_handler_obj.read_from_excel(sheet_name, os.path.basename(excel_file_path),
+                                               os.path.dirname(excel_file_path), excel_engine_type)
+    except ValueError:
+        return None
+    validator = sheet_validator.SheetValidator()
+    records = validator.normalize_all(excel_handler_obj.extract_all_mapping_records(df, mapping_types),
+                                      "%s:%s" % (os.path.basename(excel_file_path), sheet_name))
+    return records, validator.issues
+
+
+class MappingIngestor(object):
+    """
+    Loads the mapping records of several mapping workbooks/sheets into one MappingTable.
+
+    Parsing a workbook with openpyxl is CPU bound, so the sheets missing from
+    the mapping cache are parsed in parallel by a process pool: loading a
+    corpus of per OS workbooks takes about as long as its slowest workbook.
+    The parsed records are cached by the parent process only, and merged in
+    workbook/sheet order. A rule ID mapped differently by two sources is a
+    conflict: it is reported with both sources and the last source wins, as
+    for the duplicates of a single sheet.
+
+    Attributes:
+        workers (int): Number of worker processes, the sheets are parsed in the current process when 1
+        excel_engine_type (str): pandas Excel engine
+        cache (MappingCache): Mapping cache, None to always parse the workbooks
+        conflicts (list): Conflicts found by the last ingest, dicts of mapping_type, cp_rule_id, and the req_no and
+            source of both records
+        issues (list): SheetValidator issues of the sheets parsed by the last ingest
+    """
+
+    def __init__(self, workers=0, excel_engine_type="openpyxl", cache=None):
+        self.workers = int(workers) or os.cpu_count() or 1
+        self.excel_engine_type = excel_engine_type
+        self.cache = cache
+        self.conflicts = []
+        self.issues = []
+
+    def ingest(self, excel_file_paths, sheet_names, mapping_types):
+        """
+        Returns:
+            MappingTable of the mapping records of every (workbook, sheet) of the given mapping types
+        """
+        sources = [(excel_file_path, sheet_name) for excel_file_path in excel_file_paths
+                   for sheet_name in sheet_names]
+        records = dict((source, {}) for source in sources)
+        fingerprints = {}
+        if self.cache is not None:
+            for excel_file_path, sheet_name in sources:
+                if excel_file_path not in fingerprints:
+                    fingerprints[excel_file_path] = self.cache.fingerprint(excel_file_path)
+                for mapping_type in mapping_types:
+                    fltrd_info_lst = self.cache.load(excel_file_path, sheet_name, mapping_type,
+                                                     fingerprints[excel_file_path])
+                    if fltrd_info_lst is not None:
+                        records[(excel_file_path, sheet_name)][mapping_type] = fltrd_info_lst
+
+        missing = [(source, [mapping_type for mapping_type in mapping_types if mapping_type not in records[source]])
+                   for source in sources]
+        missing = [(source, missing_types) for source, missing_types in missing if missing_types]
+        self.issues = []
+        for (excel_file_path, sheet_name), parsed in zip([source for source, _ in missing], self.parse(missing)):
+            if parsed is None:
+                utility.Utility.log_stderr("Sheet [%s] not found in [%s], skipped" % (sheet_name, excel_file_path))
+                records[(excel_file_path, sheet_name)] = None
+                continue
+            parsed, issues = parsed
+            self.issues.extend(issues)
+            for mapping_type, fltrd_info_lst in parsed.items():
+                if self.cache is not None:
+                    self.cache.store(excel_file_path, sheet_name, mapping_type, fingerprints[excel_file_path],
+                                     fltrd_info_lst)
+                records[(excel_file_path, sheet_name)][mapping_type] = fltrd_info_lst
+        return self.merge([(source, records[source]) for source in sources if records[source] is not None],
+                          mapping_types)
+
+    def parse(self, missing):
+        """Parses the (source, missing mapping types) sheets, in worker processes when there is more than one."""
+        args = [(excel_file_path, sheet_name, missing_types, self.excel_engine_type)
+                for (excel_file_path, sheet_name), missing_types in missing]
+        workers = min(self.workers, len(args))
+        if workers <= 1:
+            return [parse_mapping_sheet(*arg) for arg in args]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(parse_mapping_sheet, *zip(*args)))
+
+    def merge(self, source_records, mapping_types):
+        """
+        Merges the records of every source into one MappingTable, recording the conflicts between sources.
+        Records repeated identically by several sources are kept once.
+        """
+        mapping_table = mapping_index.MappingTable()
+        self.conflicts = []
+        for mapping_type in mapping_types:
+            mapping_idx = mapping_table.add_records(mapping_type, [])
+            record_sources = {}
+            for (excel_file_path, sheet_name), records in source_records:
+                source = "%s:%s" % (os.path.basename(excel_file_path), sheet_name)
+                for fltrd_info_elmnt in records.get(mapping_type, []):
+                    record = mapping_index.MappingRecord.from_elmnt(fltrd_info_elmnt)
+                    key = sheet_validator.rule_key(record.cp_rule_id)
+                    previous = mapping_idx.get(key)
+                    previous_source = record_sources.get(key)
+                    if previous is not None and previous_source != source:
+                        if previous == record:
+                            continue
+                        self.conflicts.append({'mapping_type': mapping_type, 'cp_rule_id': record.cp_rule_id,
+                                               'req_no': previous.req_no, 'source': previous_source,
+                                               'other_req_no': record.req_no, 'other_source': source})
+                    mapping_idx.add(record)
+                    record_sources[key] = source
+        return mapping_table
+
+    def report_conflicts(self):
+        for conflict in self.conflicts:
+            utility.Utility.log_stderr(
+                "Conflicting %s mapping records for rule [%s]: Req [%s] in [%s], Req [%s] in [%s], using the last" % (
+                    conflict['mapping_type'], conflict['cp_rule_id'], conflict['req_no'], conflict['source'],
+                    conflict['other_req_no'], conflict['other_source']))
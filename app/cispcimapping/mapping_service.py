@@ -0,0 +1,340 @@
+import collections
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from . import bulk_mapper
+from . import frameworks
+from . import utility
+
+# Number of finished jobs kept for the /jobs endpoint
+FINISHED_JOBS_KEPT = 100
+
+
+class MappingService(object):
+    """
+    Resident mapping service running mapping jobs on demand and on a schedule.
+
+    The service keeps what a one-shot run pays for on every start: the parsed
+    mapping indexes (reloaded only when the mapping document changes), the
+    Halo API token and the pooled keep-alive connections of the HaloAPICaller.
+    Jobs are queued (bounded queue) and run by a fixed number of job workers,
+    each job mapping its source policies with a BulkMapper. The metrics of
+    the HaloAPICaller are reset when a job starts and reported (summary and
+    Prometheus textfile, the JSON log staying open) when it finishes; with
+    several job workers, jobs running at the same time share one report.
+
+    Attributes:
+        halo_api_caller (HaloAPICaller): Halo API caller shared by every job
+        load_mapping_indexes (callable): mapping types -> dict mapping type -> MappingIndex
+        mapping_file_path (str): Mapping document watched for changes, or a callable returning the list of mapping
+            workbooks (multi-workbook mode)
+        policy_publisher (PolicyPublisher): Publisher shared by every job (and its incremental mode state)
+        workers (int): Number of jobs run concurrently
+        bulk_workers (int): Number of source policies mapped concurrently within a job
+        schedule_interval (float): Seconds between two scheduled jobs, 0 to disable the schedule
+        scheduled_job (dict): Job request submitted by the schedule
+        jobs (OrderedDict): Job ID -> job dict, queued, running and recently finished
+    """
+
+    def __init__(self, halo_api_caller, load_mapping_indexes, mapping_file_path, policy_publisher_obj, workers=1,
+                 bulk_workers=4, queue_size=100, schedule_interval=0, scheduled_job=None):
+        self.halo_api_caller = halo_api_caller
+        self.load_mapping_indexes = load_mapping_indexes
+        self.mapping_file_path = mapping_file_path
+        self.policy_publisher = policy_publisher_obj
+        self.workers = max(1, int(workers))
+        self.bulk_workers = bulk_workers
+        self.schedule_interval = float(schedule_interval)
+        self.scheduled_job = scheduled_job
+        self.queue = queue.Queue(max(1, int(queue_size)))
+        self.lock = threading.Lock()
+        self.mapping_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.jobs = collections.OrderedDict()
+        self.mapping_idxs = {}
+        self.mapping_file_stat = None
+        self.threads = []
+        self.running_jobs = 0
+        self.running_jobs_success = True
+
+    def start(self, mapping_types):
+        """Warms the mapping indexes and the Halo API token, then starts the job workers and the schedule."""
+        self.mapping_indexes(mapping_types)
+        self.halo_api_caller.token_manager.get_token()
+        for i in range(self.workers):
+            self.start_thread(self.work, "mapping-job-worker-%d" % i)
+        if self.schedule_interval > 0 and self.scheduled_job is not None:
+            self.start_thread(self.schedule, "mapping-job-schedule")
+
+    def start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        for _ in range(self.workers):
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def mapping_indexes(self, mapping_types):
+        """
+        Returns the mapping indexes of the given mapping types, loading the missing ones and reloading them all
+        when the mapping document has changed since they were loaded.
+        """
+        with self.mapping_lock:
+            file_stat = self.mapping_file_stat_now()
+            if file_stat != self.mapping_file_stat:
+                if self.mapping_idxs:
+                    utility.Utility.log_stdout("Mapping document changed, reloading the mapping indexes")
+                mapping_types = list(mapping_types) + [mapping_type for mapping_type in self.mapping_idxs
+                                                       if mapping_type not in mapping_types]
+                self.mapping_idxs = {}
+                self.mapping_file_stat = file_stat
+            missing = [mapping_type for mapping_type in mapping_types if mapping_type not in self.mapping_idxs]
+            if missing:
+                self.mapping_idxs.update(self.load_mapping_indexes(missing))
+            return dict((mapping_type, self.mapping_idxs[mapping_type]) for mapping_type in mapping_types)
+
+    def mapping_file_stat_now(self):
+        """Returns the (path, size, mtime) of every mapping workbook, None for a missing workbook."""
+        if callable(self.mapping_file_path):
+            excel_file_paths = self.mapping_file_path()
+        else:
+            excel_file_paths = [self.mapping_file_path]
+        file_stat = []
+        for excel_file_path in excel_file_paths:
+            try:
+                stat = os.stat(excel_file_path)
+                file_stat.append((excel_file_path, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                file_stat.append(None)
+        return file_stat
+
+    def reload(self):
+        with self.mapping_lock:
+            mapping_types = list(self.mapping_idxs)
+            self.mapping_file_stat = None
+        return self.mapping_indexes(mapping_types)
+
+    def submit(self, policy_names=None, policy_pattern=None, mapping_types=None, trigger="api"):
+        """
+        Queues a mapping job.
+
+        Returns:
+            the job dict, or None when the queue is full
+        """
+        job = {'id': uuid.uuid4().hex,
+               'trigger': trigger,
+               'policy_names': list(policy_names or []),
+               'policy_pattern': policy_pattern or "",
+               'mapping_types': list(mapping_types or []),
+               'status': "queued",
+               'submitted_at': utility.Utility.date_to_iso8601(datetime.now()),
+               'started_at': None,
+               'finished_at': None,
+               'results': [],
+               'missing': [],
+               'error': None}
+        with self.lock:
+            try:
+                self.queue.put_nowait(job['id'])
+            except queue.Full:
+                return None
+            self.jobs[job['id']] = job
+            self.trim_jobs()
+        utility.Utility.log_stdout("Mapping job [%s] queued (%s)" % (job['id'], trigger))
+        return self.job_view(job)
+
+    def trim_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ("success", "failed")]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self.jobs[job_id]
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self.job_view(job) if job is not None else None
+
+    def list_jobs(self):
+        with self.lock:
+            return [self.job_view(job) for job in self.jobs.values()]
+
+    @classmethod
+    def job_view(cls, job):
+        return dict(job, results=list(job['results']))
+
+    def wait(self, job_id, timeout=None, poll_interval=0.1):
+        """Returns the job once finished, or its current state after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get_job(job_id)
+            if job is None or job['status'] in ("success", "failed"):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(poll_interval)
+
+    def status(self):
+        with self.lock:
+            statuses = [job['status'] for job in self.jobs.values()]
+        return {'status': "stopping" if self.stopped.is_set() else "running",
+                'queued': statuses.count("queued"),
+                'running': statuses.count("running"),
+                'workers': self.workers,
+                'mapping_types': sorted(self.mapping_idxs)}
+
+    def work(self):
+        while not self.stopped.is_set():
+            job_id = self.queue.get()
+            if job_id is None:
+                return
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    continue
+                job['status'] = "running"
+                job['started_at'] = utility.Utility.date_to_iso8601(datetime.now())
+                self.running_jobs += 1
+                if self.running_jobs == 1:
+                    self.running_jobs_success = True
+                    self.halo_api_caller.metrics.reset()
+            try:
+                self.run_job(job)
+            except Exception as e:
+                utility.Utility.log_stderr("Mapping job [%s] failed: %s" % (job_id, e))
+                with self.lock:
+                    job['status'] = "failed"
+                    job['error'] = str(e)
+            with self.lock:
+                job['finished_at'] = utility.Utility.date_to_iso8601(datetime.now())
+                self.running_jobs -= 1
+                self.running_jobs_success = self.running_jobs_success and job['status'] == "success"
+                report = self.running_jobs == 0
+                success = self.running_jobs_success
+            if report:
+                self.halo_api_caller.metrics.finish(success, close=False)
+
+    def run_job(self, job):
+        mapping_idxs = self.mapping_indexes(job['mapping_types'] or list(self.mapping_idxs))
+        bulk_mapper_obj = bulk_mapper.BulkMapper(self.halo_api_caller, mapping_idxs, self.bulk_workers,
+                                                 self.policy_publisher)
+        with self.halo_api_caller.metrics.span("stage", stage="policy_list"):
+            policies, missing = bulk_mapper_obj.select_policies(job['policy_names'], job['policy_pattern'])
+        for policy_name in missing:
+            utility.Utility.log_stderr("Mapping job [%s]: configuration policy [%s] not found!" % (
+                job['id'], policy_name))
+        results = bulk_mapper_obj.run(policies)
+        failed = [result for result in results if result['status'] != 'success']
+        with self.lock:
+            job['results'] = results
+            job['missing'] = missing
+            job['status'] = "failed" if failed or missing else "success"
+        utility.Utility.log_stdout("Mapping job [%s] finished: %d policies mapped, %d failed, %d not found" % (
+            job['id'], len(results) - len(failed), len(failed), len(missing)))
+
+    def schedule(self):
+        """Submits the scheduled job every schedule_interval seconds, unless the previous one is still pending."""
+        pending_job_id = None
+        while not self.stopped.wait(0 if pending_job_id is None else self.schedule_interval):
+            pending = self.get_job(pending_job_id) if pending_job_id else None
+            if pending is not None and pending['status'] in ("queued", "running"):
+                utility.Utility.log_stderr("Scheduled mapping job [%s] still %s, skipping this run" % (
+                    pending_job_id, pending['status']))
+                continue
+            job = self.submit(trigger="schedule", **self.scheduled_job)
+            pending_job_id = job['id'] if job is not None else ""
+
+
+class MappingServiceServer(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP trigger of a MappingService:
+
+        GET  /health          service status
+        GET  /jobs            queued, running and recently finished jobs
+        GET  /jobs/<id>       one job, with its per policy results
+        POST /jobs            queue a job: {"policy_names": [...], "policy_pattern": "...", "mapping_types": [...]}
+        POST /reload          reload the mapping indexes
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, service, host="127.0.0.1", port=8081):
+        HTTPServer.__init__(self, (host, port), MappingServiceHandler)
+        self.service = service
+
+
+class MappingServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        service = self.server.service
+        if path == "/health":
+            return self.respond(200, service.status())
+        if path == "/jobs":
+            return self.respond(200, {'jobs': service.list_jobs()})
+        if path.startswith("/jobs/"):
+            job = service.get_job(path[len("/jobs/"):])
+            if job is None:
+                return self.respond(404, {'error': "job not found"})
+            return self.respond(200, {'job': job})
+        return self.respond(404, {'error': "not found"})
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        service = self.server.service
+        if path == "/reload":
+            return self.respond(200, {'mapping_types': sorted(service.reload())})
+        if path != "/jobs":
+            return self.respond(404, {'error': "not found"})
+        try:
+            request = json.loads(body.decode("utf-8")) if body else {}
+        except ValueError as e:
+            return self.respond(400, {'error': "invalid job request: %s" % e})
+        if not isinstance(request, dict):
+            return self.respond(400, {'error': "invalid job request: a JSON object is expected"})
+        policy_names = request.get('policy_names') or []
+        policy_pattern = request.get('policy_pattern') or ""
+        mapping_types = request.get('mapping_types') or []
+        for field, value in (('policy_names', policy_names), ('mapping_types', mapping_types)):
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                return self.respond(400, {'error': "invalid job request: %s must be a list of strings" % field})
+        if not isinstance(policy_pattern, str):
+            return self.respond(400, {'error': "invalid job request: policy_pattern must be a string"})
+        mapping_types = [mapping_type.upper() for mapping_type in mapping_types]
+        supported_types = frameworks.names()
+        unsupported_types = [mapping_type for mapping_type in mapping_types if mapping_type not in supported_types]
+        if unsupported_types:
+            return self.respond(400, {'error': "unsupported mapping types: %s" % ", ".join(unsupported_types)})
+        if not policy_names and not policy_pattern:
+            return self.respond(400, {'error': "policy_names or policy_pattern is required"})
+        job = service.submit(policy_names, policy_pattern, mapping_types)
+        if job is None:
+            return self.respond(503, {'error': "job queue full"})
+        return self.respond(202, {'job': job})
+
+    def respond(self, status, obj):
+        data = json.dumps(obj, sort_keys=True).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
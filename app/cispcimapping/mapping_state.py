@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+from . import utility
+
+# Policy fields changing on every run or set by the Halo API, left out of the fingerprints.
+VOLATILE_POLICY_KEYS = frozenset(['id', 'name', 'url', 'created_at', 'updated_at', 'used_by', 'rules'])
+
+
+class MappingState(object):
+    """
+    Record of the derived policies generated by previous runs, used by the incremental mode.
+
+    For every (source policy, mapping type) the state keeps the ID and name of the derived policy and the
+    fingerprints of its content, so a run can tell whether the derived policy would change at all. A derived policy
+    split into parts has one entry per part ("<mapping type>#2"...), and the entry of its first part keeps the IDs of
+    all parts, so the parts left over when it shrinks can be retired. The state is a small JSON file rewritten
+    atomically after every change, and can be shared by the workers of a bulk run.
+
+    Attributes:
+        state_file (str): Path of the JSON state file
+        entries (dict): "<source policy id>|<mapping type>" -> entry dict
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.isfile(state_file):
+            try:
+                with open(state_file) as fh:
+                    self.entries = json.load(fh)
+            except (IOError, OSError, ValueError) as e:
+                utility.Utility.log_stderr("Ignoring unreadable mapping state '%s': %s" % (state_file, e))
+
+    @classmethod
+    def entry_key(cls, source_policy_id, mapping_type):
+        return "%s|%s" % (source_policy_id, mapping_type)
+
+    @classmethod
+    def fingerprint_value(cls, value):
+        data = json.dumps(value, sort_keys=True, separators=(',', ':')).encode("utf-8")
+        return hashlib.sha256(data).hexdigest()
+
+    @classmethod
+    def fingerprint_policy(cls, policy_details):
+        """
+        Returns (policy fingerprint, {cp_rule_id: rule fingerprint}) of a derived policy, ignoring its name, IDs and
+        timestamps.
+        """
+        policy = policy_details['policy']
+        rule_fingerprints = {}
+        for rule in policy['rules']:
+            rule_fingerprints[str(rule.get('cp_rule_id') or rule.get('name'))] = cls.fingerprint_value(rule)
+        policy_fields = dict((key, value) for key, value in policy.items() if key not in VOLATILE_POLICY_KEYS)
+        policy_fingerprint = cls.fingerprint_value([policy_fields, sorted(rule_fingerprints.items())])
+        return policy_fingerprint, rule_fingerprints
+
+    def get(self, source_policy_id, mapping_type):
+        with self.lock:
+            return self.entries.get(self.entry_key(source_policy_id, mapping_type))
+
+    def record(self, source_policy_id, mapping_type, derived_policy_id, derived_policy_name, policy_fingerprint,
+               rule_fingerprints):
+        with self.lock:
+            key = self.entry_key(source_policy_id, mapping_type)
+            entry = {
+                'derived_policy_id': derived_policy_id,
+                'derived_policy_name': derived_policy_name,
+                'fingerprint': policy_fingerprint,
+                'rule_fingerprints': rule_fingerprints,
+                'updated_at': utility.Utility.date_to_iso8601(datetime.now())}
+            part_ids = (self.entries.get(key) or {}).get('part_ids')
+            if part_ids:
+                entry['part_ids'] = part_ids
+            self.entries[key] = entry
+            self.save()
+
+    def record_parts(self, source_policy_id, mapping_type, part_ids):
+        """Keeps the derived policy IDs of every part of a split derived policy on the entry of its first part."""
+        with self.lock:
+            entry = self.entries.get(self.entry_key(source_policy_id, mapping_type))
+            if entry is None or entry.get('part_ids', []) == part_ids:
+                return
+            if part_ids:
+                entry['part_ids'] = part_ids
+            else:
+                entry.pop('part_ids', None)
+            self.save()
+
+    def stale_parts(self, source_policy_id, mapping_type, part_count):
+        """
+        Returns:
+            list of (part mapping type, derived policy id) of the parts of a previously split derived policy beyond
+            its first part_count parts
+        """
+        entry = self.get(source_policy_id, mapping_type) or {}
+        return [("%s#%d" % (mapping_type, i + 1), part_id)
+                for i, part_id in enumerate(entry.get('part_ids', [])) if i >= part_count]
+
+    def drop(self, source_policy_id, mapping_type):
+        with self.lock:
+            if self.entries.pop(self.entry_key(source_policy_id, mapping_type), None) is not None:
+                self.save()
+
+    def save(self):
+        state_dir = os.path.dirname(os.path.abspath(self.state_file))
+        try:
+            if not os.path.isdir(state_dir):
+                os.makedirs(state_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=state_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as fh:
+                json.dump(self.entries, fh, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.state_file)
+        except (IOError, OSError) as e:
+            utility.Utility.log_stderr("Failed to write mapping state '%s': %s" % (self.state_file, e))
+
+    @classmethod
+    def changed_rules(cls, old_rule_fingerprints, new_rule_fingerprints):
+        """Returns the rule keys added, removed or modified between two sets of rule fingerprints."""
+        keys = set(old_rule_fingerprints) | set(new_rule_fingerprints)
+        return sorted(key for key in keys if old_rule_fingerprints.get(key) != new_rule_fingerprints.get(key))
@@ -0,0 +1,234 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+from . import utility
+
+
+class Span(object):
+    """
+    Timed unit of work (a pipeline stage or an HTTP call), used as a context manager.
+
+    Attributes:
+        name (str): Span name, i.e. "stage" or "http_request"
+        labels (dict): Low cardinality labels, also used for the aggregated metrics
+        attributes (dict): Per span details (status, bytes, retries, error...), only logged
+    """
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.attributes = {}
+        self.start = None
+        self.started = None
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.started
+        if exc_type is not None:
+            self.attributes.setdefault('error', exc_type.__name__)
+        self.metrics.record_span(self)
+        return False
+
+
+class NullSpan(object):
+    """Span handed out while the metrics are disabled, doing nothing."""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Metrics(object):
+    """
+    Timings and counters of a mapping run.
+
+    Every finished span is written as one JSON line to the JSON log, and the
+    spans are aggregated per (name, labels) into duration summaries exported,
+    with the counters, as a Prometheus textfile (node_exporter textfile
+    collector format) by finish(). Disabled metrics hand out a shared no-op
+    span and ignore counters, so instrumented code costs one attribute check.
+
+    Attributes:
+        enabled (bool): Record the spans and counters
+        json_log (str): Path of the JSON lines log, "-" for stdout, empty for none
+        textfile (str): Path of the Prometheus textfile, empty for none
+        namespace (str): Prefix of the exported metric names
+    """
+
+    def __init__(self, enabled=False, json_log="-", textfile="", namespace="cispcimapping"):
+        self.enabled = enabled
+        self.json_log = json_log
+        self.textfile = textfile
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.durations = {}
+        self.counters = {}
+        self.json_log_fh = None
+
+    @classmethod
+    def label_key(cls, labels):
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @classmethod
+    def endpoint(cls, url):
+        """Returns the URL path with the resource IDs replaced, i.e. /v1/policies/{id}, as a bounded label."""
+        segments = [segment for segment in urllib.parse.urlparse(url).path.split("/") if segment]
+        return "/" + "/".join(segments[:2] + ["{id}"] * len(segments[2:]))
+
+    def span(self, name, **labels):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, labels)
+
+    def http_span(self, method, url):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, "http_request", {'method': method, 'endpoint': self.endpoint(url)})
+
+    def record_http_response(self, span, status, response_bytes, retries):
+        """Sets the response details on an HTTP span and counts the response, its bytes and the retries."""
+        if not self.enabled:
+            return
+        span.set(status=status, response_bytes=response_bytes, retries=retries)
+        self.count("http_responses", status=status, **span.labels)
+        self.count("http_response_bytes", response_bytes, **span.labels)
+        if retries:
+            self.count("http_retries", retries, **span.labels)
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, self.label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_span(self, span):
+        key = (span.name, self.label_key(span.labels))
+        with self.lock:
+            summary = self.durations.setdefault(key, [0, 0.0])
+            summary[0] += 1
+            summary[1] += span.duration
+        record = dict(span.labels, **span.attributes)
+        record.update(type="span", name=span.name, duration_seconds=round(span.duration, 6),
+                      start=utility.Utility.date_to_iso8601(datetime.fromtimestamp(span.start, timezone.utc)))
+        self.log_json(record)
+
+    def log_json(self, record):
+        if not self.json_log:
+            return
+        line = json.dumps(record, sort_keys=True, default=str) + "\n"
+        with self.lock:
+            try:
+                if self.json_log == "-":
+                    sys.stdout.write(line)
+                    return
+                if self.json_log_fh is None:
+                    self.json_log_fh = open(self.json_log, "a")
+                self.json_log_fh.write(line)
+            except (IOError, OSError) as e:
+                utility.Utility.log_stderr("Failed to write metrics log '%s': %s" % (self.json_log, e))
+                self.json_log = ""
+
+    def reset(self):
+        """Starts a new run of a long-lived process: clears the durations and counters, keeping the JSON log open."""
+        with self.lock:
+            self.started = time.time()
+            self.durations = {}
+            self.counters = {}
+
+    def finish(self, success=True, close=True):
+        """
+        Logs the counters and the run duration, and writes the Prometheus textfile. The JSON log is closed, unless
+        close is False (a long-lived process reporting every run, see reset).
+        """
+        if not self.enabled:
+            return
+        duration = time.time() - self.started
+        with self.lock:
+            counters = dict(("%s%s" % (name, "".join("|%s=%s" % label for label in labels)), value)
+                            for (name, labels), value in sorted(self.counters.items()))
+        self.log_json({'type': "summary", 'success': success, 'duration_seconds': round(duration, 6),
+                       'counters': counters})
+        if close:
+            self.close()
+        if self.textfile:
+            self.write_textfile(self.textfile, success, duration)
+
+    def close(self):
+        with self.lock:
+            if self.json_log_fh is not None:
+                self.json_log_fh.close()
+                self.json_log_fh = None
+
+    def prometheus_text(self, success=True, duration=None):
+        if duration is None:
+            duration = time.time() - self.started
+        prefix = self.namespace + "_"
+        lines = ["# TYPE %srun_success gauge" % prefix,
+                 "%srun_success %d" % (prefix, 1 if success else 0),
+                 "# TYPE %srun_duration_seconds gauge" % prefix,
+                 "%srun_duration_seconds %f" % (prefix, duration),
+                 "# TYPE %slast_run_timestamp_seconds gauge" % prefix,
+                 "%slast_run_timestamp_seconds %f" % (prefix, self.started)]
+        with self.lock:
+            durations = sorted(self.durations.items())
+            counters = sorted(self.counters.items())
+        last_name = None
+        for (name, labels), (count, total) in durations:
+            metric = "%s%s_duration_seconds" % (prefix, name)
+            if name != last_name:
+                lines.append("# TYPE %s summary" % metric)
+                last_name = name
+            lines.append("%s_sum%s %f" % (metric, self.format_labels(labels), total))
+            lines.append("%s_count%s %d" % (metric, self.format_labels(labels), count))
+        last_name = None
+        for (name, labels), value in counters:
+            metric = "%s%s_total" % (prefix, name)
+            if name != last_name:
+                lines.append("# TYPE %s counter" % metric)
+                last_name = name
+            lines.append("%s%s %s" % (metric, self.format_labels(labels), value))
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def format_labels(cls, labels):
+        if not labels:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (key, value.replace("\\", "\\\\").replace('"', '\\"').replace(
+            "\n", "\\n")) for key, value in labels)
+
+    def write_textfile(self, path, success=True, duration=None):
+        """Writes the Prometheus textfile atomically, so the collector never reads a partial file."""
+        text = self.prometheus_text(success, duration)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+            with os.fdopen(fd, "w") as fh:
+                fh.write(text)
+            os.replace(tmp_path, path)
+        except (IOError, OSError) as e:
+            utility.Utility.log_stderr("Failed to write metrics textfile '%s': %s" % (path, e))
+
@@ -0,0 +1,138 @@
+import json
+import os
+
+from . import utility
+from .sheet_validator import requirement_items
+
+# Output files written in the output directory, JSON Lines
+DERIVED_POLICIES_FILE = "derived_policies.jsonl"
+RULE_DIFF_FILE = "rule_diff.jsonl"
+COVERAGE_FILE = "coverage.jsonl"
+
+
+class OfflineMapper(object):
+    """
+    Dry run of the mapping over saved policy details, without any Halo API call.
+
+    Every saved policy details document (the JSON returned by
+    GET /v1/policies/<id>, a file or a directory of them) is mapped to every
+    mapping type with the same HaloAPICaller.extract_policy_rules as the live
+    run. Instead of being created, the derived policies are written to local
+    JSON Lines files together with a rule level diff and the per framework
+    coverage:
+
+        derived_policies.jsonl  one derived policy per (source policy, mapping type)
+        rule_diff.jsonl         one line per (source rule, mapping type): renamed (mapped, its name prefixed
+                                with the requirement) or dropped
+        coverage.jsonl          one line per (source policy, mapping type): rules and requirements covered,
+                                a cell holding several requirements counting each of them
+
+    Attributes:
+        halo_api_caller (HaloAPICaller): Used for the rule extraction only, never authenticated
+        mapping_idxs (dict): Mapping type -> MappingIndex
+        output_dir (str): Directory receiving the JSON Lines files
+        requirements (dict): Mapping type -> number of distinct requirements of the mapping index
+    """
+
+    def __init__(self, halo_api_caller, mapping_idxs, output_dir):
+        self.halo_api_caller = halo_api_caller
+        self.mapping_idxs = mapping_idxs
+        self.output_dir = output_dir
+        self.requirements = dict((mapping_type, len(set(req_no for record in mapping_idx
+                                                        for req_no in requirement_items(record.req_no))))
+                                 for mapping_type, mapping_idx in mapping_idxs.items())
+
+    @classmethod
+    def iter_policy_files(cls, input_path):
+        """Yields the saved policy details files: input_path itself, or every .json file below it."""
+        if not os.path.isdir(input_path):
+            yield input_path
+            return
+        for dir_path, dir_names, file_names in os.walk(input_path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith(".json"):
+                    yield os.path.join(dir_path, file_name)
+
+    @classmethod
+    def load_policy_details(cls, policy_file):
+        """Returns the policy details of a saved file, either {'policy': {...}} or the bare policy."""
+        with open(policy_file, "rb") as fh:
+            policy_details = json.loads(fh.read().decode("utf-8"))
+        if 'policy' not in policy_details:
+            policy_details = {'policy': policy_details}
+        policy_details['policy'].setdefault('rules', [])
+        return policy_details
+
+    def map_policy(self, policy_details, mapping_type, rule_keys=None):
+        """
+        Maps one source policy to one mapping type. rule_keys are the HaloAPICaller.policy_rule_keys of the policy,
+        computed here when None.
+
+        Returns:
+            (derived policy, rule diff dicts, coverage dict)
+        """
+        mapping_idx = self.mapping_idxs[mapping_type]
+        source_policy = policy_details['policy']
+        if rule_keys is None:
+            rule_keys = self.halo_api_caller.policy_rule_keys(policy_details)
+        mapped_policy = self.halo_api_caller.extract_policy_rules((policy_details, False), mapping_type, mapping_idx,
+                                                                  rule_keys)
+        derived_rules = iter(mapped_policy['policy']['rules'])
+        diff = []
+        covered = set()
+        for rule, key in zip(source_policy['rules'], rule_keys):
+            record = mapping_idx.get(key)
+            entry = {'source_policy_id': source_policy.get('id'), 'mapping_type': mapping_type,
+                     'cp_rule_id': rule.get('cp_rule_id'), 'rule_name': rule.get('name')}
+            if record is None:
+                entry['status'] = "dropped"
+            else:
+                derived_rule = next(derived_rules)
+                covered.update(requirement_items(record.req_no))
+                entry.update(status="renamed", derived_rule_name=derived_rule.get('name'), req_no=record.req_no)
+            diff.append(entry)
+        rules_kept = len(mapped_policy['policy']['rules'])
+        requirements_total = self.requirements[mapping_type]
+        coverage = {'source_policy_id': source_policy.get('id'), 'source_policy_name': source_policy.get('name'),
+                    'mapping_type': mapping_type, 'derived_policy_name': mapped_policy['policy']['name'],
+                    'rules_in': len(source_policy['rules']), 'rules_kept': rules_kept,
+                    'rules_dropped': len(source_policy['rules']) - rules_kept,
+                    'requirements_covered': len(covered), 'requirements_total': requirements_total,
+                    'coverage': round(float(len(covered)) / requirements_total, 4) if requirements_total else 0.0}
+        return mapped_policy, diff, coverage
+
+    def run(self, input_path):
+        """
+        Maps every saved policy below input_path and writes the JSON Lines files.
+
+        Returns:
+            dict with the number of 'policies' mapped, 'failed' files and 'derived' policies written
+        """
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        summary = {'policies': 0, 'failed': 0, 'derived': 0}
+        with open(os.path.join(self.output_dir, DERIVED_POLICIES_FILE), "w") as policies_fh, \
+                open(os.path.join(self.output_dir, RULE_DIFF_FILE), "w") as diff_fh, \
+                open(os.path.join(self.output_dir, COVERAGE_FILE), "w") as coverage_fh:
+            for policy_file in self.iter_policy_files(input_path):
+                try:
+                    policy_details = self.load_policy_details(policy_file)
+                except (IOError, OSError, ValueError, AttributeError, TypeError) as e:
+                    utility.Utility.log_stderr("Skipping unreadable policy details '%s': %s" % (policy_file, e))
+                    summary['failed'] += 1
+                    continue
+                summary['policies'] += 1
+                rule_keys = self.halo_api_caller.policy_rule_keys(policy_details)
+                for mapping_type in self.mapping_idxs:
+                    mapped_policy, diff, coverage = self.map_policy(policy_details, mapping_type, rule_keys)
+                    policies_fh.write(self.json_line({'source_file': policy_file, 'mapping_type': mapping_type,
+                                                      'policy': mapped_policy['policy']}))
+                    diff_fh.writelines(self.json_line(entry) for entry in diff)
+                    coverage_fh.write(self.json_line(dict(coverage, source_file=policy_file)))
+                    summary['derived'] += 1
+        return summary
+
+    @classmethod
+    def json_line(cls, obj):
+        return json.dumps(obj, sort_keys=True, separators=(',', ':')) + "\n"
@@ -0,0 +1,180 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from . import mapping_state
+from . import utility
+
+# Suffix of the name of a part of a split policy, i.e. " (2/3)" (see HaloAPICaller.split_policy)
+POLICY_PART_SUFFIX = re.compile(r' \(\d+/\d+\)$')
+
+
+class PolicyPublisher(object):
+    """
+    Publishes the derived PCI/HIPAA/NIST policies to the Halo API.
+
+    Without a mapping state every derived policy is created. With a mapping
+    state (incremental mode), a derived policy identical to the one generated
+    by the previous run is skipped, and a changed one replaces the previously
+    generated policy in place instead of adding a new policy to the account.
+    An updated policy keeps its name, with the part suffix of its new part
+    when it is split. When the update fails, the policy is created again and
+    the previous one is deleted, so no orphan is left with the same name.
+
+    Each derived policy is serialized once to its request body. A derived
+    policy over the payload limit of the HaloAPICaller is published as several
+    parts, each part being tracked by the mapping state on its own. When a
+    split derived policy needs fewer parts than on the previous run, the
+    parts left over are deleted (or reported when they cannot be). The
+    derived policies of one source policy can be published concurrently over
+    the pooled connections of the HaloAPICaller (publish_many).
+
+    Attributes:
+        halo_api_caller (HaloAPICaller): Authenticated Halo API caller
+        mapping_state (MappingState): State of the previous runs, None to always create
+        workers (int): Number of derived policies published concurrently by publish_many
+    """
+
+    def __init__(self, halo_api_caller, mapping_state=None, workers=1):
+        self.halo_api_caller = halo_api_caller
+        self.mapping_state = mapping_state
+        self.workers = max(1, int(workers))
+
+    def publish_many(self, items):
+        """
+        Publishes (source policy id, mapping type, mapped policy) items concurrently.
+
+        Returns:
+            list of outcome dicts (see publish), in the order of the items
+        """
+        if self.workers == 1 or len(items) < 2:
+            return [self.publish_safely(*item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as executor:
+            return list(executor.map(lambda item: self.publish_safely(*item), items))
+
+    def publish_safely(self, source_policy_id, mapping_type, mapped_policy):
+        metrics = self.halo_api_caller.metrics
+        try:
+            with metrics.span("stage", stage="publish", mapping_type=mapping_type) as span:
+                outcome = self.publish(source_policy_id, mapping_type, mapped_policy)
+                span.set(action=outcome['action'])
+        except Exception as e:
+            return self.outcome(None, error=str(e))
+        return outcome
+
+    def publish(self, source_policy_id, mapping_type, mapped_policy):
+        """
+        Returns:
+            dict with 'action' (created, updated or unchanged; None on failure), 'policy' (id and name of the
+            derived policy), 'changed_rules' (number of rules changed since the previous run), 'error', 'parts'
+            (outcomes of the parts of a split policy, empty when the policy was not split) and 'stale_parts' (IDs of
+            the policies of the previous run, replaced or parts left over, that could not be deleted)
+        """
+        parts = self.halo_api_caller.split_policy(mapped_policy)
+        if len(parts) == 1:
+            outcome = self.publish_part(source_policy_id, mapping_type, *parts[0])
+            self.retire_stale_parts(source_policy_id, mapping_type, outcome)
+            return outcome
+        utility.Utility.log_stdout("Policy [%s] over the payload limit, published as %d policies" % (
+            mapped_policy['policy']['name'], len(parts)))
+        outcomes = [self.publish_part(source_policy_id, mapping_type if i == 0 else "%s#%d" % (mapping_type, i + 1),
+                                      *part) for i, part in enumerate(parts)]
+        actions = [outcome['action'] for outcome in outcomes]
+        errors = [outcome['error'] for outcome in outcomes if outcome['error']]
+        changed_rules = [outcome['changed_rules'] for outcome in outcomes if outcome['changed_rules'] is not None]
+        if errors:
+            action = None
+        elif 'created' in actions:
+            action = 'created'
+        elif 'updated' in actions:
+            action = 'updated'
+        else:
+            action = 'unchanged'
+        outcome = self.outcome(action, dict(outcomes[0]['policy'], name=mapped_policy['policy']['name']),
+                               errors[0] if errors else None)
+        outcome['changed_rules'] = sum(changed_rules) if changed_rules else None
+        outcome['parts'] = outcomes
+        outcome['stale_parts'] = [part_id for part_outcome in outcomes for part_id in part_outcome['stale_parts']]
+        self.retire_stale_parts(source_policy_id, mapping_type, outcome)
+        return outcome
+
+    def retire_stale_parts(self, source_policy_id, mapping_type, outcome):
+        """
+        Deletes the parts of a previously split derived policy which are not needed anymore, and records the part
+        IDs of the published policy. A part that cannot be deleted is reported in the outcome and kept in the state.
+        """
+        if self.mapping_state is None or outcome['action'] is None:
+            return
+        part_outcomes = outcome['parts'] or [outcome]
+        for part_mapping_type, part_id in self.mapping_state.stale_parts(source_policy_id, mapping_type,
+                                                                         len(part_outcomes)):
+            if self.halo_api_caller.delete_configuration_policy(part_id)[0] is None:
+                utility.Utility.log_stderr("Failed to delete policy [%s], a part of the %s policy of [%s] not needed "
+                                           "anymore" % (part_id, mapping_type, source_policy_id))
+                outcome['stale_parts'].append(part_id)
+                continue
+            utility.Utility.log_stdout("Deleted policy [%s], a part of the %s policy of [%s] not needed anymore" % (
+                part_id, mapping_type, source_policy_id))
+            self.mapping_state.drop(source_policy_id, part_mapping_type)
+        self.mapping_state.record_parts(source_policy_id, mapping_type,
+                                        [part_outcome['policy'].get('id') for part_outcome in outcome['parts']])
+
+    def publish_part(self, source_policy_id, mapping_type, mapped_policy, body):
+        if self.mapping_state is None:
+            return self.create(body)
+
+        policy_fingerprint, rule_fingerprints = mapping_state.MappingState.fingerprint_policy(mapped_policy)
+        entry = self.mapping_state.get(source_policy_id, mapping_type)
+        if entry is None:
+            outcome = self.create(body)
+            outcome['changed_rules'] = len(rule_fingerprints)
+        elif entry['fingerprint'] == policy_fingerprint:
+            return self.outcome('unchanged', {'id': entry['derived_policy_id'], 'name': entry['derived_policy_name']})
+        else:
+            changed_rules = mapping_state.MappingState.changed_rules(entry['rule_fingerprints'], rule_fingerprints)
+            outcome = self.update(entry, mapped_policy)
+            outcome['changed_rules'] = len(changed_rules)
+
+        if outcome['action'] is not None:
+            self.mapping_state.record(source_policy_id, mapping_type, outcome['policy'].get('id'),
+                                      outcome['policy'].get('name'), policy_fingerprint, rule_fingerprints)
+        return outcome
+
+    def create(self, mapped_policy):
+        """Creates a policy from a policy dict or its encoded request body."""
+        csm_plc_crt_rst = self.halo_api_caller.create_configuration_policy(mapped_policy)
+        if csm_plc_crt_rst[0] is None:
+            return self.outcome(None, error="policy creation failed")
+        return self.outcome('created', csm_plc_crt_rst[0]['policy'])
+
+    def update(self, entry, mapped_policy):
+        """
+        Updates the policy generated by the previous run, or replaces it by a new policy when the update fails.
+        """
+        policy_name = self.part_name(entry['derived_policy_name'], mapped_policy['policy']['name'])
+        mapped_policy = dict(mapped_policy, policy=dict(mapped_policy['policy'], name=policy_name))
+        csm_plc_upd_rst = self.halo_api_caller.update_configuration_policy(entry['derived_policy_id'], mapped_policy)
+        if csm_plc_upd_rst[0] is not None:
+            return self.outcome('updated', {'id': entry['derived_policy_id'], 'name': policy_name})
+        utility.Utility.log_stderr("Failed to update policy [%s], replacing it by a new policy" % policy_name)
+        outcome = self.create(mapped_policy)
+        if outcome['action'] is None:
+            return outcome
+        if self.halo_api_caller.delete_configuration_policy(entry['derived_policy_id'])[0] is None:
+            utility.Utility.log_stderr("Failed to delete policy [%s] replaced by policy [%s]" % (
+                entry['derived_policy_id'], outcome['policy'].get('id')))
+            outcome['stale_parts'].append(entry['derived_policy_id'])
+        return outcome
+
+    @classmethod
+    def part_name(cls, derived_policy_name, policy_name):
+        """
+        Returns the name of the policy generated by the previous run, with the part suffix ("(1/3)") of the new
+        policy instead of its own, so a policy split or merged since then is named like its other parts.
+        """
+        match = POLICY_PART_SUFFIX.search(policy_name)
+        return POLICY_PART_SUFFIX.sub("", derived_policy_name) + (match.group(0) if match else "")
+
+    @classmethod
+    def outcome(cls, action, policy=None, error=None):
+        return {'action': action, 'policy': policy or {}, 'changed_rules': None, 'error': error, 'parts': [],
+                'stale_parts': []}
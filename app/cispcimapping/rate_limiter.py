@@ -0,0 +1,34 @@
+import threading
+import time
+
+
+class RateLimiter(object):
+    """
+    Thread-safe limiter spreading calls evenly to at most ``rate`` calls per second.
+
+    A rate of 0 (or less) disables the rate limit, pauses still apply.
+
+    Attributes:
+        rate (float): Maximum number of calls per second
+    """
+
+    def __init__(self, rate=0):
+        self.rate = float(rate)
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def acquire(self):
+        """Blocks until the caller may proceed."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            if self.rate > 0:
+                self.next_slot = slot + 1.0 / self.rate
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Holds every caller back for the given number of seconds (i.e. after a 429 response)."""
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
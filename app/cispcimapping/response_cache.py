@@ -0,0 +1,200 @@
+import glob
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from . import utility
+
+
+class ResponseCache(object):
+    """
+    Persistent on-disk cache of the Halo API GET responses (policy list pages and policy details).
+
+    One entry is kept per (API key, URL) with the response body and its
+    validators (ETag, Last-Modified). An entry younger than ``ttl`` seconds is
+    used without any request; an older one is revalidated with
+    If-None-Match/If-Modified-Since, so an unchanged resource costs a 304
+    instead of its full body. Entries are pickled and replaced atomically like
+    the MappingCache entries, and the cache is kept under ``max_bytes`` by
+    evicting the least recently used entries (by file modification time,
+    refreshed on every hit). The size accounting and the eviction are
+    serialized by a lock, as the cache is shared by the bulk workers.
+
+    The entry files are grouped by collection, the URL without its query
+    string (i.e. every page of the policy list), so that a write to the API
+    drops the cached pages it makes stale (see forget).
+
+    Attributes:
+        cache_dir (str): Directory holding the cache entries
+        ttl (float): Seconds during which an entry is used without revalidation, 0 to always revalidate
+        max_bytes (int): Total size of the entries above which the least recently used ones are evicted
+    """
+
+    entry_suffix = ".response.pickle"
+
+    def __init__(self, cache_dir, ttl=0, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.ttl = float(ttl)
+        self.max_bytes = int(max_bytes)
+        self.lock = threading.Lock()
+        self.total_bytes = None
+
+    def entry_path(self, key_id, url):
+        entry_key = "\0".join([key_id, url])
+        return os.path.join(self.cache_dir, "%s-%s%s" % (self.collection_key(key_id, url),
+                                                         hashlib.sha1(entry_key.encode("utf-8")).hexdigest(),
+                                                         self.entry_suffix))
+
+    @classmethod
+    def collection(cls, url):
+        """Returns the collection of a URL: the URL without its query string and trailing slash."""
+        return url.split("?", 1)[0].rstrip("/")
+
+    @classmethod
+    def collection_key(cls, key_id, url):
+        collection_key = "\0".join([key_id, cls.collection(url)])
+        return hashlib.sha1(collection_key.encode("utf-8")).hexdigest()[:16]
+
+    def get(self, key_id, url):
+        """Returns the cached entry of a URL, or None."""
+        entry_path = self.entry_path(key_id, url)
+        try:
+            with open(entry_path, "rb") as fh:
+                entry = pickle.load(fh)
+            os.utime(entry_path, None)
+        except (IOError, OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return self.ttl > 0 and time.time() - entry['stored_at'] < self.ttl
+
+    @classmethod
+    def conditional_headers(cls, entry):
+        """Returns the revalidation headers of a cached entry."""
+        headers = {}
+        if entry.get('etag'):
+            headers["If-None-Match"] = entry['etag']
+        if entry.get('last_modified'):
+            headers["If-Modified-Since"] = entry['last_modified']
+        return headers
+
+    def store(self, key_id, url, body, etag=None, last_modified=None):
+        """
+        Stores a response body, when it can be revalidated or the TTL is set. Returns True if the body was stored.
+        """
+        if not (etag or last_modified or self.ttl > 0):
+            return False
+        entry_path = self.entry_path(key_id, url)
+        entry = {'url': url, 'body': body, 'etag': etag, 'last_modified': last_modified, 'stored_at': time.time()}
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(entry, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            with self.lock:
+                replaced_size = self.entry_size(entry_path)
+                os.replace(tmp_path, entry_path)
+                size = os.path.getsize(entry_path)
+                if self.total_bytes is None:
+                    self.total_bytes = sum(size for _, size, _ in self.list_entries())
+                else:
+                    self.total_bytes += size - replaced_size
+                if self.total_bytes > self.max_bytes:
+                    self._evict()
+        except (IOError, OSError) as e:
+            utility.Utility.log_stderr("Failed to write response cache entry '%s': %s" % (entry_path, e))
+            return False
+        return True
+
+    def refresh(self, key_id, url, entry):
+        """Restarts the TTL of an entry revalidated by a 304 response."""
+        self.store(key_id, url, entry['body'], entry.get('etag'), entry.get('last_modified'))
+
+    def delete(self, key_id, url):
+        entry_path = self.entry_path(key_id, url)
+        with self.lock:
+            size = self.entry_size(entry_path)
+            try:
+                os.remove(entry_path)
+            except OSError:
+                return
+            if self.total_bytes is not None:
+                self.total_bytes -= size
+
+    def forget(self, key_id, url):
+        """
+        Drops the entries made stale by a successful write (POST, PUT or DELETE) to a URL: the entries of its
+        collection and of the parent collection, i.e. the policy details and every page of the policy list after a
+        policy is created, updated or deleted. Returns the number of removed entries.
+        """
+        collection = self.collection(url)
+        collection_keys = set([self.collection_key(key_id, collection), self.collection_key(
+            key_id, collection.rsplit("/", 1)[0])])
+        removed = 0
+        with self.lock:
+            for collection_key in collection_keys:
+                for entry_path in glob.glob(os.path.join(self.cache_dir, collection_key + "-*" + self.entry_suffix)):
+                    size = self.entry_size(entry_path)
+                    try:
+                        os.remove(entry_path)
+                    except OSError:
+                        continue
+                    removed += 1
+                    if self.total_bytes is not None:
+                        self.total_bytes -= size
+        return removed
+
+    @classmethod
+    def entry_size(cls, entry_path):
+        try:
+            return os.path.getsize(entry_path)
+        except OSError:
+            return 0
+
+    def list_entries(self):
+        """Returns the (mtime, size, path) of every cache entry."""
+        entries = []
+        for entry_path in glob.glob(os.path.join(self.cache_dir, "*" + self.entry_suffix)):
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache holds at most max_bytes."""
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        entries = self.list_entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            total -= size
+        self.total_bytes = total
+
+    def invalidate(self):
+        """
+        Removes every cache entry and returns the number of removed entries.
+        """
+        removed = 0
+        with self.lock:
+            for entry_path in glob.glob(os.path.join(self.cache_dir, "*" + self.entry_suffix)):
+                os.remove(entry_path)
+                removed += 1
+            self.total_bytes = None
+        return removed
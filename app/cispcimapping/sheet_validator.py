@@ -0,0 +1,154 @@
+import collections
+import re
+
+from . import utility
+
+# Separators between the requirement numbers of one mapping sheet cell, i.e. "10.2.1, 11.5"
+REQUIREMENT_SEPARATORS = re.compile(r'[,;\n]+')
+# Cell values standing for "no requirement"
+NO_REQUIREMENT = frozenset(['', 'N/A', 'NA', 'NAN', 'NONE'])
+# Cell values standing for "no rule ID"
+NO_RULE_ID = frozenset(['', 'NAN', 'NONE', 'NULL'])
+WHITESPACE = re.compile(r'\s+')
+# A number turned into a float by the spreadsheet, i.e. "1234.0"
+FLOAT_INTEGER = re.compile(r'^(\d+)\.0+$')
+
+# Kinds of validation issues, the records of the first three are dropped
+BLANK_RULE_ID = 'blank_rule_id'
+BLANK_REQUIREMENT = 'blank_requirement'
+DUPLICATE = 'duplicate'
+CONFLICT = 'conflict'
+NORMALIZED_RULE_ID = 'normalized_rule_id'
+NORMALIZED_REQUIREMENT = 'normalized_requirement'
+
+
+def clean_rule_id(value):
+    """Returns the cleaned CloudPassage rule ID of a mapping sheet cell: ends trimmed, no float suffix, or ''."""
+    cp_rule_id = str(value).strip()
+    match = FLOAT_INTEGER.match(cp_rule_id)
+    if match:
+        cp_rule_id = match.group(1)
+    return "" if cp_rule_id.upper() in NO_RULE_ID else cp_rule_id
+
+
+def rule_key(cp_rule_id):
+    """
+    Returns the canonical lookup key of a rule ID, the same for every spelling of it (case, surrounding whitespace,
+    float suffix).
+    """
+    if cp_rule_id is None:
+        return ""
+    return clean_rule_id(cp_rule_id).casefold()
+
+
+def requirement_items(req_no):
+    """Returns the requirement numbers of a mapping sheet cell, in cell order and without duplicates."""
+    items = []
+    for item in REQUIREMENT_SEPARATORS.split(str(req_no)):
+        item = WHITESPACE.sub(" ", item).strip().rstrip(':').strip()
+        match = FLOAT_INTEGER.match(item)
+        if match:
+            item = match.group(1)
+        if item.upper() not in NO_REQUIREMENT and item not in items:
+            items.append(item)
+    return items
+
+
+def clean_req_no(req_no):
+    """
+    Returns the requirement number(s) of a mapping sheet cell with its ends trimmed, or '' when it holds no
+    requirement. The separators between several requirements are kept as they are, since they end up in the
+    derived rule names.
+    """
+    return str(req_no).strip() if requirement_items(req_no) else ""
+
+
+def clean_text(value):
+    text = str(value).strip()
+    return "" if text.upper() == 'NAN' else text
+
+
+class SheetValidator(object):
+    """
+    Validation and normalization of the mapping records extracted from a mapping sheet.
+
+    Runs once, when a sheet is parsed, before the records are cached and
+    indexed: the rule IDs and requirement numbers are trimmed (the rule IDs
+    also lose a float-ified "1234.0"), records without a rule ID or a
+    requirement ("N/A" and the like) are dropped, and records repeating a
+    rule ID (whatever its case) are merged: an identical record is a
+    duplicate and is dropped, a differing one is a conflict and the last
+    record wins, as in MappingIndex. Nothing else of a cell is rewritten, so
+    the derived rule names keep the requirement numbers as the sheet spells
+    them.
+    Every issue is recorded, so the cached table is clean and the rule
+    matching only does hashed lookups on canonical keys (see rule_key).
+
+    Attributes:
+        issues (list): Issues found, dicts of 'issue', 'mapping_type', 'source', 'cp_rule_id', 'value' and, for the
+            conflicts, 'other_value'
+    """
+
+    def __init__(self):
+        self.issues = []
+
+    def normalize(self, mapping_type, fltrd_info_lst, source=""):
+        """
+        Returns:
+            list of the clean [cp_rule_id, req_no, title, description], one per rule ID
+        """
+        records = collections.OrderedDict()
+        for fltrd_info_elmnt in fltrd_info_lst:
+            raw_rule_id, raw_req_no, title, description = [str(value) for value in fltrd_info_elmnt[:4]]
+            cp_rule_id = clean_rule_id(raw_rule_id)
+            if not cp_rule_id:
+                self.add_issue(BLANK_RULE_ID, mapping_type, source, "", raw_rule_id)
+                continue
+            req_no = clean_req_no(raw_req_no)
+            if not req_no:
+                self.add_issue(BLANK_REQUIREMENT, mapping_type, source, cp_rule_id, raw_req_no)
+                continue
+            if cp_rule_id != raw_rule_id:
+                self.add_issue(NORMALIZED_RULE_ID, mapping_type, source, cp_rule_id, raw_rule_id)
+            if req_no != raw_req_no:
+                self.add_issue(NORMALIZED_REQUIREMENT, mapping_type, source, cp_rule_id, raw_req_no)
+            record = [cp_rule_id, req_no, clean_text(title), clean_text(description)]
+            key = rule_key(cp_rule_id)
+            previous = records.get(key)
+            if previous is not None:
+                if previous[1:] == record[1:]:
+                    self.add_issue(DUPLICATE, mapping_type, source, cp_rule_id, req_no)
+                    continue
+                self.add_issue(CONFLICT, mapping_type, source, cp_rule_id, previous[1], other_value=req_no)
+            records[key] = record
+        return list(records.values())
+
+    def normalize_all(self, records, source=""):
+        """Normalizes the records of every mapping type, i.e. of ExcelHandler.extract_all_mapping_records."""
+        return dict((mapping_type, self.normalize(mapping_type, fltrd_info_lst, source))
+                    for mapping_type, fltrd_info_lst in records.items())
+
+    def add_issue(self, issue, mapping_type, source, cp_rule_id, value, **details):
+        self.issues.append(dict(details, issue=issue, mapping_type=mapping_type, source=source, cp_rule_id=cp_rule_id,
+                                value=value))
+
+    def counts(self):
+        """Returns the number of issues of each kind."""
+        return dict(collections.Counter(issue['issue'] for issue in self.issues))
+
+    def report(self):
+        """Logs the number of issues of each kind, and every dropped or conflicting record."""
+        if not self.issues:
+            return
+        utility.Utility.log_stderr("Mapping sheet validation: %s" % ", ".join(
+            "%d %s" % (count, issue) for issue, count in sorted(self.counts().items())))
+        for issue in self.issues:
+            if issue['issue'] == CONFLICT:
+                utility.Utility.log_stderr("Conflicting %s mapping records for rule [%s] in %s: Req [%s] and [%s], "
+                                           "using the last one" % (issue['mapping_type'], issue['cp_rule_id'],
+                                                                   issue['source'], issue['value'],
+                                                                   issue['other_value']))
+            elif issue['issue'] in (BLANK_RULE_ID, BLANK_REQUIREMENT):
+                utility.Utility.log_stderr("Dropped %s mapping record with %s [%s] in %s" % (
+                    issue['mapping_type'], issue['issue'].replace("_", " "), issue['value'] or issue['cp_rule_id'],
+                    issue['source']))
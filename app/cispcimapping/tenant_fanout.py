@@ -0,0 +1,211 @@
+import copy
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import bulk_mapper
+from . import frameworks
+from . import halo_api_caller
+from . import mapping_state
+from . import policy_publisher
+from . import utility
+
+# Tenant manifest fields overriding the ConfigHelper attribute of the same name
+TENANT_CONFIG_FIELDS = ('halo_api_key_id', 'halo_api_key_secret', 'halo_api_hostname', 'halo_api_port',
+                        'halo_api_rate_limit')
+# Characters of a tenant name not kept in its mapping state file name
+UNSAFE_FILE_NAME_CHARS = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def load_tenant_manifest(manifest_file, default_mapping_types=None):
+    """
+    Reads and validates a tenant manifest: a JSON list of tenants, or an object with a 'tenants' list.
+
+    Every tenant has a unique 'name', its Halo API credentials ('halo_api_key_id' and 'halo_api_key_secret', or the
+    names of the environment variables holding them in 'halo_api_key_id_env' and 'halo_api_key_secret_env'), the
+    source policies to map ('policy_names' and/or 'policy_pattern') and optionally its 'mapping_types' (the
+    configured MAPPING_TYPE by default), 'workers' (number of its policies mapped concurrently) and Halo API
+    'halo_api_hostname', 'halo_api_port' and 'halo_api_rate_limit'.
+
+    Returns:
+        list of tenant dicts, with the environment credentials resolved and the mapping types upper-cased
+
+    Raises:
+        ValueError: The manifest is unreadable or a tenant is invalid
+    """
+    try:
+        with open(manifest_file) as fh:
+            manifest = json.load(fh)
+    except (IOError, OSError) as e:
+        raise ValueError("Unreadable tenant manifest '%s': %s" % (manifest_file, e))
+    if isinstance(manifest, dict):
+        manifest = manifest.get('tenants')
+    if not isinstance(manifest, list) or not manifest:
+        raise ValueError("Tenant manifest '%s' holds no tenant list" % manifest_file)
+    tenants = []
+    names = set()
+    for position, entry in enumerate(manifest):
+        if not isinstance(entry, dict) or not entry.get('name'):
+            raise ValueError("Tenant #%d of the manifest has no name" % (position + 1))
+        tenant = dict(entry)
+        name = tenant['name']
+        if name in names:
+            raise ValueError("Tenant [%s] is listed twice in the manifest" % name)
+        names.add(name)
+        for field in ('halo_api_key_id', 'halo_api_key_secret'):
+            env_name = tenant.pop(field + '_env', None)
+            if env_name:
+                tenant[field] = os.getenv(env_name, "")
+            if not tenant.get(field):
+                raise ValueError("Tenant [%s] has no %s" % (name, field))
+        tenant['policy_names'] = list(tenant.get('policy_names') or [])
+        tenant['policy_pattern'] = tenant.get('policy_pattern') or ""
+        if not tenant['policy_names'] and not tenant['policy_pattern']:
+            raise ValueError("Tenant [%s] has neither policy_names nor policy_pattern" % name)
+        tenant['mapping_types'] = [mapping_type.upper() for mapping_type in
+                                   tenant.get('mapping_types') or default_mapping_types or []]
+        unsupported_types = [mapping_type for mapping_type in tenant['mapping_types']
+                             if mapping_type not in frameworks.FRAMEWORKS]
+        if not tenant['mapping_types'] or unsupported_types:
+            raise ValueError("Tenant [%s] has unsupported mapping types [%s], expected some of %s" % (
+                name, ", ".join(unsupported_types), ", ".join(frameworks.names())))
+        tenants.append(tenant)
+    return tenants
+
+
+class TenantFanout(object):
+    """
+    Maps the policies of many Halo accounts (tenants) in one run.
+
+    Every tenant gets its own HaloAPICaller (credentials, token, connection
+    pool and rate limiter) and BulkMapper, while the parsed mapping indexes,
+    the mapping and response caches and the metrics are shared by all of
+    them. Up to ``tenant_workers`` tenants are mapped at a time, each one with
+    up to its own ``workers`` policies in flight, and ``slots`` bounds the
+    number of policies mapped concurrently across all tenants, so a run over
+    hundreds of tenants keeps a fixed load whatever their sizes. A failing
+    tenant (no token obtained, policy list not retrieved, API errors) is
+    reported in the summary and does not stop the others.
+
+    Attributes:
+        config (ConfigHelper): Base configuration, overridden per tenant by the manifest
+        mapping_idxs (dict): Mapping type -> MappingIndex, of every mapping type of the manifest
+        tenant_workers (int): Number of tenants mapped concurrently
+        tenant_policy_workers (int): Default number of policies of a tenant mapped concurrently
+        slots (threading.BoundedSemaphore): Cap on the policies mapped concurrently across all tenants
+        metrics (Metrics): Metrics shared by the HaloAPICaller of every tenant
+        journal (JobJournal): Journal of the units of the job, None to map every unit
+        job_id (str): ID of the journaled job
+    """
+
+    def __init__(self, config, mapping_idxs, tenant_workers=4, tenant_policy_workers=4, workers=16, metrics=None,
+                 journal=None, job_id=None):
+        self.config = config
+        self.mapping_idxs = mapping_idxs
+        self.tenant_workers = max(1, int(tenant_workers))
+        self.tenant_policy_workers = max(1, int(tenant_policy_workers))
+        self.slots = threading.BoundedSemaphore(max(1, int(workers)))
+        self.metrics = metrics
+        self.journal = journal
+        self.job_id = job_id
+
+    def tenant_config(self, tenant):
+        """Returns a copy of the base configuration with the tenant's credentials, API endpoint and selection."""
+        config = copy.copy(self.config)
+        for field in TENANT_CONFIG_FIELDS:
+            if tenant.get(field) is not None:
+                setattr(config, field, str(tenant[field]))
+        config.target_policy_names = tenant['policy_names']
+        config.target_policy_pattern = tenant['policy_pattern']
+        config.mapping_types = tenant['mapping_types']
+        config.mapping_type = ",".join(tenant['mapping_types'])
+        # The shared response cache is purged once for the whole run, not by every tenant
+        config.halo_api_cache_purge = False
+        state_dir, state_name = os.path.split(self.config.mapping_state_file)
+        state_base, state_ext = os.path.splitext(state_name)
+        config.mapping_state_file = os.path.join(state_dir, "%s-%s%s" % (
+            state_base, UNSAFE_FILE_NAME_CHARS.sub("_", tenant['name']), state_ext))
+        return config
+
+    def map_tenant(self, tenant):
+        """
+        Maps the selected policies of one tenant.
+
+        Returns:
+            tenant summary dict with the 'tenant' name, 'status', 'error', the numbers of 'policies' selected and
+            'created', 'updated', 'unchanged', 'resumed' (done by the interrupted run of the journaled job) and
+            'failed' derived policies, the 'missing' policy names, the 'seconds' spent and the per derived policy
+            'results'
+        """
+        started = time.perf_counter()
+        summary = {'tenant': tenant['name'], 'status': 'failed', 'error': None, 'policies': 0, 'created': 0,
+                   'updated': 0, 'unchanged': 0, 'resumed': 0, 'failed': 0, 'missing': [], 'results': []}
+        try:
+            config = self.tenant_config(tenant)
+            halo_api_caller_obj = halo_api_caller.HaloAPICaller(config, self.metrics)
+            if halo_api_caller_obj.token_manager.get_token() is None:
+                summary['error'] = "Halo credentials are bad: no Halo API token obtained"
+                return summary
+            state = None
+            if config.incremental_mode:
+                state = mapping_state.MappingState(config.mapping_state_file)
+            publisher = policy_publisher.PolicyPublisher(halo_api_caller_obj, state, config.publish_workers)
+            mapping_idxs = dict((mapping_type, self.mapping_idxs[mapping_type])
+                                for mapping_type in tenant['mapping_types'])
+            journaled_job = None
+            if self.journal is not None:
+                journaled_job = self.journal.job(self.job_id, tenant['name'])
+            bulk_mapper_obj = bulk_mapper.BulkMapper(halo_api_caller_obj, mapping_idxs,
+                                                     tenant.get('workers') or self.tenant_policy_workers, publisher,
+                                                     self.slots, journaled_job)
+            policies, summary['missing'] = bulk_mapper_obj.select_policies(tenant['policy_names'],
+                                                                           tenant['policy_pattern'])
+            summary['policies'] = len(policies)
+            summary['results'] = bulk_mapper_obj.run(policies)
+        except Exception as e:
+            summary['error'] = str(e) or e.__class__.__name__
+            return summary
+        finally:
+            summary['seconds'] = round(time.perf_counter() - started, 3)
+        for result in summary['results']:
+            if result['status'] != 'success':
+                summary['failed'] += 1
+            else:
+                summary[result['action']] += 1
+        if not (summary['failed'] or summary['missing']):
+            summary['status'] = 'success'
+        return summary
+
+    def run(self, tenants):
+        """
+        Maps every tenant of the manifest, tenant_workers at a time.
+
+        Returns:
+            dict with the per tenant summaries ('tenants', in manifest order) and their 'totals'
+        """
+        with ThreadPoolExecutor(max_workers=min(self.tenant_workers, len(tenants))) as executor:
+            tenant_summaries = list(executor.map(self.map_tenant, tenants))
+        totals = {'tenants': len(tenant_summaries), 'tenants_failed': 0}
+        for key in ('policies', 'created', 'updated', 'unchanged', 'resumed', 'failed'):
+            totals[key] = sum(tenant_summary[key] for tenant_summary in tenant_summaries)
+        for tenant_summary in tenant_summaries:
+            if tenant_summary['status'] != 'success':
+                totals['tenants_failed'] += 1
+            self.log_summary(tenant_summary)
+        return {'tenants': tenant_summaries, 'totals': totals}
+
+    @classmethod
+    def log_summary(cls, tenant_summary):
+        message = "Tenant [%s]: %d policies, %d generated, %d updated, %d unchanged, %d resumed, %d failed, %d not " \
+                  "found in %.1fs" % (tenant_summary['tenant'], tenant_summary['policies'], tenant_summary['created'],
+                                      tenant_summary['updated'], tenant_summary['unchanged'],
+                                      tenant_summary['resumed'], tenant_summary['failed'],
+                                      len(tenant_summary['missing']), tenant_summary['seconds'])
+        if tenant_summary['status'] == 'success':
+            utility.Utility.log_stdout(message)
+        else:
+            utility.Utility.log_stderr("%s%s" % (message, ": %s" % tenant_summary['error']
+                                                 if tenant_summary['error'] else ""))
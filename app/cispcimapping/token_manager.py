@@ -0,0 +1,80 @@
+import threading
+import time
+
+
+class TokenManager(object):
+    """
+    Thread-safe owner of the Halo API bearer token.
+
+    The token is refreshed ``refresh_margin`` seconds before it expires, and
+    again after the Halo API rejects it (see ``invalidate``). Refreshes are
+    serialized by a lock, so concurrent workers needing a new token trigger a
+    single call to the authentication endpoint and then share its result. A
+    token issued without an ``expires_in`` is kept ``default_lifetime``
+    seconds, and a failed fetch is not retried for ``failure_backoff``
+    seconds: meanwhile every caller gets None at once, so an authentication
+    outage does not turn every request of every worker into an auth request.
+
+    Attributes:
+        fetch_token (callable): Returns (token, expires_in seconds), or (None, None) on failure
+        refresh_margin (float): Seconds before expiry at which the token is refreshed
+        default_lifetime (float): Lifetime of a token issued without (or with a zero) expires_in
+        failure_backoff (float): Seconds during which a failed fetch is not retried
+    """
+
+    def __init__(self, fetch_token, refresh_margin=60, default_lifetime=900, failure_backoff=5):
+        self.fetch_token = fetch_token
+        self.refresh_margin = float(refresh_margin)
+        self.default_lifetime = float(default_lifetime)
+        self.failure_backoff = float(failure_backoff)
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+
+    def get_token(self):
+        """
+        Returns a valid token, refreshing it first if it is missing or about to expire, or None while a failed
+        fetch is backed off.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.token is None and now < self.retry_at:
+                return None
+            if self.token is None or now >= self.expires_at - self.refresh_margin:
+                self._refresh()
+            return self.token
+
+    def refresh(self):
+        """Forces a new token and returns it, whatever the backoff of a previous failed fetch."""
+        with self.lock:
+            self._refresh()
+            return self.token
+
+    def invalidate(self, token):
+        """
+        Drops a token rejected by the Halo API. Tokens already replaced by another thread are ignored, so a burst
+        of 401 responses leads to a single refresh.
+        """
+        with self.lock:
+            if self.token == token:
+                self.token = None
+
+    def set_token(self, token, expires_in):
+        with self.lock:
+            self.token = token
+            self.expires_at = time.monotonic() + self.lifetime(expires_in)
+
+    def lifetime(self, expires_in):
+        return float(expires_in or 0) or self.default_lifetime
+
+    def _refresh(self):
+        token, expires_in = self.fetch_token()
+        self.token = token
+        now = time.monotonic()
+        if token is None:
+            self.expires_at = 0.0
+            self.retry_at = now + self.failure_backoff
+        else:
+            self.expires_at = now + self.lifetime(expires_in)
+            self.retry_at = 0.0
@@ -1,11 +1,33 @@
 #!/usr/bin/python
+import argparse
+import json
 import os
+import signal
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import urllib3
+
+from cispcimapping import bulk_mapper
 from cispcimapping import config_helper
-from cispcimapping import custom_enum
+from cispcimapping import coverage_index
 from cispcimapping import excel_handler
+from cispcimapping import frameworks
 from cispcimapping import halo_api_caller
+from cispcimapping import http_session
+from cispcimapping import job_journal
+from cispcimapping import mapping_cache
+from cispcimapping import mapping_index
+from cispcimapping import mapping_ingest
+from cispcimapping import mapping_service
+from cispcimapping import mapping_state
+from cispcimapping import metrics
+from cispcimapping import offline_mapper
+from cispcimapping import policy_publisher
+from cispcimapping import response_cache
+from cispcimapping import sheet_validator
+from cispcimapping import tenant_fanout
 from cispcimapping import utility
 
 
@@ -16,119 +38,586 @@ def main():
     config = config_helper.ConfigHelper()
     utility.Utility.log_stdout("1- Creating HALO API CALLER Object.")
     halo_api_caller_obj = halo_api_caller.HaloAPICaller(config)
-    mapping_type = config.mapping_type
+    mapping_types = config.mapping_types
+    metrics = halo_api_caller_obj.metrics
+    success = False
+    try:
+        """
+        First we make sure that all configs are sound...
+        """
+        utility.Utility.log_stdout("2- Checking the provided configuration parameters")
+        with metrics.span("stage", stage="auth"):
+            check_configs(config, halo_api_caller_obj)
+
+        """
+        Retrieving list of configuration policies and extracting the Configuration Policy ID using the provided policy
+        name, page by page until the policy is found
+        """
+        utility.Utility.log_stdout("3- Retrieving list of configuration policies")
+        utility.Utility.log_stdout("4- Extract Configuration Policy ID using the provided policy name")
+        policy_name = halo_api_caller_obj.target_policy_name
+        with metrics.span("stage", stage="policy_list"):
+            target_policy_id = halo_api_caller_obj.find_configuration_policy_id(policy_name)
+        if target_policy_id is None:
+            utility.Utility.log_stdout("Configuration policy [%s] not found!  Exiting!" % policy_name)
+            sys.exit(1)
+
+        """
+        Retrieving target configuration policy details
+        """
+        utility.Utility.log_stdout("5- Retrieving target configuration policy details")
+        csm_plc_det = None
+        if not config.halo_api_stream_policy_details:
+            with metrics.span("stage", stage="policy_details"):
+                csm_plc_det = halo_api_caller_obj.get_configuration_policy_details(target_policy_id)
+
+        """Parsing the mapping document/sheet and creating list of rules having PCI/HIPAA/NIST mapping info and ignore
+        rules with no PCI/HIPAA/NIST mapping info """
+        utility.Utility.log_stdout(
+            "6- Parsing the mapping document/sheet and creating list of rules having PCI/HIPAA/NIST mapping info and "
+            "ignore rules with no PCI/HIPAA/NIST mapping info")
+        with metrics.span("stage", stage="mapping_sheet"):
+            mapping_idxs = load_mapping_indexes_or_exit(config, mapping_types, metrics)
+
+        """In streaming mode the policy details are only requested now, and their rules are filtered while they are
+        received """
+        mapped_policies = {}
+        if config.halo_api_stream_policy_details:
+            with metrics.span("stage", stage="policy_details"):
+                mapped_policies = halo_api_caller_obj.map_configuration_policy_details(target_policy_id,
+                                                                                       mapping_idxs)[0]
+            if mapped_policies is None:
+                utility.Utility.log_stdout("Configuration policy details could not be retrieved!  Exiting!")
+                sys.exit(1)
+
+        """Filtering the rules of target configuration policy based on the list of rules that have PCI/HIPAA/NIST
+        mapping info generated from the previous step and creating the new configuration policies with only rules
+        having PCI or HIPAA or NIST mapping info """
+        utility.Utility.log_stdout(
+            "7- Filtering the rules of target configuration policy based on the list of rules that have PCI/HIPAA/NIST "
+            "mapping info generated from the previous step")
+        utility.Utility.log_stdout(
+            "8- creating the new configuration policies with only rules having PCI or HIPAA or NIST mapping info")
+        policy_publisher_obj = get_policy_publisher(config, halo_api_caller_obj)
+        rule_keys = None
+        if csm_plc_det is not None and csm_plc_det[0] is not None:
+            rule_keys = halo_api_caller_obj.policy_rule_keys(csm_plc_det[0])
+        with ThreadPoolExecutor(max_workers=len(mapping_types)) as executor:
+            futures = [executor.submit(map_and_create_policy, halo_api_caller_obj, policy_publisher_obj,
+                                       target_policy_id, csm_plc_det, mapping_type, mapping_idxs[mapping_type],
+                                       mapped_policies.get(mapping_type), rule_keys)
+                       for mapping_type in mapping_types]
+            for future in futures:
+                outcome = future.result()
+                if outcome['action'] is None:
+                    utility.Utility.log_stdout("Configuration Policy creation failed: %s" % outcome['error'])
+                    sys.exit(1)
+                utility.Utility.log_stdout("9- Configuration Policy [%s] %s" % (
+                    outcome['policy']['name'], bulk_mapper.ACTION_MESSAGES[outcome['action']]))
+        success = True
+    finally:
+        metrics.finish(success)
+    utility.Utility.log_stdout("Mapping Script Finished.")
+
+
+def get_mapping_file_path(config):
+    parent_dir_name = os.path.dirname(os.path.abspath(__file__))
+    # mapping_file_path = parent_dir_name + '/resources/'
+    mapping_file_path = parent_dir_name.replace('\\', '/')
+    return os.path.join(mapping_file_path, config.mapping_file_name)
+
+
+def get_mapping_file_paths(config):
+    """
+    Returns the mapping workbooks of the multi-workbook mode (MAPPING_FILES), or the single mapping document.
+    """
+    if config.mapping_files:
+        return mapping_ingest.expand_mapping_sources(config.mapping_files, os.path.dirname(os.path.abspath(__file__)))
+    return [get_mapping_file_path(config)]
+
+
+def load_mapping_records(config, mapping_types, validator=None):
+    """
+    Returns the mapping records of every mapping type, going through the mapping cache when it is enabled.
+    """
+    cache = None
+    if config.mapping_cache_enabled:
+        cache = mapping_cache.MappingCache(config.mapping_cache_dir)
+    excel_handler_obj = excel_handler.ExcelHandler()
+    return excel_handler_obj.load_mapping_records(get_mapping_file_path(config), config.sheet_name, mapping_types,
+                                                  config.excel_engine_type, cache, validator)
+
+
+def load_mapping_table(config, mapping_types, validator=None):
+    """
+    Returns the MappingTable of the mapping document/sheet, or of every workbook/sheet in multi-workbook mode. The
+    validation issues of the parsed sheets are collected by the given SheetValidator, or else reported.
+    """
+    report = validator is None
+    if report:
+        validator = sheet_validator.SheetValidator()
+    if not config.mapping_files:
+        mapping_table = mapping_index.MappingTable.from_records(load_mapping_records(config, mapping_types, validator))
+        if report:
+            validator.report()
+        return mapping_table
+    excel_file_paths = get_mapping_file_paths(config)
+    if not excel_file_paths:
+        utility.Utility.log_stderr("No mapping workbook matches MAPPING_FILES [%s]" % config.mapping_files)
+    cache = None
+    if config.mapping_cache_enabled:
+        cache = mapping_cache.MappingCache(config.mapping_cache_dir)
+    ingestor = mapping_ingest.MappingIngestor(config.mapping_ingest_workers, config.excel_engine_type, cache)
+    mapping_table = ingestor.ingest(excel_file_paths, config.sheet_names, mapping_types)
+    validator.issues.extend(ingestor.issues)
+    if report:
+        validator.report()
+    ingestor.report_conflicts()
+    utility.Utility.log_stdout("Ingested %d mapping workbooks (%d conflicting records)" % (
+        len(excel_file_paths), len(ingestor.conflicts)))
+    return mapping_table
+
+
+def load_mapping_indexes(config, mapping_types, metrics=None):
+    """
+    Builds one mapping index per mapping type from the mapping document/sheet, or workbooks/sheets.
+
+    Raises:
+        ValueError: A mapping type has no mapping record, as the sheet lacks its columns or they are empty, which
+            would publish empty derived policies
+    """
+    mapping_table = load_mapping_table(config, mapping_types)
+    empty_types = [mapping_type for mapping_type in mapping_types
+                   if mapping_type not in mapping_table.indexes or not len(mapping_table.index(mapping_type))]
+    if empty_types:
+        raise ValueError("The mapping document [%s] %s holds no %s mapping record (missing or empty columns)" % (
+            config.mapping_files or config.mapping_file_name, config.sheet_name, ", ".join(empty_types)))
+    mapping_idxs = {}
+    for mapping_type in mapping_table.mapping_types():
+        mapping_idx = mapping_table.index(mapping_type)
+        mapping_idx.report_duplicates(mapping_type)
+        mapping_idxs[mapping_type] = mapping_idx
+        if metrics is not None:
+            metrics.count("mapping_rows", len(mapping_idx), mapping_type=mapping_type)
+    memory_usage = mapping_table.memory_usage()
+    utility.Utility.log_stdout("Loaded %d mapping records (%d distinct strings, %.1f KiB)" % (
+        memory_usage['records'], memory_usage['unique_strings'], memory_usage['bytes'] / 1024.0))
+    return mapping_idxs
+
+
+def load_mapping_indexes_or_exit(config, mapping_types, metrics=None):
+    """Returns the load_mapping_indexes of the command line runs, exiting when a mapping type has no record."""
+    try:
+        return load_mapping_indexes(config, mapping_types, metrics)
+    except ValueError as e:
+        utility.Utility.log_stderr("%s!  Exiting!" % e)
+        sys.exit(1)
+
+
+def compile_cache():
+    """
+    Pre-compiles the mapping cache for every mapping type of the configured mapping document/sheet, or
+    workbooks/sheets, with the records cleaned by the sheet validation, and writes the validation issues to
+    MAPPING_VALIDATION_REPORT.
+    """
+    config = config_helper.ConfigHelper()
+    cache = mapping_cache.MappingCache(config.mapping_cache_dir)
+    removed = cache.invalidate()
+    config.mapping_cache_enabled = True
+    validator = sheet_validator.SheetValidator()
+    mapping_table = load_mapping_table(config, frameworks.names(), validator)
+    for mapping_type in mapping_table.mapping_types():
+        utility.Utility.log_stdout("Cached %d %s mapping records from [%s] %s" % (
+            len(mapping_table.index(mapping_type)), mapping_type, config.mapping_files or config.mapping_file_name,
+            config.sheet_name))
+    validator.report()
+    report_dir = os.path.dirname(os.path.abspath(config.mapping_validation_report))
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+    with open(config.mapping_validation_report, "w") as fh:
+        json.dump({'records': dict((mapping_type, len(mapping_table.index(mapping_type)))
+                                   for mapping_type in mapping_table.mapping_types()),
+                   'counts': validator.counts(), 'issues': validator.issues}, fh, indent=2, sort_keys=True)
+    utility.Utility.log_stdout("Mapping cache compiled in '%s' (%d stale entries removed), validation report "
+                               "written to '%s'" % (config.mapping_cache_dir, removed,
+                                                    config.mapping_validation_report))
+
+
+def clear_cache():
+    config = config_helper.ConfigHelper()
+    removed = mapping_cache.MappingCache(config.mapping_cache_dir).invalidate()
+    utility.Utility.log_stdout("Removed %d mapping cache entries from '%s'" % (removed, config.mapping_cache_dir))
+    removed = response_cache.ResponseCache(config.halo_api_cache_dir).invalidate()
+    utility.Utility.log_stdout("Removed %d cached Halo API responses from '%s'" % (removed, config.halo_api_cache_dir))
+
+
+def get_policy_publisher(config, halo_api_caller_obj):
+    """
+    Returns the policy publisher, keeping track of the generated policies in incremental mode.
+    """
+    state = None
+    if config.incremental_mode:
+        state = mapping_state.MappingState(config.mapping_state_file)
+    return policy_publisher.PolicyPublisher(halo_api_caller_obj, state, config.publish_workers)
+
+
+def get_job_journal(config, *selection):
+    """
+    Returns the job journal and the ID of the job (JOB_ID, or derived from the selection), started or resumed, or
+    (None, None) when the journal is disabled.
+    """
+    if not config.job_journal_enabled:
+        return None, None
+    journal = job_journal.JobJournal(config.job_journal_file)
+    job_id = config.job_id or job_journal.JobJournal.job_key(*selection)
+    journal.begin(job_id, config.job_resume)
+    return journal, job_id
+
+
+def map_and_create_policy(halo_api_caller_obj, policy_publisher_obj, source_policy_id, csm_plc_det, mapping_type,
+                          mapping_idx, filtered_pcihipaanist_policy=None, rule_keys=None):
+    """
+    Filters the policy details for one mapping type, unless the already filtered policy (streaming mode) is given,
+    and publishes the resulting policy. rule_keys are the policy_rule_keys of the policy details, shared by every
+    mapping type.
+    """
+    metrics = halo_api_caller_obj.metrics
+    if filtered_pcihipaanist_policy is None:
+        with metrics.span("stage", stage="filter", mapping_type=mapping_type):
+            filtered_pcihipaanist_policy = halo_api_caller_obj.extract_policy_rules(csm_plc_det, mapping_type,
+                                                                                    mapping_idx, rule_keys)
+    with metrics.span("stage", stage="publish", mapping_type=mapping_type) as span:
+        outcome = policy_publisher_obj.publish(source_policy_id, mapping_type, filtered_pcihipaanist_policy)
+        span.set(action=outcome['action'])
+    return outcome
+
 
+def bulk():
     """
-    First we make sure that all configs are sound...
+    Maps every source policy selected by TARGET_POLICY_NAMES and/or TARGET_POLICY_PATTERN concurrently.
     """
-    utility.Utility.log_stdout("2- Checking the provided configuration parameters")
+    utility.Utility.log_stdout("Bulk Mapping Script Started ...")
+    config = config_helper.ConfigHelper()
+    halo_api_caller_obj = halo_api_caller.HaloAPICaller(config)
     check_configs(config, halo_api_caller_obj)
+    if not config.bulk_mode():
+        utility.Utility.log_stdout("Required configuration variable TARGET_POLICY_NAMES or TARGET_POLICY_PATTERN is "
+                                   "not set!  Exiting!")
+        sys.exit(1)
+
+    metrics = halo_api_caller_obj.metrics
+    success = False
+    try:
+        with metrics.span("stage", stage="mapping_sheet"):
+            mapping_idxs = load_mapping_indexes_or_exit(config, config.mapping_types, metrics)
+        journal, job_id = get_job_journal(config, 'bulk', config.halo_api_hostname, config.halo_api_key_id,
+                                          config.target_policy_names, config.target_policy_pattern,
+                                          config.mapping_types)
+        bulk_mapper_obj = bulk_mapper.BulkMapper(halo_api_caller_obj, mapping_idxs, config.bulk_workers,
+                                                 get_policy_publisher(config, halo_api_caller_obj),
+                                                 journal=journal.job(job_id) if journal is not None else None)
+        try:
+            with metrics.span("stage", stage="policy_list"):
+                policies, missing = bulk_mapper_obj.select_policies(config.target_policy_names,
+                                                                    config.target_policy_pattern)
+        except RuntimeError as e:
+            utility.Utility.log_stderr("%s!  Exiting!" % e)
+            if journal is not None:
+                journal.finish(job_id, False)
+            sys.exit(1)
+        for policy_name in missing:
+            utility.Utility.log_stderr("Configuration policy [%s] not found!" % policy_name)
+        utility.Utility.log_stdout("Mapping %d configuration policies to %s with %d workers" % (
+            len(policies), ", ".join(config.mapping_types), bulk_mapper_obj.workers))
 
+        results = bulk_mapper_obj.run(policies)
+        failed = [result for result in results if result['status'] != 'success']
+        actions = [result['action'] for result in results]
+        success = not (failed or missing)
+        if journal is not None:
+            journal.finish(job_id, success)
+    finally:
+        metrics.finish(success)
+    utility.Utility.log_stdout("Bulk Mapping Script Finished: %d policies generated, %d updated, %d unchanged, "
+                               "%d resumed, %d failed, %d not found." % (
+                                   actions.count('created'), actions.count('updated'), actions.count('unchanged'),
+                                   actions.count('resumed'), len(failed), len(missing)))
+    if failed or missing:
+        sys.exit(1)
+
+
+def fanout():
     """
-    Retrieving list of configuration policies
+    Maps the policies of every tenant of TENANT_MANIFEST, FANOUT_TENANTS tenants and at most FANOUT_WORKERS policies
+    at a time, over one shared parse of the mapping document, and writes the per tenant results to
+    FANOUT_SUMMARY_FILE.
     """
-    utility.Utility.log_stdout("3- Retrieving list of configuration policies")
-    csm_plc_lst = halo_api_caller_obj.get_configuration_policy_list()
+    utility.Utility.log_stdout("Fan-out Mapping Script Started ...")
+    config = config_helper.ConfigHelper()
+    sanity = config.sane(require_target=False, require_credentials=False)
+    if not config.tenant_manifest:
+        utility.Utility.log_stdout("Required configuration variable TENANT_MANIFEST is not set!")
+        sanity = False
+    if sanity is False:
+        utility.Utility.log_stdout("Configuration is bad!  Exiting!")
+        sys.exit(1)
+    try:
+        tenants = tenant_fanout.load_tenant_manifest(config.tenant_manifest, config.mapping_types)
+    except ValueError as e:
+        utility.Utility.log_stderr("%s  Exiting!" % e)
+        sys.exit(1)
+    if config.halo_api_cache_enabled and config.halo_api_cache_purge:
+        utility.Utility.log_stdout("Removed %d cached Halo API responses" % response_cache.ResponseCache(
+            config.halo_api_cache_dir).invalidate())
 
+    metrics_obj = metrics.Metrics(config.metrics_enabled, config.metrics_json_log, config.metrics_textfile)
+    success = False
+    try:
+        mapping_types = []
+        for tenant in tenants:
+            mapping_types.extend(mapping_type for mapping_type in tenant['mapping_types']
+                                 if mapping_type not in mapping_types)
+        with metrics_obj.span("stage", stage="mapping_sheet"):
+            mapping_idxs = load_mapping_indexes_or_exit(config, mapping_types, metrics_obj)
+        journal, job_id = get_job_journal(config, 'fanout', [
+            (tenant['name'], tenant.get('halo_api_hostname'), tenant['halo_api_key_id'], tenant['policy_names'],
+             tenant['policy_pattern'], tenant['mapping_types']) for tenant in tenants])
+        tenant_fanout_obj = tenant_fanout.TenantFanout(config, mapping_idxs, config.fanout_tenants,
+                                                       config.bulk_workers, config.fanout_workers, metrics_obj,
+                                                       journal, job_id)
+        utility.Utility.log_stdout("Mapping the policies of %d tenants, %d at a time" % (
+            len(tenants), min(tenant_fanout_obj.tenant_workers, len(tenants))))
+        summary = tenant_fanout_obj.run(tenants)
+        with open(config.fanout_summary_file, "w") as fh:
+            json.dump(summary, fh, indent=2, sort_keys=True)
+        success = not summary['totals']['tenants_failed']
+        if journal is not None:
+            journal.finish(job_id, success)
+    finally:
+        metrics_obj.finish(success)
+    totals = summary['totals']
+    utility.Utility.log_stdout("Fan-out Mapping Script Finished: %d tenants (%d failed), %d policies generated, "
+                               "%d updated, %d unchanged, %d resumed, %d failed; summary written to '%s'." % (
+                                   totals['tenants'], totals['tenants_failed'], totals['created'],
+                                   totals['updated'], totals['unchanged'], totals['resumed'], totals['failed'],
+                                   config.fanout_summary_file))
+    if not success:
+        sys.exit(1)
+
+
+def dry_run():
     """
-    Extract Configuration Policy ID using the provided policy name
+    Maps the saved policy details of DRY_RUN_INPUT offline and writes the derived policies, the rule level diff and
+    the per framework coverage to DRY_RUN_OUTPUT_DIR as JSON Lines, without any Halo API call.
     """
-    utility.Utility.log_stdout("4- Extract Configuration Policy ID using the provided policy name")
-    policy_name = halo_api_caller_obj.target_policy_name
-    target_policy_id = halo_api_caller_obj.extract_policy_from_policy_list(csm_plc_lst, policy_name)
+    utility.Utility.log_stdout("Dry Run Started ...")
+    config = config_helper.ConfigHelper()
+    sanity = config.sane(require_target=False, require_credentials=False)
+    if not config.dry_run_input:
+        utility.Utility.log_stdout("Required configuration variable DRY_RUN_INPUT is not set!")
+        sanity = False
+    if sanity is False:
+        utility.Utility.log_stdout("Configuration is bad!  Exiting!")
+        sys.exit(1)
+    halo_api_caller_obj = halo_api_caller.HaloAPICaller(config)
+    metrics = halo_api_caller_obj.metrics
+    success = False
+    try:
+        with metrics.span("stage", stage="mapping_sheet"):
+            mapping_idxs = load_mapping_indexes_or_exit(config, config.mapping_types, metrics)
+        offline_mapper_obj = offline_mapper.OfflineMapper(halo_api_caller_obj, mapping_idxs, config.dry_run_output_dir)
+        with metrics.span("stage", stage="dry_run"):
+            summary = offline_mapper_obj.run(config.dry_run_input)
+        success = not summary['failed']
+    finally:
+        metrics.finish(success)
+    utility.Utility.log_stdout("Dry Run Finished: %d policies mapped to %d derived policies in '%s', %d failed." % (
+        summary['policies'], summary['derived'], config.dry_run_output_dir, summary['failed']))
+    if summary['failed']:
+        sys.exit(1)
+
+
+def parse_query_args(argv):
+    parser = argparse.ArgumentParser(prog="runner.py query",
+                                     description="Query the mappings of every framework of the mapping document.")
+    queries = parser.add_subparsers(dest='query')
+    queries.required = True
+    rule_parser = queries.add_parser('rule', help="requirements of a CloudPassage rule in every framework")
+    rule_parser.add_argument('cp_rule_id')
+    requirement_parser = queries.add_parser('requirement', help="rules mapped to a framework requirement")
+    requirement_parser.add_argument('framework')
+    requirement_parser.add_argument('req_no')
+    requirement_parser.add_argument('--prefix', action='store_true', help="include the sub-requirements")
+    coverage_parser = queries.add_parser('coverage', help="requirements of a framework covered by a policy")
+    coverage_parser.add_argument('framework')
+    coverage_parser.add_argument('--policy-file', help="saved policy details JSON")
+    coverage_parser.add_argument('--policy', help="name of a configuration policy, fetched from the Halo API")
+    coverage_parser.add_argument('--group', action='store_true',
+                                 help="aggregate by parent requirement, i.e. NIST CSF category")
+    overlap_parser = queries.add_parser('overlap', help="rules and requirements shared by two frameworks")
+    overlap_parser.add_argument('framework')
+    overlap_parser.add_argument('other_framework')
+    return parser.parse_args(argv)
 
+
+def query(argv=None):
     """
-    Retrieving target configuration policy details
+    Answers forward, reverse and coverage queries over the mappings of every framework, printed as JSON:
+
+        python runner.py query rule CIS:Ubuntu18.04:1.1.1.1
+        python runner.py query requirement PCI 2.2 --prefix
+        python runner.py query coverage NIST --policy-file policy.json --group
+        python runner.py query overlap HIPAA NIST
     """
-    utility.Utility.log_stdout("5- Retrieving target configuration policy details")
-    csm_plc_det = halo_api_caller_obj.get_configuration_policy_details(target_policy_id)
+    args = parse_query_args(sys.argv[2:] if argv is None else argv)
+    config = config_helper.ConfigHelper()
+    mapping_types = frameworks.names()
+    for framework in [getattr(args, 'framework', None), getattr(args, 'other_framework', None)]:
+        if framework is not None and framework.upper() not in mapping_types:
+            utility.Utility.log_stderr("Unsupported mapping type %s, expected one of %s" % (
+                framework, ", ".join(mapping_types)))
+            sys.exit(1)
+    coverage_index_obj = coverage_index.CoverageIndex(load_mapping_table(config, mapping_types))
+    if args.query == 'rule':
+        result = coverage_index_obj.rule(args.cp_rule_id)
+    elif args.query == 'requirement':
+        result = coverage_index_obj.rules_for(args.framework.upper(), args.req_no, args.prefix)
+    elif args.query == 'overlap':
+        result = coverage_index_obj.overlap(args.framework.upper(), args.other_framework.upper())
+    else:
+        rule_ids = None
+        policy_details = None
+        if args.policy_file:
+            policy_details = offline_mapper.OfflineMapper.load_policy_details(args.policy_file)
+        elif args.policy:
+            halo_api_caller_obj = halo_api_caller.HaloAPICaller(config)
+            policy_id = halo_api_caller_obj.find_configuration_policy_id(args.policy)
+            if policy_id is not None:
+                policy_details = halo_api_caller_obj.get_configuration_policy_details(policy_id)[0]
+            if policy_details is None:
+                utility.Utility.log_stderr("Configuration policy [%s] not found!" % args.policy)
+                sys.exit(1)
+        if policy_details is not None:
+            rule_ids = [rule.get('cp_rule_id') for rule in policy_details['policy']['rules']]
+        result = coverage_index_obj.coverage(args.framework.upper(), rule_ids, args.group)
+    print(json.dumps(result, indent=2, sort_keys=True))
 
-    """Parsing the mapping document/sheet and creating list of rules having PCI/HIPAA/NIST mapping info and ignore 
-    rules with no PCI/HIPAA/NIST mapping info """
-    utility.Utility.log_stdout(
-        "6- Parsing the mapping document/sheet and creating list of rules having PCI/HIPAA/NIST mapping info and "
-        "ignore rules with no PCI/HIPAA/NIST mapping info")
-    parent_dir_name = os.path.dirname(__file__)
-    # mapping_file_path = parent_dir_name + '/resources/'
-    mapping_file_path = parent_dir_name.replace('\\', '/')
 
-    excel_handler_obj = excel_handler.ExcelHandler()
-    df = excel_handler_obj.read_from_excel(halo_api_caller_obj.sheet_name, halo_api_caller_obj.mapping_file_name,
-                                           mapping_file_path, halo_api_caller_obj.excel_engine_type)
-
-    cp_rule_id_lst = []
-    fltrd_info_lst = []
-
-    for index, row in df.iterrows():
-        if mapping_type == custom_enum.MappingType.pci.value:
-            pci_dss_req_no = str(row['PCI-DSS_Req. #'])
-            if pci_dss_req_no != 'nan':
-                cp_rule_id = str(row['CP Rule ID'])
-                req_no = str(row['PCI-DSS_Req. #'])
-                title = str(row['PCI-DSS_Title'])
-                description = str(row['PCI-DSS_Description'])
-                fltrd_info_elmnt = [cp_rule_id, req_no, title, description]
-                cp_rule_id_lst.append(cp_rule_id)
-                fltrd_info_lst.append(fltrd_info_elmnt)
-
-        if mapping_type == custom_enum.MappingType.hipaa.value:
-            hipaa_req_no = str(row['HIPAA_Req. #'])
-            if hipaa_req_no != 'nan':
-                cp_rule_id = str(row['CP Rule ID'])
-                req_no = str(row['HIPAA_Req. #'])
-                title = str(row['HIPAA_Title'])
-                description = str(row['HIPAA_Description'])
-                fltrd_info_elmnt = [cp_rule_id, req_no, title, description]
-                cp_rule_id_lst.append(cp_rule_id)
-                fltrd_info_lst.append(fltrd_info_elmnt)
-
-        if mapping_type == custom_enum.MappingType.nist.value:
-            nist_req_no = str(row['NIST CSF 1.1'])
-            if nist_req_no != 'nan':
-                cp_rule_id = str(row['CP Rule ID'])
-                req_no = str(row['NIST CSF 1.1'])
-                title = str(row['NIST_Title'])
-                description = str(row['NIST_Description'])
-                fltrd_info_elmnt = [cp_rule_id, req_no, title, description]
-                cp_rule_id_lst.append(cp_rule_id)
-                fltrd_info_lst.append(fltrd_info_elmnt)
-
-    """Filtering the rules of target configuration policy based on the list of rules that have PCI/HIPAA/NIST mapping 
-    info generated from the previous step """
-    utility.Utility.log_stdout(
-        "7- Filtering the rules of target configuration policy based on the list of rules that have PCI/HIPAA/NIST "
-        "mapping info generated from the previous step")
-    if mapping_type == custom_enum.MappingType.pci.value:
-        filtered_pcihipaanist_policy = halo_api_caller_obj.extract_policy_rules_have_pci(csm_plc_det, cp_rule_id_lst,
-                                                                                         fltrd_info_lst)
-    if mapping_type == custom_enum.MappingType.hipaa.value:
-        filtered_pcihipaanist_policy = halo_api_caller_obj.extract_policy_rules_have_hipaa(csm_plc_det, cp_rule_id_lst,
-                                                                                           fltrd_info_lst)
-    if mapping_type == custom_enum.MappingType.nist.value:
-        filtered_pcihipaanist_policy = halo_api_caller_obj.extract_policy_rules_have_nist(csm_plc_det, cp_rule_id_lst,
-                                                                                          fltrd_info_lst)
-    """
-    creating the new configuration policy with only rules having PCI or HIPAA or NIST mapping info
-    """
-    utility.Utility.log_stdout(
-        "8- creating the new configuration policy with only rules having PCI or HIPAA or NIST mapping info")
-    csm_plc_crt_rst = halo_api_caller_obj.create_configuration_policy(filtered_pcihipaanist_policy)
-    csm_plc_det = csm_plc_crt_rst[0]
-    generated_policy_name = csm_plc_det['policy']['name']
-    utility.Utility.log_stdout("9- Configuration Policy [%s] Generated Successfully" % generated_policy_name)
-    utility.Utility.log_stdout("Mapping Script Finished.")
+def serve():
+    """
+    Runs the mapping service: mapping indexes, Halo API token and connections stay warm, and mapping jobs are run
+    on demand (HTTP trigger on SERVICE_HOST:SERVICE_PORT, or the submit command) and every SERVICE_SCHEDULE_INTERVAL
+    seconds for TARGET_POLICY_NAME(S)/TARGET_POLICY_PATTERN.
+    """
+    utility.Utility.log_stdout("Mapping Service Started ...")
+    config = config_helper.ConfigHelper()
+    halo_api_caller_obj = halo_api_caller.HaloAPICaller(config)
+    schedule_interval = float(config.service_schedule_interval)
+    check_configs(config, halo_api_caller_obj, require_target=schedule_interval > 0)
+
+    scheduled_job = None
+    if schedule_interval > 0:
+        scheduled_job = {'policy_names': config.target_policy_names, 'policy_pattern': config.target_policy_pattern,
+                         'mapping_types': config.mapping_types}
+        if not config.bulk_mode():
+            scheduled_job['policy_names'] = [config.target_policy_name]
+
+    def load_service_mapping_indexes(mapping_types):
+        return load_mapping_indexes(config, mapping_types, halo_api_caller_obj.metrics)
+
+    service = mapping_service.MappingService(halo_api_caller_obj, load_service_mapping_indexes,
+                                             lambda: get_mapping_file_paths(config),
+                                             get_policy_publisher(config, halo_api_caller_obj),
+                                             config.service_workers, config.bulk_workers, config.service_queue_size,
+                                             schedule_interval, scheduled_job)
+    try:
+        service.start(config.mapping_types)
+    except ValueError as e:
+        utility.Utility.log_stderr("%s!  Exiting!" % e)
+        sys.exit(1)
+    server = mapping_service.MappingServiceServer(service, config.service_host, int(config.service_port))
+
+    def stop(signum, frame):
+        utility.Utility.log_stdout("Mapping Service stopping ...")
+        threading.Thread(target=server.shutdown).start()
 
+    signal.signal(signal.SIGTERM, stop)
+    utility.Utility.log_stdout("Mapping Service listening on %s:%d with %d job workers%s" % (
+        config.service_host, server.server_port, service.workers,
+        ", scheduled every %gs" % schedule_interval if scheduled_job else ""))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+        halo_api_caller_obj.metrics.close()
+    utility.Utility.log_stdout("Mapping Service Stopped.")
 
-def check_configs(config, halo_api_caller):
+
+def submit():
+    """
+    Queues a mapping job for TARGET_POLICY_NAME(S)/TARGET_POLICY_PATTERN on the mapping service running at
+    SERVICE_HOST:SERVICE_PORT.
+    """
+    config = config_helper.ConfigHelper()
+    request = {'policy_names': config.target_policy_names, 'policy_pattern': config.target_policy_pattern,
+               'mapping_types': config.mapping_types}
+    if not config.bulk_mode():
+        request['policy_names'] = [config.target_policy_name]
+    url = "http://%s:%s/jobs" % (config.service_host, config.service_port)
+    session = http_session.HTTPSession(retries=0)
+    try:
+        response = session.request("POST", url, headers={"Content-Type": "application/json"},
+                                   body=json.dumps(request).encode("utf-8"))
+    except urllib3.exceptions.HTTPError as e:
+        utility.Utility.log_stderr("Failed to connect [%s] to the mapping service at '%s'" % (e, url))
+        sys.exit(1)
+    result = json.loads(response.data.decode("utf-8"))
+    if response.status != 202:
+        utility.Utility.log_stderr("Mapping job rejected: %s" % result.get('error'))
+        sys.exit(1)
+    utility.Utility.log_stdout("Mapping job [%s] queued" % result['job']['id'])
+
+
+def check_configs(config, halo_api_caller, require_target=True):
     halo_api_caller_obj = halo_api_caller
     if halo_api_caller_obj.credentials_work() is False:
         utility.Utility.log_stdout("Halo credentials are bad!  Exiting!")
         sys.exit(1)
 
-    if config.sane() is False:
+    if config.sane(require_target) is False:
         utility.Utility.log_stdout("Configuration is bad!  Exiting!")
         sys.exit(1)
 
 
+COMMANDS = {
+    'map': main,
+    'bulk': bulk,
+    'dry-run': dry_run,
+    'fanout': fanout,
+    'query': query,
+    'compile-cache': compile_cache,
+    'clear-cache': clear_cache,
+    'serve': serve,
+    'submit': submit,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Map CIS configuration policy rules to PCI, HIPAA and NIST.")
+    parser.add_argument('command', nargs='?', default='map', choices=sorted(COMMANDS),
+                        help="map (default): create the mapped policies, bulk: map many policies concurrently, "
+                             "dry-run: map saved policy details offline to local files, "
+                             "fanout: map the policies of every tenant of TENANT_MANIFEST, "
+                             "query: forward/reverse/coverage queries over every framework (query -h), "
+                             "compile-cache: pre-compile the mapping cache, clear-cache: remove every mapping cache "
+                             "and Halo API response cache entry, serve: run the mapping service, submit: queue a job "
+                             "on the mapping service")
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help="arguments of the query command")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    main()
+    COMMANDS[parse_args().command]()
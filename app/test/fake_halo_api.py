@@ -0,0 +1,312 @@
+#!/usr/bin/python
+"""
+Local stand-in for the Halo API, used by the tests and the benchmarks.
+
+Serves the endpoints used by the mapping tool over HTTP/1.1 keep-alive:
+
+    POST /oauth/access_token      client credentials token
+    GET  /v1/policies/            paginated configuration policy list
+    GET  /v1/policies/<id>        configuration policy details
+    POST /v1/policies             configuration policy creation
+    PUT  /v1/policies/<id>        configuration policy update
+    DELETE /v1/policies/<id>      configuration policy deletion
+
+Latency, page size, token lifetime, request payload limit (413) and
+401/429/5xx fault injection are configurable, gzip request bodies are
+accepted, GET responses carry an ETag honoured by If-None-Match (304), and
+the server counts requests and bytes per endpoint.
+
+Run standalone:
+
+    python test/fake_halo_api.py --port 8080 --rules 5000
+"""
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class FakeHaloAPI(ThreadingMixIn, HTTPServer):
+    """
+    Threaded fake Halo API server.
+
+    Attributes:
+        policies (dict): Policy ID -> policy dict (with rules)
+        latency (float): Seconds added before every response
+        max_per_page (int): Largest page size served by the policy list
+        token_lifetime (int): expires_in of the issued tokens
+        fault_rates (dict): HTTP status -> probability of answering any API request with it
+        max_payload_bytes (int): Largest (uncompressed) request body accepted, 0 for no limit
+        stats (dict): Endpoint -> {'requests', 'bytes_in', 'bytes_out'}
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, max_per_page=100, token_lifetime=900,
+                 fault_rates=None, seed=0, max_payload_bytes=0):
+        HTTPServer.__init__(self, (host, port), FakeHaloAPIHandler)
+        self.policies = {}
+        self.latency = latency
+        self.max_per_page = max_per_page
+        self.token_lifetime = token_lifetime
+        self.fault_rates = fault_rates or {}
+        self.max_payload_bytes = max_payload_bytes
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.tokens = set()
+        self.faults = []
+        self.stats = {}
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return "http://%s" % self.server_address[0]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add_policy(self, name, rules, policy_id=None, **fields):
+        policy_id = policy_id or "policy-%d" % next(self.ids)
+        policy = dict(fields, id=policy_id, name=name, rules=rules)
+        policy.setdefault('platform', 'linux')
+        policy.setdefault('description', 'Synthetic policy %s' % name)
+        with self.lock:
+            self.policies[policy_id] = policy
+        return policy
+
+    def add_synthetic_policy(self, name, rule_count, rule_ids=None, policy_id=None):
+        """
+        Adds a policy with rule_count rules. Rules take their cp_rule_id from rule_ids in turn (i.e. the CP Rule IDs
+        of a mapping sheet), every other rule getting an ID absent from any mapping.
+        """
+        rule_ids = list(rule_ids or [])
+        rules = []
+        for i in range(rule_count):
+            if rule_ids and i % 2 == 0:
+                cp_rule_id = rule_ids[(i // 2) % len(rule_ids)]
+            else:
+                cp_rule_id = "CIS:Synthetic:%d" % i
+            rules.append({'id': 'rule-%d' % i, 'cp_rule_id': cp_rule_id, 'name': 'Synthetic rule %d' % i,
+                          'description': 'Check number %d of the synthetic policy' % i, 'active': True,
+                          'critical': i % 7 == 0, 'checks': [{'type': 'file_setting', 'path': '/etc/rule%d' % i}]})
+        return self.add_policy(name, rules, policy_id)
+
+    def inject(self, status, count=1, method=None, path_prefix=None, retry_after=None):
+        """Answers the next count matching API requests with status."""
+        with self.lock:
+            for _ in range(count):
+                self.faults.append((status, method, path_prefix, retry_after))
+
+    def expire_tokens(self):
+        """Invalidates every issued token, so the next API requests get a 401."""
+        with self.lock:
+            self.tokens.clear()
+
+    def take_fault(self, method, path):
+        with self.lock:
+            for fault in self.faults:
+                status, fault_method, path_prefix, retry_after = fault
+                if (fault_method is None or fault_method == method) and (
+                        path_prefix is None or path.startswith(path_prefix)):
+                    self.faults.remove(fault)
+                    return status, retry_after
+            for status, rate in self.fault_rates.items():
+                if self.random.random() < rate:
+                    return status, None
+        return None
+
+    def record(self, endpoint, bytes_in, bytes_out):
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {'requests': 0, 'bytes_in': 0, 'bytes_out': 0})
+            stats['requests'] += 1
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+
+    def totals(self):
+        with self.lock:
+            totals = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0}
+            for stats in self.stats.values():
+                for key in totals:
+                    totals[key] += stats[key]
+            return totals
+
+    def created_policies(self):
+        with self.lock:
+            return [policy for policy in self.policies.values() if policy.get('generated')]
+
+
+class FakeHaloAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send the headers and body of a response in one segment, as a real API front end does.
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def dispatch(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        payload = gzip.decompress(body) if self.headers.get("Content-Encoding") == "gzip" else body
+        parsed = urllib.parse.urlparse(self.path)
+        path = parsed.path.rstrip("/")
+        query = urllib.parse.parse_qs(parsed.query)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if path == "/oauth/access_token" and self.command == "POST":
+            return self.respond("auth", body, *self.issue_token())
+
+        if not self.authorized():
+            return self.respond("unauthorized", body, 401, {'error': 'invalid or expired token'})
+        fault = self.server.take_fault(self.command, parsed.path)
+        if fault is not None:
+            headers = {"Retry-After": str(fault[1])} if fault[1] is not None else {}
+            return self.respond("fault", body, fault[0], {'error': 'injected fault'}, headers)
+        if self.server.max_payload_bytes and len(payload) > self.server.max_payload_bytes:
+            return self.respond("too_large", body, 413, {'error': 'request entity too large'})
+
+        if path == "/v1/policies" and self.command == "GET":
+            return self.respond("policy_list", body, *self.policy_list(query))
+        if path == "/v1/policies" and self.command == "POST":
+            return self.respond("policy_create", body, *self.create_policy(payload))
+        if path.startswith("/v1/policies/"):
+            policy_id = path[len("/v1/policies/"):]
+            if self.command == "GET":
+                return self.respond("policy_details", body, *self.policy_details(policy_id))
+            if self.command == "PUT":
+                return self.respond("policy_update", body, *self.update_policy(policy_id, payload))
+            if self.command == "DELETE":
+                return self.respond("policy_delete", body, *self.delete_policy(policy_id))
+        return self.respond("not_found", body, 404, {'error': 'not found'})
+
+    def issue_token(self):
+        with self.server.lock:
+            token = "fake-token-%d" % next(self.server.ids)
+            self.server.tokens.add(token)
+        return 200, {'access_token': token, 'expires_in': self.server.token_lifetime}
+
+    def authorized(self):
+        authorization = self.headers.get("Authorization", "")
+        with self.server.lock:
+            return authorization.startswith("Bearer ") and authorization[len("Bearer "):] in self.server.tokens
+
+    def policy_list(self, query):
+        per_page = min(int(query.get('per_page', ['20'])[0]), self.server.max_per_page)
+        page = int(query.get('page', ['1'])[0])
+        with self.server.lock:
+            policies = [{'id': policy['id'], 'name': policy['name'], 'platform': policy.get('platform')}
+                        for policy in self.server.policies.values()]
+        if 'name' in query:
+            policies = [policy for policy in policies if policy['name'] == query['name'][0]]
+        first = (page - 1) * per_page
+        result = {'count': len(policies), 'policies': policies[first:first + per_page], 'pagination': {}}
+        if first + per_page < len(policies):
+            next_query = dict((key, values[0]) for key, values in query.items())
+            next_query.update(page=page + 1, per_page=per_page)
+            result['pagination']['next'] = "%s:%d/v1/policies/?%s" % (
+                self.server.base_url, self.server.server_port, urllib.parse.urlencode(next_query))
+        return 200, result
+
+    def policy_details(self, policy_id):
+        with self.server.lock:
+            policy = self.server.policies.get(policy_id)
+        if policy is None:
+            return 404, {'error': 'policy not found'}
+        return 200, {'policy': policy}
+
+    def create_policy(self, body):
+        policy = json.loads(body.decode("utf-8"))['policy']
+        policy = self.server.add_policy(policy['name'], policy.get('rules', []), None, **dict(
+            (key, value) for key, value in policy.items() if key not in ('id', 'name', 'rules')))
+        policy['generated'] = True
+        return 201, {'policy': policy}
+
+    def update_policy(self, policy_id, body):
+        policy = json.loads(body.decode("utf-8"))['policy']
+        with self.server.lock:
+            if policy_id not in self.server.policies:
+                return 404, {'error': 'policy not found'}
+            self.server.policies[policy_id] = dict(policy, id=policy_id, generated=True)
+        return 204, None
+
+    def delete_policy(self, policy_id):
+        with self.server.lock:
+            if self.server.policies.pop(policy_id, None) is None:
+                return 404, {'error': 'policy not found'}
+        return 204, None
+
+    def respond(self, endpoint, request_body, status, obj, headers=None):
+        data = json.dumps(obj).encode("utf-8") if obj is not None else b""
+        if self.command == "GET" and status == 200:
+            etag = '"%s"' % hashlib.sha1(data).hexdigest()
+            headers = dict(headers or {}, ETag=etag)
+            if self.headers.get("If-None-Match") == etag:
+                status, data = 304, b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.record(endpoint, len(request_body), len(data))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Halo API.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rules', type=int, default=1000, help="rules of the synthetic policy")
+    parser.add_argument('--policies', type=int, default=1, help="number of synthetic policies")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--max-per-page', type=int, default=100)
+    parser.add_argument('--max-payload-bytes', type=int, default=0, help="largest request body accepted (413)")
+    args = parser.parse_args()
+    server = FakeHaloAPI(port=args.port, latency=args.latency, max_per_page=args.max_per_page,
+                         max_payload_bytes=args.max_payload_bytes)
+    for i in range(args.policies):
+        server.add_synthetic_policy("Synthetic CIS Policy %d" % (i + 1), args.rules)
+    print("Fake Halo API listening on %s:%d" % (server.base_url, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import imp
+import json
+import os
+import sys
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+
+class InMemoryHaloAPICaller(cis_pci_mapping.HaloAPICaller):
+    """HaloAPICaller answering from in-memory policies instead of the Halo API."""
+
+    def __init__(self, policies):
+        super(InMemoryHaloAPICaller, self).__init__(cis_pci_mapping.ConfigHelper())
+        self.policies = policies
+        self.created = []
+
+    def iter_configuration_policy_pages(self, policy_name=None):
+        summaries = [{'id': policy['id'], 'name': policy['name']} for policy in self.policies]
+        yield {'count': len(summaries), 'policies': summaries[:2]}, False
+        yield {'count': len(summaries), 'policies': summaries[2:]}, False
+
+    def get_configuration_policy_details(self, policy_id):
+        for policy in self.policies:
+            if policy['id'] == policy_id:
+                return {'policy': policy}, False
+        return None, False
+
+    def create_configuration_policy(self, policy_data):
+        if isinstance(policy_data, bytes):
+            policy_data = json.loads(policy_data.decode("utf-8"))
+        if policy_data['policy']['name'].startswith('NIST_Broken'):
+            return None, False
+        self.created.append(policy_data)
+        return {'policy': dict(policy_data['policy'], id='new-%d' % len(self.created))}, False
+
+
+def build_policies():
+    rules = [{'cp_rule_id': 'CIS:1', 'name': 'Rule 1'}, {'cp_rule_id': 'CIS:2', 'name': 'Rule 2'}]
+    return [{'id': 'p1', 'name': 'CIS Ubuntu 18.04', 'rules': rules},
+            {'id': 'p2', 'name': 'CIS Ubuntu 20.04', 'rules': rules},
+            {'id': 'p3', 'name': 'CIS RHEL 8', 'rules': rules},
+            {'id': 'p4', 'name': 'Broken', 'rules': rules}]
+
+
+def test_select_policies():
+    bulk_mapper_obj = cis_pci_mapping.BulkMapper(InMemoryHaloAPICaller(build_policies()), {})
+    selected, missing = bulk_mapper_obj.select_policies(['p3', 'Unknown'], '^CIS Ubuntu')
+    assert selected == [('p1', 'CIS Ubuntu 18.04'), ('p2', 'CIS Ubuntu 20.04'), ('p3', 'CIS RHEL 8')]
+    assert missing == ['Unknown']
+
+
+def test_select_policies_fails_on_unretrieved_page():
+    halo_api_caller_obj = InMemoryHaloAPICaller(build_policies())
+    halo_api_caller_obj.iter_configuration_policy_pages = lambda policy_name=None: iter([(None, True)])
+    bulk_mapper_obj = cis_pci_mapping.BulkMapper(halo_api_caller_obj, {})
+    try:
+        bulk_mapper_obj.select_policies([], '^CIS Ubuntu')
+        assert False, "failed policy list taken for an empty one"
+    except RuntimeError as e:
+        assert "policy list" in str(e)
+
+
+def test_run_reports_each_policy_and_mapping_type():
+    halo_api_caller_obj = InMemoryHaloAPICaller(build_policies())
+    mapping_idxs = {'PCI': cis_pci_mapping.MappingIndex([['CIS:1', '2.2', 'Title', 'Desc']]),
+                    'NIST': cis_pci_mapping.MappingIndex([['CIS:2', 'PR.IP-1', 'Title', 'Desc']])}
+    bulk_mapper_obj = cis_pci_mapping.BulkMapper(halo_api_caller_obj, mapping_idxs, workers=3)
+    results = bulk_mapper_obj.run([('p1', 'CIS Ubuntu 18.04'), ('p4', 'Broken'), ('p9', 'Gone')])
+    statuses = [(result['policy_id'], result['mapping_type'], result['status']) for result in results]
+    assert statuses == [('p1', 'PCI', 'success'), ('p1', 'NIST', 'success'),
+                        ('p4', 'PCI', 'success'), ('p4', 'NIST', 'failed'),
+                        ('p9', 'PCI', 'failed'), ('p9', 'NIST', 'failed')]
+    assert len(halo_api_caller_obj.created) == 3
+    assert results[0]['generated_policy_name'].startswith('PCI-DSS_CIS Ubuntu 18.04_')
@@ -0,0 +1,55 @@
+import imp
+import json
+import os
+import sys
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+sys.path.append(current_dir)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+import runner  # noqa: E402
+
+
+def build_coverage_index():
+    mapping_table = cis_pci_mapping.MappingTable.from_records({
+        'PCI': [['CIS:1', '2.2.4', 'Config', 'Desc'], ['CIS:2', '2.2.5, 10.2\n\nN/A', 'Config', 'Desc'],
+                ['CIS:3', '8.1', 'Users', 'Desc']],
+        'NIST': [['CIS:1', 'PR.IP-1', 'Baseline', 'Desc'], ['CIS:2', 'PR.IP-1', 'Baseline', 'Desc'],
+                 ['CIS:4', 'DE.CM-7:', 'Monitoring', 'Desc']]})
+    return cis_pci_mapping.CoverageIndex(mapping_table)
+
+
+def test_forward_reverse_and_coverage_queries():
+    coverage_index_obj = build_coverage_index()
+    assert coverage_index_obj.rule('CIS:2') == {
+        'PCI': {'req_nos': ['10.2', '2.2.5'], 'title': 'Config', 'description': 'Desc'},
+        'NIST': {'req_nos': ['PR.IP-1'], 'title': 'Baseline', 'description': 'Desc'}}
+    assert coverage_index_obj.rules_for('PCI', '2.2.4') == ['CIS:1']
+    assert coverage_index_obj.rules_for('PCI', '2.2', prefix=True) == ['CIS:1', 'CIS:2']
+
+    coverage = coverage_index_obj.coverage('PCI', ['CIS:1', 'CIS:9'])
+    assert (coverage['requirements_covered'], coverage['requirements_total']) == (1, 4)
+    assert coverage['uncovered'] == ['10.2', '2.2.5', '8.1']
+    categories = coverage_index_obj.coverage('NIST', ['CIS:1'], group=True)
+    assert categories['covered'] == {'PR.IP': ['CIS:1']}
+    assert categories['uncovered'] == ['DE.CM']
+
+    overlap = coverage_index_obj.overlap('PCI', 'NIST')
+    assert overlap['rules_both'] == 2
+    assert overlap['jaccard'] == 0.5
+    assert overlap['requirement_pairs'][0] == ['10.2', 'PR.IP-1', 1]
+
+
+def test_query_command(monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv("MAPPING_CACHE_DIR", str(tmp_path))
+    policy_file = tmp_path / "policy.json"
+    policy_file.write_text(json.dumps({'policy': {'name': 'Saved', 'rules': [
+        {'cp_rule_id': 'CIS:Ubuntu18.04:1.1.1.1'}]}}))
+    runner.query(['coverage', 'nist', '--policy-file', str(policy_file)])
+    coverage = json.loads(capsys.readouterr().out)
+    assert coverage['requirements_covered'] == 1
+    assert coverage['requirements_covered'] + len(coverage['uncovered']) == coverage['requirements_total']
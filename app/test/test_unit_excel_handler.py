@@ -19,4 +19,19 @@ def test_excel_handler():
     excel_handler_obj = cis_pci_mapping.ExcelHandler()
     df = excel_handler_obj.read_from_excel(sheet_name, mapping_file_name,
                                            mapping_file_path, excel_engine_type)
-    assert len(df) == 222
\ No newline at end of file
+    assert len(df) == 222
+
+
+def test_extract_mapping_records():
+    config = cis_pci_mapping.ConfigHelper()
+    excel_handler_obj = cis_pci_mapping.ExcelHandler()
+    df = excel_handler_obj.read_from_excel(config.sheet_name, config.mapping_file_name,
+                                           module_path, config.excel_engine_type)
+    all_records = excel_handler_obj.extract_all_mapping_records(df)
+    for mapping_type, columns in cis_pci_mapping.excel_handler.MAPPING_COLUMNS.items():
+        expected = []
+        for index, row in df.iterrows():
+            if str(row[columns[0]]) != 'nan':
+                expected.append([str(row['CP Rule ID']), str(row[columns[0]]), str(row[columns[1]]),
+                                 str(row[columns[2]])])
+        assert all_records[mapping_type] == expected
@@ -0,0 +1,60 @@
+import imp
+import json
+import os
+import sys
+
+import pandas as pd
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+
+def test_builtin_frameworks_keep_the_historical_annotation():
+    frameworks = cis_pci_mapping.frameworks
+    assert frameworks.names() == ['PCI', 'HIPAA', 'NIST', 'ISO27001', 'SOC2', 'CISV8']
+    assert frameworks.get('nist').columns == ('NIST CSF 1.1', 'NIST_Title', 'NIST_Description')
+    record = cis_pci_mapping.MappingRecord.from_elmnt(['CIS:1', '164.312(b)', 'Audit controls', 'Desc'])
+    rule = frameworks.get('HIPAA').annotate_rule({'cp_rule_id': 'CIS:1', 'name': 'Rule 1'}, record)
+    assert rule == {'cp_rule_id': 'CIS:1', 'name': 'HIPAA-164.312(b)-Rule 1',
+                    'user_notes': 'HIPAA Req: 164.312(b), HIPAA_Title: Audit controls, HIPAA_Description: Desc'}
+    try:
+        frameworks.get('FEDRAMP')
+        assert False, "unknown framework accepted"
+    except ValueError:
+        pass
+
+
+def test_custom_framework_drives_extraction(tmp_path):
+    frameworks = cis_pci_mapping.frameworks
+    definitions_file = tmp_path / "frameworks.json"
+    definitions_file.write_text(json.dumps([{
+        'name': 'CSA', 'title': 'CSA CCM v4', 'req_column': 'CCM_Control', 'title_column': 'CCM_Title',
+        'description_column': 'CCM_Description', 'rule_name_prefix': 'CCM-', 'policy_name_prefix': 'CCM_',
+        'user_notes_template': "CCM {req_no} ({title})"}]))
+    try:
+        assert frameworks.load_definitions(str(definitions_file)) == ['CSA']
+        assert frameworks.load_definitions(str(definitions_file)) == []
+        df = pd.DataFrame([['CIS:1', 'IAM-02', 'Password policy', 'Desc', '8.2'],
+                           ['CIS:2', None, None, None, '2.2']],
+                          columns=['CP Rule ID', 'CCM_Control', 'CCM_Title', 'CCM_Description', 'PCI-DSS_Req. #'])
+        excel_handler_obj = cis_pci_mapping.ExcelHandler()
+        # PCI misses its title and description columns
+        assert excel_handler_obj.sheet_frameworks(df) == ['CSA']
+        records = excel_handler_obj.extract_all_mapping_records(df, ['CSA', 'PCI'])
+        assert records == {'CSA': [['CIS:1', 'IAM-02', 'Password policy', 'Desc']], 'PCI': []}
+
+        halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(cis_pci_mapping.ConfigHelper())
+        policy_details = {'policy': {'name': 'Source', 'rules': [{'cp_rule_id': 'CIS:1', 'name': 'Rule 1'},
+                                                                 {'cp_rule_id': 'CIS:2', 'name': 'Rule 2'}]}}
+        mapped_policy = halo_api_caller_obj.extract_policy_rules(
+            (policy_details, False), 'CSA', cis_pci_mapping.MappingIndex(records['CSA']))
+        assert mapped_policy['policy']['name'].startswith('CCM_Source_')
+        assert mapped_policy['policy']['rules'] == [{'cp_rule_id': 'CIS:1', 'name': 'CCM-IAM-02-Rule 1',
+                                                     'user_notes': 'CCM IAM-02 (Password policy)'}]
+    finally:
+        frameworks.FRAMEWORKS.pop('CSA', None)
+        frameworks.LOADED_FILES.discard(os.path.abspath(str(definitions_file)))
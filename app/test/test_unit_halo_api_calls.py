@@ -1,6 +1,11 @@
 import imp
+import json
 import os
 import sys
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 
 module_name = 'cispcimapping'
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -26,3 +31,61 @@ def test_get_configuration_policy_details():
     csm_plc_det = halo_api_caller_obj.get_configuration_policy_details(config.target_policy_id)
     policy_details = csm_plc_det[0]
     assert policy_details['policy']['name'] == config.target_policy_name
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PaginatedPolicyListHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    policy_count = 250
+    requested_pages = []
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query['per_page'][0])
+        self.requested_pages.append(page)
+        first = (page - 1) * per_page
+        policies = [{'id': 'id-%d' % i, 'name': 'policy-%d' % i}
+                    for i in range(first, min(first + per_page, self.policy_count))]
+        body = {'count': self.policy_count, 'policies': policies, 'pagination': {}}
+        if first + per_page < self.policy_count:
+            body['pagination']['next'] = "http://127.0.0.1:%d/v1/policies/?page=%d&per_page=%d" % (
+                self.server.server_port, page + 1, per_page)
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_configuration_policy_list_pagination(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PaginatedPolicyListHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    config = cis_pci_mapping.ConfigHelper()
+    config.halo_api_hostname = "http://127.0.0.1"
+    config.halo_api_port = str(server.server_port)
+    config.halo_api_per_page = "100"
+    config.halo_api_cache_dir = str(tmp_path / "responses")
+    halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(config)
+    halo_api_caller_obj.token_manager.set_token("token", 900)
+    try:
+        csm_plc_lst = halo_api_caller_obj.get_configuration_policy_list()
+        assert len(csm_plc_lst[0]['policies']) == 250
+        assert PaginatedPolicyListHandler.requested_pages == [1, 2, 3]
+
+        del PaginatedPolicyListHandler.requested_pages[:]
+        assert halo_api_caller_obj.find_configuration_policy_id('policy-120') == 'id-120'
+        assert PaginatedPolicyListHandler.requested_pages == [1, 2]
+    finally:
+        halo_api_caller_obj.http_session.clear()
+        server.shutdown()
+        server.server_close()
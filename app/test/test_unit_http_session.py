@@ -0,0 +1,104 @@
+import imp
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    client_ports = []
+
+    def do_GET(self):
+        self.client_ports.append(self.client_address[1])
+        status = 401 if self.path.endswith("/unauthorized") else 200
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_requests_reuse_pooled_connection():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordingHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(cis_pci_mapping.ConfigHelper())
+    try:
+        url = "http://127.0.0.1:%d/v1/policies/" % server.server_port
+        for _ in range(5):
+            assert halo_api_caller_obj.do_get_request(url, "token") == (b'{"ok": true}', False)
+        assert len(RecordingHandler.client_ports) == 5
+        assert len(set(RecordingHandler.client_ports)) == 1
+        assert halo_api_caller_obj.do_get_request(url + "unauthorized", "token") == (None, True)
+    finally:
+        halo_api_caller_obj.http_session.clear()
+        server.shutdown()
+        server.server_close()
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    statuses = []
+    requests = []
+
+    def respond(self):
+        self.requests.append(self.command)
+        status = self.statuses.pop(0) if self.statuses else 200
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(status)
+        if status in (429, 503):
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_GET = respond
+    do_POST = respond
+
+    def log_message(self, *args):
+        pass
+
+
+def test_transient_failures_retried():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    session = cis_pci_mapping.http_session.HTTPSession(retries=3, backoff_factor=0.01)
+    url = "http://127.0.0.1:%d/v1/policies/" % server.server_port
+    try:
+        FlakyHandler.statuses[:] = [503, 429, 502]
+        assert session.request("GET", url).status == 200
+        assert FlakyHandler.requests == ["GET"] * 4
+
+        del FlakyHandler.requests[:]
+        FlakyHandler.statuses[:] = [429, 502]
+        assert session.request("POST", url, body=b"{}").status == 502
+        assert FlakyHandler.requests == ["POST"] * 2
+
+        del FlakyHandler.requests[:]
+        FlakyHandler.statuses[:] = [500, 500, 500, 500, 500]
+        assert session.request("GET", url).status == 500
+        assert FlakyHandler.requests == ["GET"] * 4
+    finally:
+        session.clear()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,59 @@
+import imp
+import json
+import os
+import sys
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+from cispcimapping import json_stream  # noqa: E402
+
+
+def test_array_items_streamed_across_chunk_boundaries():
+    rules = [{'id': i, 'cp_rule_id': 'CIS:%d' % i, 'name': 'Rulé "%d" \\ €' % i} for i in range(40)]
+    document = {'meta': {'rules': [1], 'note': '"rules": ['},
+                'policy': {'name': 'Source', 'nested': {'rules': [2]}, 'rules': rules, 'platform': 'linux'},
+                'tail': True}
+    data = json.dumps(document, ensure_ascii=False, indent=1).encode("utf-8")
+    for chunk_size in (1, 3, 64, len(data)):
+        chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        stream = json_stream.JSONArrayStream(chunks, ('policy', 'rules'))
+        assert list(stream) == rules
+        assert stream.document['policy'] == {'name': 'Source', 'nested': {'rules': [2]}, 'rules': [],
+                                             'platform': 'linux'}
+        assert stream.document['meta'] == document['meta'] and stream.document['tail'] is True
+
+
+def test_document_without_array():
+    stream = json_stream.JSONArrayStream([b'{"policy": {"na', b'me": "Source"}}'], ('policy', 'rules'))
+    assert list(stream) == []
+    assert stream.document == {'policy': {'name': 'Source'}}
+
+
+def test_truncated_document_raises():
+    stream = json_stream.JSONArrayStream([b'{"policy": {"rules": [{"id": 1}, {"id"'], ('policy', 'rules'))
+    try:
+        list(stream)
+    except ValueError:
+        pass
+    else:
+        assert False, "truncated document accepted"
+
+
+def test_streamed_mapping_matches_loaded_mapping():
+    halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(cis_pci_mapping.ConfigHelper())
+    rules = [{'cp_rule_id': 'CIS:%d' % i, 'name': 'Rule %d' % i} for i in range(10)]
+    policy_details = {'policy': {'name': 'Source', 'rules': rules}}
+    mapping_idxs = {'PCI': cis_pci_mapping.MappingIndex([['CIS:1', '2.2', 'T', 'D'], ['CIS:4', '8.1', 'T', 'D']]),
+                    'NIST': cis_pci_mapping.MappingIndex([['CIS:4', 'PR.AC-1', 'T', 'D']])}
+    stream = json_stream.JSONArrayStream([json.dumps(policy_details).encode("utf-8")], ('policy', 'rules'))
+    mapped_policies = halo_api_caller_obj.extract_policy_rules_from_stream(stream, mapping_idxs)
+    for mapping_type, mapping_idx in mapping_idxs.items():
+        expected = halo_api_caller_obj.extract_policy_rules((policy_details, False), mapping_type, mapping_idx)
+        assert mapped_policies[mapping_type]['policy']['rules'] == expected['policy']['rules']
+        assert mapped_policies[mapping_type]['policy']['name'].split('_')[:2] == \
+            expected['policy']['name'].split('_')[:2]
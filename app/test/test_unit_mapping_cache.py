@@ -0,0 +1,44 @@
+import imp
+import os
+import sys
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+
+def test_mapping_cache_store_load_invalidate(tmp_path):
+    mapping_file = tmp_path / "mapping.xlsx"
+    mapping_file.write_bytes(b"first version")
+    cache = cis_pci_mapping.MappingCache(str(tmp_path / "cache"))
+    fingerprint = cache.fingerprint(str(mapping_file))
+    records = [['CIS:1', '2.2', 'Title', 'Desc']]
+    cache.store(str(mapping_file), 'Sheet2', 'PCI', fingerprint, records)
+    assert cache.load(str(mapping_file), 'Sheet2', 'PCI', fingerprint) == records
+    assert cache.load(str(mapping_file), 'Sheet2', 'NIST', fingerprint) is None
+
+    mapping_file.write_bytes(b"second version")
+    assert cache.load(str(mapping_file), 'Sheet2', 'PCI', cache.fingerprint(str(mapping_file))) is None
+    assert cache.invalidate() == 1
+    assert cache.load(str(mapping_file), 'Sheet2', 'PCI', fingerprint) is None
+
+
+def test_load_mapping_records_warm_cache_skips_excel(tmp_path):
+    config = cis_pci_mapping.ConfigHelper()
+    excel_file_path = os.path.join(module_path, config.mapping_file_name)
+    cache = cis_pci_mapping.MappingCache(str(tmp_path))
+    excel_handler_obj = cis_pci_mapping.ExcelHandler()
+    cold = excel_handler_obj.load_mapping_records(excel_file_path, config.sheet_name, ['PCI', 'NIST'],
+                                                  config.excel_engine_type, cache)
+
+    def fail_read_from_excel(*args):
+        raise AssertionError("mapping sheet parsed on a warm cache")
+
+    excel_handler_obj.read_from_excel = fail_read_from_excel
+    warm = excel_handler_obj.load_mapping_records(excel_file_path, config.sheet_name, ['PCI', 'NIST'],
+                                                  config.excel_engine_type, cache)
+    assert warm == cold
+    assert len(warm['PCI']) > 0
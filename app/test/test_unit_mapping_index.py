@@ -0,0 +1,66 @@
+import imp
+import os
+import sys
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+
+def test_mapping_index_duplicates_last_wins():
+    fltrd_info_lst = [['CIS:1', '2.2', 'T1', 'D1'],
+                      ['CIS:2', '8.1', 'T2', 'D2'],
+                      ['cis:1', '2.4', 'T3', 'D3']]
+    mapping_idx = cis_pci_mapping.MappingIndex(fltrd_info_lst)
+    assert len(mapping_idx) == 2
+    # get takes the canonical rule ID as is, find normalizes any spelling of it
+    assert mapping_idx.get('cis:1')[1] == '2.4' and mapping_idx.get('CIS:1') is None
+    assert mapping_idx.find(' CIS:1\n')[1] == '2.4'
+    assert [record.cp_rule_id for record in mapping_idx.duplicates['cis:1']] == ['CIS:1', 'cis:1']
+    assert 'cis:2' not in mapping_idx.duplicates
+
+
+def test_extract_policy_rules_have_pci():
+    config = cis_pci_mapping.ConfigHelper()
+    halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(config)
+    mapping_idx = cis_pci_mapping.MappingIndex([['CIS:1', '2.2', 'Title', 'Desc']])
+    policy_details = {'policy': {'name': 'Source', 'rules': [{'cp_rule_id': 'CIS:1', 'name': 'Rule 1'},
+                                                             {'cp_rule_id': 'CIS:2', 'name': 'Rule 2'}]}}
+    filtered_policy = halo_api_caller_obj.extract_policy_rules_have_pci((policy_details, False), mapping_idx)
+    rules = filtered_policy['policy']['rules']
+    assert len(rules) == 1
+    assert rules[0]['name'] == 'PCI-DSS-2.2-Rule 1'
+    assert rules[0]['user_notes'] == 'PCI-DSS Req: 2.2, PCI_Title: Title, PCI_Description: Desc'
+    assert filtered_policy['policy']['name'].startswith('PCI-DSS_Source_')
+
+
+def test_extract_policy_rules_keeps_source_policy():
+    config = cis_pci_mapping.ConfigHelper()
+    halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(config)
+    mapping_idx = cis_pci_mapping.MappingIndex([['CIS:1', '2.2', 'Title', 'Desc']])
+    policy_details = {'policy': {'name': 'Source', 'rules': [{'cp_rule_id': 'CIS:1', 'name': 'Rule 1'}]}}
+    pci_policy = halo_api_caller_obj.extract_policy_rules_have_pci((policy_details, False), mapping_idx)
+    nist_policy = halo_api_caller_obj.extract_policy_rules_have_nist((policy_details, False), mapping_idx)
+    assert policy_details['policy']['name'] == 'Source'
+    assert policy_details['policy']['rules'][0] == {'cp_rule_id': 'CIS:1', 'name': 'Rule 1'}
+    assert pci_policy['policy']['rules'][0]['name'] == 'PCI-DSS-2.2-Rule 1'
+    assert nist_policy['policy']['rules'][0]['name'] == 'NIST-2.2-Rule 1'
+
+
+def test_mapping_table_interns_and_looks_up_records():
+    mapping_table = cis_pci_mapping.MappingTable.from_records({
+        'PCI': [['CIS:1', '2.2', 'Configuration standards', 'D1'], ['CIS:2', '2.2', 'Configuration standards', 'D1']],
+        'NIST': [['CIS:1', 'PR.IP-1', 'Baseline configuration', 'D2']]})
+    pci_records = list(mapping_table.iter_framework('PCI'))
+    assert [record.cp_rule_id for record in pci_records] == ['CIS:1', 'CIS:2']
+    assert pci_records[0].title is pci_records[1].title
+    assert mapping_table.get('CIS:1', 'NIST') == ['CIS:1', 'PR.IP-1', 'Baseline configuration', 'D2']
+    assert sorted(mapping_table.get('CIS:1')) == ['NIST', 'PCI']
+    assert mapping_table.get('CIS:2') == {'PCI': ['CIS:2', '2.2', 'Configuration standards', 'D1']}
+    memory_usage = mapping_table.memory_usage()
+    assert memory_usage['records'] == 3
+    assert memory_usage['unique_strings'] == 8
+    assert memory_usage['bytes'] > 0
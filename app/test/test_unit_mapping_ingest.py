@@ -0,0 +1,63 @@
+import imp
+import os
+import shutil
+import sys
+
+import pandas as pd
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+
+def write_workbook(path, sheet_name, rows):
+    columns = ['CP Rule ID', 'PCI-DSS_Req. #', 'PCI-DSS_Title', 'PCI-DSS_Description']
+    pd.DataFrame(rows, columns=columns).to_excel(str(path), sheet_name=sheet_name, index=False)
+
+
+def test_ingest_workbooks_in_parallel(tmp_path):
+    config = cis_pci_mapping.ConfigHelper()
+    single = cis_pci_mapping.ExcelHandler().load_mapping_records(
+        os.path.join(module_path, config.mapping_file_name), config.sheet_name, ['PCI', 'NIST'],
+        config.excel_engine_type)
+    for name in ("ubuntu.xlsx", "rhel.xlsx"):
+        shutil.copy(os.path.join(module_path, config.mapping_file_name), str(tmp_path / name))
+    paths = cis_pci_mapping.mapping_ingest.expand_mapping_sources(str(tmp_path))
+    assert paths == cis_pci_mapping.mapping_ingest.expand_mapping_sources(str(tmp_path / "*.xlsx"))
+    assert [os.path.basename(path) for path in paths] == ["rhel.xlsx", "ubuntu.xlsx"]
+
+    cache = cis_pci_mapping.MappingCache(str(tmp_path / "cache"))
+    ingestor = cis_pci_mapping.MappingIngestor(2, config.excel_engine_type, cache)
+    mapping_table = ingestor.ingest(paths, [config.sheet_name, "Missing"], ['PCI', 'NIST'])
+    # Both workbooks hold the same records: kept once, no conflict
+    assert ingestor.conflicts == []
+    for mapping_type in ('PCI', 'NIST'):
+        expected = cis_pci_mapping.MappingIndex(single[mapping_type])
+        assert sorted(list(record) for record in mapping_table.index(mapping_type)) == sorted(
+            list(record) for record in expected)
+
+    def fail_parse(missing):
+        assert missing == [], "mapping workbooks parsed on a warm cache"
+        return []
+
+    ingestor.parse = fail_parse
+    warm_table = ingestor.ingest(paths, [config.sheet_name], ['PCI', 'NIST'])
+    assert len(warm_table) == len(mapping_table)
+
+
+def test_ingest_reports_conflicts(tmp_path):
+    write_workbook(tmp_path / "a.xlsx", "Sheet2", [['CIS:A:1', '2.2', 'Config', 'Desc'],
+                                                   ['CIS:A:2', '8.1', 'Users', 'Desc']])
+    write_workbook(tmp_path / "b.xlsx", "Sheet2", [['CIS:A:1', '2.2', 'Config', 'Desc'],
+                                                   ['CIS:A:2', '8.2', 'Auth', 'Desc'],
+                                                   ['CIS:B:1', '10.1', 'Logs', 'Desc']])
+    ingestor = cis_pci_mapping.MappingIngestor(1)
+    mapping_table = ingestor.ingest(cis_pci_mapping.mapping_ingest.expand_mapping_sources(str(tmp_path)),
+                                    ["Sheet2"], ['PCI'])
+    assert len(mapping_table) == 3
+    assert mapping_table.get('CIS:A:2', 'PCI').req_no == '8.2'
+    assert ingestor.conflicts == [{'mapping_type': 'PCI', 'cp_rule_id': 'CIS:A:2', 'req_no': '8.1',
+                                   'source': 'a.xlsx:Sheet2', 'other_req_no': '8.2', 'other_source': 'b.xlsx:Sheet2'}]
@@ -0,0 +1,122 @@
+import imp
+import json
+import os
+import sys
+import threading
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+sys.path.append(current_dir)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+import fake_halo_api  # noqa: E402
+import runner  # noqa: E402
+
+
+def build_service(monkeypatch, tmp_path, server, loads, **kwargs):
+    for name, value in {"HALO_API_HOSTNAME": server.base_url, "HALO_API_PORT": str(server.server_port),
+                        "HALO_API_KEY_ID": "key", "HALO_API_KEY_SECRET": "secret",
+                        "MAPPING_CACHE_DIR": str(tmp_path)}.items():
+        monkeypatch.setenv(name, value)
+    config = cis_pci_mapping.ConfigHelper()
+    halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(config)
+
+    def load_mapping_indexes(mapping_types):
+        loads.append(list(mapping_types))
+        return runner.load_mapping_indexes(config, mapping_types)
+
+    return cis_pci_mapping.MappingService(halo_api_caller_obj, load_mapping_indexes,
+                                          runner.get_mapping_file_path(config),
+                                          cis_pci_mapping.PolicyPublisher(halo_api_caller_obj), **kwargs)
+
+
+def test_jobs_triggered_over_http_reuse_warm_state(monkeypatch, tmp_path):
+    loads = []
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source A", 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        server.add_synthetic_policy("Source B", 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        service = build_service(monkeypatch, tmp_path, server, loads, workers=2)
+        service.start(['PCI', 'HIPAA'])
+        trigger = cis_pci_mapping.MappingServiceServer(service, port=0)
+        threading.Thread(target=trigger.serve_forever, daemon=True).start()
+        session = cis_pci_mapping.http_session.HTTPSession(retries=0)
+        url = "http://127.0.0.1:%d" % trigger.server_port
+        try:
+            job_ids = []
+            for request in ({'policy_names': ['Source A'], 'mapping_types': ['pci']},
+                            {'policy_pattern': '^Source', 'mapping_types': ['PCI', 'HIPAA']}):
+                response = session.request("POST", url + "/jobs", body=json.dumps(request).encode("utf-8"))
+                assert response.status == 202
+                job_ids.append(json.loads(response.data.decode("utf-8"))['job']['id'])
+            jobs = [service.wait(job_id, timeout=30) for job_id in job_ids]
+            assert [job['status'] for job in jobs] == ["success", "success"]
+            assert len(jobs[0]['results']) == 1
+            assert len(jobs[1]['results']) == 4
+
+            response = session.request("GET", url + "/jobs/" + job_ids[1])
+            assert json.loads(response.data.decode("utf-8"))['job']['status'] == "success"
+            for body in (b'{"mapping_types": ["PCI"]}', b'{"policy_names": "Source A"}', b'["Source A"]',
+                         b'{"policy_names": ["Source A"], "mapping_types": [1]}',
+                         b'{"policy_names": ["Source A"], "mapping_types": "PCI"}',
+                         b'{"policy_pattern": ["^Source"]}'):
+                response = session.request("POST", url + "/jobs", body=body)
+                assert response.status == 400
+            assert len(service.list_jobs()) == 2
+            response = session.request("GET", url + "/health")
+            assert json.loads(response.data.decode("utf-8"))['mapping_types'] == ['HIPAA', 'PCI']
+        finally:
+            session.clear()
+            trigger.shutdown()
+            trigger.server_close()
+            service.stop()
+        assert loads == [['PCI', 'HIPAA']]
+        assert server.stats['auth']['requests'] == 1
+        assert len(server.created_policies()) == 5
+
+
+def test_scheduled_jobs(monkeypatch, tmp_path):
+    loads = []
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source", 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        service = build_service(monkeypatch, tmp_path, server, loads, schedule_interval=0.2,
+                                scheduled_job={'policy_names': ['Source'], 'mapping_types': ['PCI']})
+        service.start(['PCI'])
+        try:
+            first = None
+            for _ in range(100):
+                jobs = service.list_jobs()
+                if len(jobs) >= 2:
+                    break
+                threading.Event().wait(0.1)
+            first = service.wait(jobs[0]['id'], timeout=30)
+        finally:
+            service.stop()
+        assert first['trigger'] == "schedule"
+        assert first['status'] == "success"
+        assert len(jobs) >= 2
+
+
+def test_metrics_reported_per_job(monkeypatch, tmp_path):
+    json_log = str(tmp_path / "metrics.jsonl")
+    monkeypatch.setenv("METRICS_ENABLED", "true")
+    monkeypatch.setenv("METRICS_JSON_LOG", json_log)
+    monkeypatch.setenv("METRICS_TEXTFILE", str(tmp_path / "metrics.prom"))
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source", 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        service = build_service(monkeypatch, tmp_path, server, [])
+        service.start(['PCI'])
+        try:
+            for _ in range(2):
+                job = service.submit(['Source'], mapping_types=['PCI'])
+                assert service.wait(job['id'], timeout=30)['status'] == "success"
+        finally:
+            service.stop()
+            service.halo_api_caller.metrics.close()
+
+    summaries = [record for record in map(json.loads, open(json_log)) if record['type'] == "summary"]
+    assert len(summaries) == 2
+    assert [summary['counters']['rules_in|mapping_type=PCI'] for summary in summaries] == [10, 10]
+    assert summaries[1]['duration_seconds'] < 30
@@ -0,0 +1,66 @@
+import imp
+import json
+import os
+import sys
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+sys.path.append(current_dir)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+import fake_halo_api  # noqa: E402
+import runner  # noqa: E402
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = cis_pci_mapping.Metrics()
+    with metrics.span("stage", stage="auth") as span:
+        span.set(status=200)
+    metrics.count("rules_in", 10, mapping_type="PCI")
+    assert metrics.durations == {}
+    assert metrics.counters == {}
+
+
+def test_metrics_export(tmp_path):
+    json_log = str(tmp_path / "metrics.jsonl")
+    textfile = str(tmp_path / "metrics.prom")
+    metrics = cis_pci_mapping.Metrics(True, json_log, textfile)
+    with metrics.span("http_request", method="GET", endpoint=metrics.endpoint("https://h:443/v1/policies/ab12")):
+        pass
+    metrics.count("rules_out", 3, mapping_type="PCI")
+    metrics.count("rules_out", 2, mapping_type="PCI")
+    metrics.finish()
+
+    records = [json.loads(line) for line in open(json_log)]
+    assert records[0]['name'] == "http_request"
+    assert records[0]['endpoint'] == "/v1/policies/{id}"
+    assert records[-1]['type'] == "summary"
+    text = open(textfile).read()
+    assert 'cispcimapping_http_request_duration_seconds_count{endpoint="/v1/policies/{id}",method="GET"} 1' in text
+    assert 'cispcimapping_rules_out_total{mapping_type="PCI"} 5' in text
+    assert 'cispcimapping_run_success 1' in text
+
+
+def test_runner_stages_and_http_calls_instrumented(monkeypatch, tmp_path):
+    textfile = str(tmp_path / "metrics.prom")
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source", 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        server.inject(503, method="GET", path_prefix="/v1/policies/policy-")
+        for name, value in {"HALO_API_HOSTNAME": server.base_url, "HALO_API_PORT": str(server.server_port),
+                            "HALO_API_KEY_ID": "key", "HALO_API_KEY_SECRET": "secret",
+                            "HALO_API_BACKOFF_FACTOR": "0", "TARGET_POLICY_NAME": "Source", "MAPPING_TYPE": "PCI",
+                            "MAPPING_CACHE_DIR": str(tmp_path), "METRICS_ENABLED": "true",
+                            "METRICS_JSON_LOG": str(tmp_path / "metrics.jsonl"),
+                            "METRICS_TEXTFILE": textfile}.items():
+            monkeypatch.setenv(name, value)
+        runner.main()
+
+    text = open(textfile).read()
+    for stage in ("auth", "policy_list", "policy_details", "mapping_sheet", "filter", "publish"):
+        assert 'stage="%s"' % stage in text
+    assert 'cispcimapping_http_retries_total{endpoint="/v1/policies/{id}",method="GET"} 1' in text
+    assert 'cispcimapping_rules_in_total{mapping_type="PCI"} 10' in text
+    assert 'cispcimapping_rules_out_total{mapping_type="PCI"} 5' in text
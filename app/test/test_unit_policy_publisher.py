@@ -0,0 +1,135 @@
+import imp
+import json
+import os
+import sys
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+
+class RecordingHaloAPICaller(cis_pci_mapping.HaloAPICaller):
+    """HaloAPICaller recording the created and updated policies instead of calling the Halo API."""
+
+    def __init__(self):
+        super(RecordingHaloAPICaller, self).__init__(cis_pci_mapping.ConfigHelper())
+        self.calls = []
+
+    def create_configuration_policy(self, policy_data):
+        if isinstance(policy_data, bytes):
+            policy_data = json.loads(policy_data.decode("utf-8"))
+        self.calls.append(('create', policy_data['policy']['name']))
+        created = len([call for call in self.calls if call[0] == 'create'])
+        return {'policy': dict(policy_data['policy'], id='derived-%d' % created)}, False
+
+    def update_configuration_policy(self, policy_id, policy_data):
+        self.calls.append(('update', policy_id, policy_data['policy']['name']))
+        return {}, False
+
+    def delete_configuration_policy(self, policy_id):
+        self.calls.append(('delete', policy_id))
+        return {}, False
+
+
+def test_incremental_publish(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    halo_api_caller_obj = RecordingHaloAPICaller()
+    policy_details = ({'policy': {'id': 'source-1', 'name': 'Source', 'rules': [
+        {'cp_rule_id': 'CIS:1', 'name': 'Rule 1'}, {'cp_rule_id': 'CIS:2', 'name': 'Rule 2'}]}}, False)
+
+    def publish(fltrd_info_lst):
+        publisher = cis_pci_mapping.PolicyPublisher(halo_api_caller_obj, cis_pci_mapping.MappingState(state_file))
+        mapped_policy = halo_api_caller_obj.extract_policy_rules(
+            policy_details, 'PCI', cis_pci_mapping.MappingIndex(fltrd_info_lst))
+        return publisher.publish('source-1', 'PCI', mapped_policy)
+
+    created = publish([['CIS:1', '2.2', 'Title', 'Desc'], ['CIS:2', '2.4', 'Title', 'Desc']])
+    assert created['action'] == 'created'
+    assert created['policy']['id'] == 'derived-1'
+
+    unchanged = publish([['CIS:1', '2.2', 'Title', 'Desc'], ['CIS:2', '2.4', 'Title', 'Desc']])
+    assert unchanged['action'] == 'unchanged'
+    assert unchanged['policy']['name'] == created['policy']['name']
+
+    updated = publish([['CIS:1', '2.2', 'Title', 'Desc'], ['CIS:2', '8.1', 'Title', 'Desc']])
+    assert updated['action'] == 'updated'
+    assert updated['changed_rules'] == 1
+    assert [call[0] for call in halo_api_caller_obj.calls] == ['create', 'update']
+    assert halo_api_caller_obj.calls[1][1:] == ('derived-1', created['policy']['name'])
+
+
+def test_incremental_publish_deletes_parts_not_needed_anymore(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    halo_api_caller_obj = RecordingHaloAPICaller()
+    policy_details = ({'policy': {'id': 'source-1', 'name': 'Source', 'rules': [
+        {'cp_rule_id': 'CIS:%d' % i, 'name': 'Rule %d' % i, 'description': 'x' * 200} for i in range(3)]}}, False)
+    mapping_idx = cis_pci_mapping.MappingIndex([['CIS:%d' % i, '2.%d' % i, 'Title', 'Desc'] for i in range(3)])
+
+    def publish(max_payload_bytes, req_no='2.0'):
+        halo_api_caller_obj.halo_api_max_payload_bytes = max_payload_bytes
+        mapping_idx.find('CIS:0').req_no = req_no
+        publisher = cis_pci_mapping.PolicyPublisher(halo_api_caller_obj, cis_pci_mapping.MappingState(state_file))
+        mapped_policy = halo_api_caller_obj.extract_policy_rules(policy_details, 'PCI', mapping_idx)
+        return publisher.publish('source-1', 'PCI', mapped_policy)
+
+    split = publish(600)
+    assert [part['policy']['id'] for part in split['parts']] == ['derived-1', 'derived-2', 'derived-3']
+    assert cis_pci_mapping.MappingState(state_file).get('source-1', 'PCI')['part_ids'] == [
+        'derived-1', 'derived-2', 'derived-3']
+
+    merged = publish(0, '2.9')
+    assert merged['action'] == 'updated' and merged['stale_parts'] == []
+    # The merged policy keeps the name of its first part, without the part suffix
+    assert merged['policy']['name'] == split['parts'][0]['policy']['name'][:-len(" (1/3)")]
+    assert halo_api_caller_obj.calls[3:] == [('update', 'derived-1', merged['policy']['name']),
+                                             ('delete', 'derived-2'), ('delete', 'derived-3')]
+    state = cis_pci_mapping.MappingState(state_file)
+    assert sorted(state.entries) == ['source-1|PCI']
+    assert 'part_ids' not in state.get('source-1', 'PCI')
+
+    # Split again: the updated first part gets the part suffix of the other parts
+    resplit = publish(600, '2.0')
+    assert resplit['parts'][0]['policy']['name'] == merged['policy']['name'] + " (1/3)"
+    assert [part['policy']['name'][-len(" (1/3)"):] for part in resplit['parts']] == [" (1/3)", " (2/3)", " (3/3)"]
+
+
+class FailingUpdateHaloAPICaller(RecordingHaloAPICaller):
+    """RecordingHaloAPICaller whose updates fail, and whose deletes fail when delete_fails is set."""
+
+    delete_fails = False
+
+    def update_configuration_policy(self, policy_id, policy_data):
+        self.calls.append(('update', policy_id, policy_data['policy']['name']))
+        return None, False
+
+    def delete_configuration_policy(self, policy_id):
+        self.calls.append(('delete', policy_id))
+        return (None if self.delete_fails else {}), False
+
+
+def test_failed_update_replaces_the_previous_policy(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    halo_api_caller_obj = FailingUpdateHaloAPICaller()
+    policy_details = ({'policy': {'id': 'source-1', 'name': 'Source', 'rules': [
+        {'cp_rule_id': 'CIS:1', 'name': 'Rule 1'}]}}, False)
+
+    def publish(req_no):
+        publisher = cis_pci_mapping.PolicyPublisher(halo_api_caller_obj, cis_pci_mapping.MappingState(state_file))
+        mapped_policy = halo_api_caller_obj.extract_policy_rules(
+            policy_details, 'PCI', cis_pci_mapping.MappingIndex([['CIS:1', req_no, 'Title', 'Desc']]))
+        return publisher.publish('source-1', 'PCI', mapped_policy)
+
+    created = publish('2.2')
+    replaced = publish('2.4')
+    assert replaced['action'] == 'created' and replaced['stale_parts'] == []
+    assert halo_api_caller_obj.calls[1:] == [('update', 'derived-1', created['policy']['name']),
+                                             ('create', created['policy']['name']), ('delete', 'derived-1')]
+    assert cis_pci_mapping.MappingState(state_file).get('source-1', 'PCI')['derived_policy_id'] == 'derived-2'
+
+    halo_api_caller_obj.delete_fails = True
+    replaced = publish('8.1')
+    assert replaced['action'] == 'created' and replaced['stale_parts'] == ['derived-2']
+    assert cis_pci_mapping.MappingState(state_file).get('source-1', 'PCI')['derived_policy_id'] == 'derived-3'
@@ -0,0 +1,85 @@
+import imp
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+sys.path.append(current_dir)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+import fake_halo_api  # noqa: E402
+
+
+def test_response_cache_lru_eviction(tmp_path):
+    cache = cis_pci_mapping.ResponseCache(str(tmp_path), max_bytes=2500)
+    assert not cache.store("key", "http://api/v1/policies/0", b"x" * 1000)
+    for i in range(3):
+        assert cache.store("key", "http://api/v1/policies/%d" % i, b"x" * 1000, etag='"%d"' % i)
+        os.utime(cache.entry_path("key", "http://api/v1/policies/%d" % i), (i, i))
+        if i == 1:
+            # A hit makes the first entry the most recently used one
+            assert cache.get("key", "http://api/v1/policies/0")['etag'] == '"0"'
+    assert cache.get("key", "http://api/v1/policies/1") is None
+    assert cache.get("key", "http://api/v1/policies/0")['body'] == b"x" * 1000
+    assert cache.get("other key", "http://api/v1/policies/0") is None
+    assert cache.conditional_headers(cache.get("key", "http://api/v1/policies/2")) == {"If-None-Match": '"2"'}
+    assert not cache.is_fresh(cache.get("key", "http://api/v1/policies/2"))
+    assert cache.invalidate() == 2
+
+
+def test_response_cache_size_accounting_under_concurrent_workers(tmp_path):
+    for max_bytes in (10 ** 9, 20 * 1100):
+        cache = cis_pci_mapping.ResponseCache(str(tmp_path / str(max_bytes)), max_bytes=max_bytes)
+
+        def store(i):
+            url = "http://api/v1/policies/%d" % (i % 40)
+            cache.store("key", url, b"x" * 1000, etag='"%d"' % i)
+            if i % 7 == 0:
+                cache.delete("key", url)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(store, range(400)))
+        assert cache.total_bytes == sum(size for _, size, _ in cache.list_entries())
+        assert cache.total_bytes <= cache.max_bytes
+
+
+def test_policy_writes_drop_the_cached_policy_list(tmp_path):
+    with fake_halo_api.FakeHaloAPI(max_per_page=2) as server:
+        for i in range(3):
+            server.add_synthetic_policy("Source %d" % i, 1, ['CIS:1'])
+        config = cis_pci_mapping.ConfigHelper()
+        config.halo_api_hostname = server.base_url
+        config.halo_api_port = str(server.server_port)
+        config.halo_api_per_page = "2"
+        config.halo_api_cache_dir = str(tmp_path / "responses")
+        config.halo_api_cache_ttl = "60"
+        halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(config)
+        try:
+
+            def policy_names():
+                return sorted(policy['name'] for policy in halo_api_caller_obj.get_configuration_policy_list()[0][
+                    'policies'])
+
+            assert policy_names() == ["Source 0", "Source 1", "Source 2"]
+            assert policy_names() == ["Source 0", "Source 1", "Source 2"]
+            assert server.stats['policy_list']['requests'] == 2
+
+            # Within the TTL, the list pages cached before a create, update or delete are not served
+            created = halo_api_caller_obj.create_configuration_policy(
+                {'policy': {'name': "Derived", 'rules': []}})[0]['policy']
+            assert policy_names() == ["Derived", "Source 0", "Source 1", "Source 2"]
+            assert halo_api_caller_obj.get_configuration_policy_details(created['id'])[0]['policy']['name'] == \
+                "Derived"
+            halo_api_caller_obj.update_configuration_policy(created['id'], {'policy': {'name': "Renamed", 'rules': []}})
+            assert halo_api_caller_obj.get_configuration_policy_details(created['id'])[0]['policy']['name'] == \
+                "Renamed"
+            assert policy_names() == ["Renamed", "Source 0", "Source 1", "Source 2"]
+            halo_api_caller_obj.delete_configuration_policy(created['id'])
+            assert policy_names() == ["Source 0", "Source 1", "Source 2"]
+            assert server.stats['policy_list']['requests'] == 2 + 3 * 2
+        finally:
+            halo_api_caller_obj.http_session.clear()
@@ -0,0 +1,326 @@
+import imp
+import json
+import os
+import socket
+import sys
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+sys.path.append(current_dir)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+import fake_halo_api  # noqa: E402
+import runner  # noqa: E402
+
+
+def configure(monkeypatch, tmp_path, server, policy_name):
+    monkeypatch.setenv("HALO_API_HOSTNAME", server.base_url)
+    monkeypatch.setenv("HALO_API_PORT", str(server.server_port))
+    monkeypatch.setenv("HALO_API_KEY_ID", "key")
+    monkeypatch.setenv("HALO_API_KEY_SECRET", "secret")
+    monkeypatch.setenv("HALO_API_BACKOFF_FACTOR", "0")
+    monkeypatch.setenv("HALO_API_PER_PAGE", "2")
+    monkeypatch.setenv("TARGET_POLICY_NAME", policy_name)
+    monkeypatch.setenv("MAPPING_TYPE", "PCI,HIPAA,NIST")
+    monkeypatch.setenv("MAPPING_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("HALO_API_CACHE_DIR", str(tmp_path / "responses"))
+
+
+def test_main_against_fake_halo_api(monkeypatch, tmp_path):
+    with fake_halo_api.FakeHaloAPI(max_per_page=2) as server:
+        for i in range(3):
+            server.add_policy("Other Policy %d" % i, [])
+        server.add_synthetic_policy("Source", 20, ['CIS:Ubuntu18.04:1.1.1.1', 'CIS:Ubuntu18.04:5.2.4'])
+        configure(monkeypatch, tmp_path, server, "Source")
+        runner.main()
+
+        created = server.created_policies()
+        assert sorted(policy['name'].split('_')[0] for policy in created) == ['HIPAA', 'NIST', 'PCI-DSS']
+        for policy in created:
+            assert 0 < len(policy['rules']) <= 10
+        assert server.stats['policy_list']['requests'] == 2
+        assert server.stats['policy_create']['requests'] == 3
+
+
+def test_main_survives_injected_faults(monkeypatch, tmp_path):
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source", 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        configure(monkeypatch, tmp_path, server, "Source")
+        server.inject(503, method="GET", path_prefix="/v1/policies/policy-")
+        server.inject(429, method="POST", path_prefix="/v1/policies", retry_after=0)
+        runner.main()
+
+        assert len(server.created_policies()) == 3
+        assert server.stats['fault']['requests'] == 2
+
+
+def test_main_streaming_policy_details(monkeypatch, tmp_path):
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source", 200, ['CIS:Ubuntu18.04:1.1.1.1', 'CIS:Ubuntu18.04:5.2.4'])
+        configure(monkeypatch, tmp_path, server, "Source")
+        monkeypatch.setenv("HALO_API_STREAM_POLICY_DETAILS", "true")
+        server.inject(503, method="GET", path_prefix="/v1/policies/policy-")
+        runner.main()
+
+        source_rules = server.policies['policy-1']['rules']
+        mapping_idxs = runner.load_mapping_indexes(cis_pci_mapping.ConfigHelper(), ['PCI', 'HIPAA', 'NIST'])
+        created = dict((policy['name'].split('_')[0], policy) for policy in server.created_policies())
+        for mapping_type, prefix in (('PCI', 'PCI-DSS'), ('HIPAA', 'HIPAA'), ('NIST', 'NIST')):
+            expected = [rule for rule in source_rules
+                        if cis_pci_mapping.sheet_validator.rule_key(rule['cp_rule_id']) in mapping_idxs[mapping_type]]
+            assert len(created[prefix]['rules']) == len(expected)
+
+
+def test_bulk_splits_large_policies_and_gzips_requests(monkeypatch, tmp_path):
+    max_payload_bytes = 20000
+    with fake_halo_api.FakeHaloAPI(max_payload_bytes=max_payload_bytes) as server:
+        configure(monkeypatch, tmp_path, server, "Source")
+        mapping_idx = runner.load_mapping_indexes(cis_pci_mapping.ConfigHelper(), ['PCI'])['PCI']
+        rule_ids = sorted(record.cp_rule_id for record in mapping_idx)
+        server.add_synthetic_policy("Source", 2 * len(rule_ids), rule_ids)
+        monkeypatch.setenv("TARGET_POLICY_NAMES", "Source")
+        monkeypatch.setenv("MAPPING_TYPE", "PCI")
+        monkeypatch.setenv("HALO_API_GZIP_REQUESTS", "true")
+        monkeypatch.setenv("HALO_API_MAX_PAYLOAD_BYTES", str(max_payload_bytes))
+        runner.bulk()
+
+        created = sorted(server.created_policies(),
+                         key=lambda policy: int(policy['name'].rsplit('(', 1)[1].split('/')[0]))
+        assert len(created) > 1
+        assert [policy['name'][-len(" (1/%d)" % len(created)):] for policy in created] == [
+            " (%d/%d)" % (i + 1, len(created)) for i in range(len(created))]
+        assert sum(len(policy['rules']) for policy in created) == len(rule_ids)
+        assert server.stats['policy_create']['requests'] == len(created)
+        assert server.stats['policy_create']['bytes_in'] < len(created) * max_payload_bytes / 2
+
+
+def test_bulk_fails_when_the_policy_list_fails(monkeypatch, tmp_path):
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source", 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        configure(monkeypatch, tmp_path, server, "Source")
+        monkeypatch.setenv("TARGET_POLICY_PATTERN", "^Source$")
+        monkeypatch.setenv("MAPPING_TYPE", "PCI")
+        monkeypatch.setenv("JOB_JOURNAL_ENABLED", "true")
+        monkeypatch.setenv("JOB_JOURNAL_FILE", str(tmp_path / "journal.sqlite"))
+        server.inject(500, count=10, method="GET", path_prefix="/v1/policies/")
+        try:
+            runner.bulk()
+            assert False, "bulk succeeded without a policy list"
+        except SystemExit as e:
+            assert e.code == 1
+
+        assert server.created_policies() == []
+        journal = cis_pci_mapping.JobJournal(str(tmp_path / "journal.sqlite"))
+        assert [row[0] for row in journal.connection.execute("SELECT status FROM jobs")] == ['failed']
+
+
+def test_bulk_does_not_resume_unless_asked(monkeypatch, tmp_path):
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source", 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        configure(monkeypatch, tmp_path, server, "")
+        monkeypatch.setenv("TARGET_POLICY_NAMES", "Source,Missing")
+        monkeypatch.setenv("MAPPING_TYPE", "PCI")
+        # The job does not complete (a policy is missing), but a plain rerun maps the source policy again
+        for _ in range(2):
+            try:
+                runner.bulk()
+                assert False, "bulk succeeded with a missing policy"
+            except SystemExit as e:
+                assert e.code == 1
+        assert len(server.created_policies()) == 2
+        assert not os.path.exists(str(tmp_path / "job_journal.sqlite"))
+
+
+def test_bulk_fails_mapping_types_missing_from_the_sheet(monkeypatch, tmp_path):
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source", 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        configure(monkeypatch, tmp_path, server, "")
+        monkeypatch.setenv("TARGET_POLICY_NAMES", "Source")
+        # The shipped mapping workbook has no ISO 27001 columns
+        monkeypatch.setenv("MAPPING_TYPE", "PCI,ISO27001")
+        try:
+            runner.bulk()
+            assert False, "bulk succeeded without any ISO27001 mapping record"
+        except SystemExit as e:
+            assert e.code == 1
+        assert server.created_policies() == []
+
+
+def test_dry_run_writes_derived_policies_and_rule_diff(monkeypatch, tmp_path):
+    input_dir = tmp_path / "policies"
+    input_dir.mkdir()
+    rules = [{'cp_rule_id': 'CIS:Ubuntu18.04:1.1.1.1', 'name': 'Mapped rule'},
+             {'cp_rule_id': 'CIS:Unknown:1', 'name': 'Unmapped rule'}]
+    (input_dir / "a.json").write_text(json.dumps({'policy': {'id': 'a', 'name': 'Saved A', 'rules': rules}}))
+    (input_dir / "b.json").write_text(json.dumps({'id': 'b', 'name': 'Saved B', 'rules': rules[1:]}))
+    monkeypatch.setenv("MAPPING_TYPE", "PCI,NIST")
+    monkeypatch.setenv("MAPPING_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("DRY_RUN_INPUT", str(input_dir))
+    monkeypatch.setenv("DRY_RUN_OUTPUT_DIR", str(tmp_path / "out"))
+    runner.dry_run()
+
+    def read_lines(file_name):
+        with open(str(tmp_path / "out" / file_name)) as fh:
+            return [json.loads(line) for line in fh]
+
+    derived = read_lines("derived_policies.jsonl")
+    assert [(entry['mapping_type'], len(entry['policy']['rules'])) for entry in derived] == [
+        ('PCI', 1), ('NIST', 1), ('PCI', 0), ('NIST', 0)]
+    diff = read_lines("rule_diff.jsonl")
+    assert [(entry['source_policy_id'], entry['cp_rule_id'], entry['status']) for entry in diff if
+            entry['mapping_type'] == 'PCI'] == [('a', 'CIS:Ubuntu18.04:1.1.1.1', 'renamed'),
+                                                ('a', 'CIS:Unknown:1', 'dropped'), ('b', 'CIS:Unknown:1', 'dropped')]
+    coverage = read_lines("coverage.jsonl")
+    assert coverage[0]['rules_kept'] == 1 and coverage[0]['rules_dropped'] == 1
+    assert 0 < coverage[0]['requirements_covered'] <= coverage[0]['requirements_total']
+
+
+def test_dry_run_coverage_counts_every_requirement_of_a_cell(tmp_path):
+    mapping_idx = cis_pci_mapping.MappingIndex([['CIS:1', '10.2.1, 11.5', 'Title', 'Desc'],
+                                                ['CIS:2', '11.5', 'Title', 'Desc'], ['CIS:3', '2.2', 'Title', 'Desc']])
+    offline_mapper_obj = cis_pci_mapping.OfflineMapper(cis_pci_mapping.HaloAPICaller(cis_pci_mapping.ConfigHelper()),
+                                                       {'PCI': mapping_idx}, str(tmp_path))
+    policy_details = {'policy': {'id': 'a', 'name': 'Saved A', 'rules': [{'cp_rule_id': 'CIS:1', 'name': 'Rule 1'},
+                                                                         {'cp_rule_id': 'CIS:2', 'name': 'Rule 2'}]}}
+    _, diff, coverage = offline_mapper_obj.map_policy(policy_details, 'PCI')
+    assert [entry['status'] for entry in diff] == ['renamed', 'renamed']
+    assert (coverage['requirements_covered'], coverage['requirements_total']) == (2, 3)
+
+
+def test_response_cache_revalidates_unchanged_policies(monkeypatch, tmp_path):
+    with fake_halo_api.FakeHaloAPI() as server:
+        server.add_synthetic_policy("Source", 200, ['CIS:Ubuntu18.04:1.1.1.1', 'CIS:Ubuntu18.04:5.2.4'])
+        configure(monkeypatch, tmp_path, server, "Source")
+        runner.main()
+        details_bytes = server.stats['policy_details']['bytes_out']
+        assert details_bytes > 0
+
+        runner.main()
+        assert server.stats['policy_details']['requests'] == 2
+        assert server.stats['policy_details']['bytes_out'] == details_bytes
+
+        monkeypatch.setenv("HALO_API_CACHE_TTL", "60")
+        runner.main()
+        assert server.stats['policy_details']['requests'] == 2
+
+        monkeypatch.setenv("HALO_API_CACHE_PURGE", "true")
+        runner.main()
+        assert server.stats['policy_details']['requests'] == 3
+        assert server.stats['policy_details']['bytes_out'] == 2 * details_bytes
+        assert len(server.created_policies()) == 12
+
+
+def test_fanout_maps_every_tenant(monkeypatch, tmp_path):
+    with fake_halo_api.FakeHaloAPI() as acme, fake_halo_api.FakeHaloAPI() as globex:
+        acme.add_synthetic_policy("Source", 20, ['CIS:Ubuntu18.04:1.1.1.1'])
+        for name in ("CIS Ubuntu", "CIS RHEL", "Other"):
+            globex.add_synthetic_policy(name, 20, ['CIS:Ubuntu18.04:1.1.1.1', 'CIS:Ubuntu18.04:5.2.4'])
+        configure(monkeypatch, tmp_path, acme, "")
+        monkeypatch.setenv("GLOBEX_SECRET", "globex-secret")
+        manifest = {'tenants': [
+            {'name': 'acme', 'halo_api_key_id': 'acme', 'halo_api_key_secret': 'acme-secret',
+             'halo_api_hostname': acme.base_url, 'halo_api_port': acme.server_port, 'policy_names': ['Source']},
+            {'name': 'globex', 'halo_api_key_id': 'globex', 'halo_api_key_secret_env': 'GLOBEX_SECRET',
+             'halo_api_hostname': globex.base_url, 'halo_api_port': globex.server_port, 'policy_pattern': '^CIS',
+             'mapping_types': ['pci', 'NIST'], 'workers': 1},
+            {'name': 'initech', 'halo_api_key_id': 'initech', 'halo_api_key_secret': 'initech-secret',
+             'halo_api_hostname': acme.base_url, 'halo_api_port': acme.server_port, 'policy_names': ['Missing']}]}
+        (tmp_path / "tenants.json").write_text(json.dumps(manifest))
+        monkeypatch.setenv("TENANT_MANIFEST", str(tmp_path / "tenants.json"))
+        monkeypatch.setenv("FANOUT_WORKERS", "2")
+        monkeypatch.setenv("FANOUT_SUMMARY_FILE", str(tmp_path / "summary.json"))
+        monkeypatch.setenv("JOB_RESUME", "true")
+        try:
+            runner.fanout()
+            assert False, "fan-out with a failed tenant exited successfully"
+        except SystemExit as e:
+            assert e.code == 1
+
+        with open(str(tmp_path / "summary.json")) as fh:
+            summary = json.load(fh)
+        tenants = dict((tenant['tenant'], tenant) for tenant in summary['tenants'])
+        assert [tenant['tenant'] for tenant in summary['tenants']] == ['acme', 'globex', 'initech']
+        assert tenants['acme']['status'] == 'success' and tenants['acme']['created'] == 3
+        assert tenants['globex']['status'] == 'success' and tenants['globex']['created'] == 4
+        assert tenants['initech']['status'] == 'failed' and tenants['initech']['missing'] == ['Missing']
+        assert summary['totals'] == {'tenants': 3, 'tenants_failed': 1, 'policies': 3, 'created': 7, 'updated': 0,
+                                     'unchanged': 0, 'resumed': 0, 'failed': 0}
+        assert sorted(policy['name'].split('_')[0] for policy in globex.created_policies()) == [
+            'NIST', 'NIST', 'PCI-DSS', 'PCI-DSS']
+        assert len(acme.created_policies()) == 3
+
+        # The job did not complete: running it again resumes it, without creating the policies again
+        try:
+            runner.fanout()
+        except SystemExit:
+            pass
+        with open(str(tmp_path / "summary.json")) as fh:
+            summary = json.load(fh)
+        assert summary['totals']['resumed'] == 7 and summary['totals']['created'] == 0
+        assert len(acme.created_policies()) + len(globex.created_policies()) == 7
+
+
+def test_fanout_fails_tenants_without_token_or_policy_list(monkeypatch, tmp_path):
+    closed_socket = socket.socket()
+    closed_socket.bind(("127.0.0.1", 0))
+    closed_port = closed_socket.getsockname()[1]
+    closed_socket.close()
+    with fake_halo_api.FakeHaloAPI() as acme, fake_halo_api.FakeHaloAPI() as globex:
+        for server in (acme, globex):
+            server.add_synthetic_policy("CIS Ubuntu", 20, ['CIS:Ubuntu18.04:1.1.1.1'])
+        configure(monkeypatch, tmp_path, acme, "")
+        monkeypatch.setenv("HALO_API_RETRIES", "0")
+        monkeypatch.setenv("MAPPING_TYPE", "PCI")
+        globex.inject(500, method="GET", path_prefix="/v1/policies/")
+        manifest = [{'name': name, 'halo_api_key_id': name, 'halo_api_key_secret': 'secret',
+                     'halo_api_hostname': acme.base_url, 'halo_api_port': port, 'policy_pattern': '^CIS'}
+                    for name, port in (('acme', acme.server_port), ('unreachable', closed_port),
+                                       ('globex', globex.server_port))]
+        (tmp_path / "tenants.json").write_text(json.dumps(manifest))
+        monkeypatch.setenv("TENANT_MANIFEST", str(tmp_path / "tenants.json"))
+        monkeypatch.setenv("FANOUT_SUMMARY_FILE", str(tmp_path / "summary.json"))
+        try:
+            runner.fanout()
+            assert False, "fan-out with tenants failing to authenticate exited successfully"
+        except SystemExit as e:
+            assert e.code == 1
+
+        with open(str(tmp_path / "summary.json")) as fh:
+            summary = json.load(fh)
+        tenants = dict((tenant['tenant'], tenant) for tenant in summary['tenants'])
+        assert tenants['acme']['status'] == 'success' and tenants['acme']['created'] == 1
+        assert tenants['unreachable']['status'] == 'failed' and 'token' in tenants['unreachable']['error']
+        assert tenants['globex']['status'] == 'failed' and 'policy list' in tenants['globex']['error']
+        assert summary['totals']['tenants_failed'] == 2
+        assert globex.created_policies() == []
+
+
+def test_bulk_resumes_interrupted_job(monkeypatch, tmp_path):
+    with fake_halo_api.FakeHaloAPI() as server:
+        for name in ("CIS A", "CIS B"):
+            server.add_synthetic_policy(name, 10, ['CIS:Ubuntu18.04:1.1.1.1'])
+        configure(monkeypatch, tmp_path, server, "")
+        monkeypatch.setenv("TARGET_POLICY_PATTERN", "^CIS")
+        monkeypatch.setenv("HALO_API_RETRIES", "0")
+        monkeypatch.setenv("JOB_RESUME", "true")
+        server.inject(500, method="POST", path_prefix="/v1/policies")
+        try:
+            runner.bulk()
+            assert False, "bulk run with a failed policy creation exited successfully"
+        except SystemExit as e:
+            assert e.code == 1
+        assert len(server.created_policies()) == 5
+
+        runner.bulk()
+        assert len(server.created_policies()) == 6
+        journal = cis_pci_mapping.JobJournal(str(tmp_path / "job_journal.sqlite"))
+        units = journal.units(journal.job_key('bulk', server.base_url, 'key', [], '^CIS', ['PCI', 'HIPAA', 'NIST']))
+        assert [unit['state'] for unit in units] == ['done'] * 6
+        assert sorted(unit['attempts'] for unit in units) == [1, 1, 1, 1, 1, 2]
+
+        # A completed job starts afresh
+        runner.bulk()
+        assert len(server.created_policies()) == 12
@@ -0,0 +1,78 @@
+import imp
+import os
+import sys
+
+import pandas as pd
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+
+def test_normalize_flags_and_cleans_records():
+    validator = cis_pci_mapping.SheetValidator()
+    records = validator.normalize('PCI', [
+        [' CIS:Ubuntu18.04:1.1.1.1 ', '10.2.1,\n\n11.5:', 'Logs', 'Desc '],
+        ['1234.0', '2.2', 'Config', 'Desc'],
+        ['nan', '8.1', 'Users', 'Desc'],
+        ['CIS:Ubuntu18.04:5.2.4', 'N/A', 'None', 'Desc'],
+        ['cis:ubuntu18.04:1.1.1.1', ' 10.2.1,\n\n11.5: ', 'Logs', 'Desc'],
+        ['1234', '2.4', 'Config', 'Desc']])
+    assert records == [['CIS:Ubuntu18.04:1.1.1.1', '10.2.1,\n\n11.5:', 'Logs', 'Desc'],
+                       ['1234', '2.4', 'Config', 'Desc']]
+    assert validator.counts() == {'normalized_rule_id': 2, 'normalized_requirement': 1, 'blank_rule_id': 1,
+                                  'blank_requirement': 1, 'duplicate': 1, 'conflict': 1}
+    conflict = [issue for issue in validator.issues if issue['issue'] == 'conflict'][0]
+    assert (conflict['cp_rule_id'], conflict['value'], conflict['other_value']) == ('1234', '2.2', '2.4')
+
+    mapping_idx = cis_pci_mapping.MappingIndex(records)
+    for cp_rule_id in ('CIS:Ubuntu18.04:1.1.1.1', 'cis:UBUNTU18.04:1.1.1.1', ' CIS:Ubuntu18.04:1.1.1.1\n'):
+        assert mapping_idx.find(cp_rule_id).req_no == '10.2.1,\n\n11.5:'
+    assert mapping_idx.find('1234.0').req_no == '2.4'
+    assert mapping_idx.find(None) is None and 'cis:ubuntu18.04:5.2.4' not in mapping_idx
+
+
+def test_loaded_sheet_is_cleaned_and_cached(tmp_path):
+    workbook = tmp_path / "mapping.xlsx"
+    pd.DataFrame([['CIS:A:1 ', '2.2\n\n2.4', 'Config', 'Desc'], [1234, '8.1', 'Users', 'Desc'],
+                  ['CIS:A:1', '2.2\n\n2.4 ', 'Config', 'Desc']],
+                 columns=['CP Rule ID', 'PCI-DSS_Req. #', 'PCI-DSS_Title', 'PCI-DSS_Description']).to_excel(
+        str(workbook), sheet_name="Sheet2", index=False)
+    cache = cis_pci_mapping.MappingCache(str(tmp_path / "cache"))
+    validator = cis_pci_mapping.SheetValidator()
+    records = cis_pci_mapping.ExcelHandler().load_mapping_records(str(workbook), "Sheet2", ['PCI'], "openpyxl",
+                                                                  cache, validator)
+    assert records == {'PCI': [['CIS:A:1', '2.2\n\n2.4', 'Config', 'Desc'], ['1234', '8.1', 'Users', 'Desc']]}
+    assert validator.counts() == {'normalized_rule_id': 1, 'normalized_requirement': 1, 'duplicate': 1}
+    assert cache.load(str(workbook), "Sheet2", 'PCI', cache.fingerprint(str(workbook))) == records['PCI']
+
+    halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(cis_pci_mapping.ConfigHelper())
+    policy_details = {'policy': {'name': 'Source', 'rules': [{'cp_rule_id': 'cis:a:1', 'name': 'Rule 1'}]}}
+    mapped_policy = halo_api_caller_obj.extract_policy_rules(
+        (policy_details, False), 'PCI', cis_pci_mapping.MappingIndex(records['PCI']))
+    assert mapped_policy['policy']['rules'][0]['name'] == 'PCI-DSS-2.2\n\n2.4-Rule 1'
+
+
+def test_real_sheet_keeps_the_baseline_rule_names():
+    workbook = os.path.join(current_dir, '../Ubuntu-CIS-Control-PCD-DSS-mapping.xlsx')
+    df = cis_pci_mapping.ExcelHandler().read_from_excel("Sheet2", os.path.basename(workbook),
+                                                        os.path.dirname(workbook), "openpyxl")
+    records = cis_pci_mapping.ExcelHandler().load_mapping_records(workbook, "Sheet2", ['PCI', 'HIPAA', 'NIST'],
+                                                                  "openpyxl")
+    for mapping_type, fltrd_info_lst in records.items():
+        framework = cis_pci_mapping.frameworks.get(mapping_type)
+        mapping_idx = cis_pci_mapping.MappingIndex(fltrd_info_lst)
+        # The records of the unvalidated sheet parsing, the last one of a rule ID winning
+        baseline = {}
+        for _, row in df.iterrows():
+            req_no = str(row[framework.req_column])
+            if req_no != 'nan':
+                baseline[str(row['CP Rule ID'])] = req_no
+        assert len(mapping_idx) == len(baseline)
+        for cp_rule_id, req_no in baseline.items():
+            # Only the whitespace around a cell is trimmed, the separators between its requirements are kept
+            rule = framework.annotate_rule({'name': 'Rule'}, mapping_idx.find(cp_rule_id))
+            assert rule['name'] == framework.rule_name_prefix + req_no.strip() + '-Rule'
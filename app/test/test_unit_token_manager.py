@@ -0,0 +1,161 @@
+import imp
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+module_name = 'cispcimapping'
+current_dir = os.path.dirname(os.path.abspath(__file__))
+module_path = os.path.join(current_dir, '../')
+sys.path.append(module_path)
+fp, pathname, description = imp.find_module(module_name)
+cis_pci_mapping = imp.load_module(module_name, fp, pathname, description)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RejectingAuthHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        data = json.dumps({'error': 'invalid_client'}).encode("utf-8")
+        self.send_response(401)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class ExpiringTokenHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    issued_tokens = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        token = "token-%d" % (len(self.issued_tokens) + 1)
+        self.issued_tokens.append(token)
+        self.send_json(200, {'access_token': token, 'expires_in': 900})
+
+    def do_GET(self):
+        if self.headers.get("Authorization") != "Bearer " + self.issued_tokens[-1]:
+            self.send_json(401, {'error': 'expired'})
+        else:
+            self.send_json(200, {'policy': {'name': 'Source', 'rules': []}})
+
+    def send_json(self, status, obj):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_token_refreshed_before_expiry():
+    calls = []
+
+    def fetch_token():
+        calls.append(time.monotonic())
+        return "token-%d" % len(calls), 900
+
+    manager = cis_pci_mapping.TokenManager(fetch_token, refresh_margin=60)
+    assert manager.get_token() == "token-1"
+    assert manager.get_token() == "token-1"
+    manager.expires_at = time.monotonic() + 30
+    assert manager.get_token() == "token-2"
+    manager.invalidate("token-1")
+    assert manager.get_token() == "token-2"
+    manager.invalidate("token-2")
+    assert manager.get_token() == "token-3"
+
+
+def test_token_without_expiry_and_failed_fetch_are_not_refetched():
+    responses = [("token-1", None), (None, None), ("token-2", 0)]
+    calls = []
+
+    def fetch_token():
+        calls.append(1)
+        return responses[len(calls) - 1]
+
+    manager = cis_pci_mapping.TokenManager(fetch_token, refresh_margin=60, default_lifetime=900, failure_backoff=30)
+    assert manager.get_token() == "token-1"
+    assert manager.get_token() == "token-1" and len(calls) == 1
+    manager.invalidate("token-1")
+    assert manager.get_token() is None
+    assert manager.get_token() is None and len(calls) == 2
+    manager.retry_at = time.monotonic()
+    assert manager.get_token() == "token-2"
+    assert manager.get_token() == "token-2" and len(calls) == 3
+
+
+def test_concurrent_callers_share_one_refresh():
+    calls = []
+
+    def fetch_token():
+        calls.append(1)
+        time.sleep(0.05)
+        return "token", 900
+
+    manager = cis_pci_mapping.TokenManager(fetch_token)
+    threads = [threading.Thread(target=manager.get_token) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+
+def test_request_retried_once_after_401():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ExpiringTokenHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    config = cis_pci_mapping.ConfigHelper()
+    config.halo_api_hostname = "http://127.0.0.1"
+    config.halo_api_port = str(server.server_port)
+    halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(config)
+    try:
+        assert halo_api_caller_obj.authenticate_client() == "token-1"
+        ExpiringTokenHandler.issued_tokens.append("token-revoked")
+        csm_plc_det = halo_api_caller_obj.get_configuration_policy_details("p1")
+        assert csm_plc_det == ({'policy': {'name': 'Source', 'rules': []}}, False)
+        assert ExpiringTokenHandler.issued_tokens == ["token-1", "token-revoked", "token-3"]
+    finally:
+        halo_api_caller_obj.http_session.clear()
+        server.shutdown()
+        server.server_close()
+
+
+def test_credentials_work_needs_a_token():
+    closed_socket = socket.socket()
+    closed_socket.bind(("127.0.0.1", 0))
+    closed_port = closed_socket.getsockname()[1]
+    closed_socket.close()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RejectingAuthHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        for port in (closed_port, server.server_port):
+            config = cis_pci_mapping.ConfigHelper()
+            config.halo_api_hostname = "http://127.0.0.1"
+            config.halo_api_port = str(port)
+            config.halo_api_retries = "0"
+            halo_api_caller_obj = cis_pci_mapping.HaloAPICaller(config)
+            assert halo_api_caller_obj.credentials_work() is False
+    finally:
+        server.shutdown()
+        server.server_close()